@@ -0,0 +1,184 @@
+"""Record and replay of the interactions with github
+
+`RecordingTransport` saves all requests and responses to a cassette file and
+`ReplayTransport` serves them back without network access, which allows to run
+and time dothub commands reproducibly.
+
+Cassettes use the betamax format, so the ones in tests/integration/cassettes can
+be replayed as well.
+"""
+import base64
+import collections
+import datetime
+import json
+import logging
+import threading
+import time
+import zlib
+
+import requests
+from requests.compat import urlparse, urlencode
+from six.moves.urllib.parse import parse_qsl
+from requests.structures import CaseInsensitiveDict
+
+from . import github_helper
+from ._version import __version__
+
+# Headers not kept in the cassette as the body is stored decoded
+DROPPED_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+# Query params ignored when matching requests, so changes in the page size
+# do not invalidate cassettes
+IGNORED_PARAMS = {"per_page"}
+SCRUBBED_TOKEN = "<TOKEN>"
+LOG = logging.getLogger(__name__)
+
+
+def _request_key(method, url):
+    """Key used to match a request with the recorded interactions"""
+    parsed = urlparse(url)
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query) if k not in IGNORED_PARAMS)
+    return method.upper(), parsed._replace(query=urlencode(query)).geturl()
+
+
+class RecordingTransport(object):
+    """Transport that records all the interactions sent through another transport
+
+    Credentials are never stored: the authorization is not recorded and any
+    appearance of the token in urls or bodies is replaced.
+    """
+
+    def __init__(self, path, transport=None):
+        """Creates a recording transport
+
+        :param path: file to save the cassette to
+        :param transport: transport to send the requests, a default one if None
+        :type transport: dothub.github_helper.Transport
+        """
+        self.path = path
+        self._transport = transport or github_helper.Transport()
+        self._interactions = []
+        self._tokens = set()
+        self._lock = threading.Lock()
+
+    def send(self, method, url, **kwargs):
+        """Sends a request through the wrapped transport recording it"""
+        auth = kwargs.get("auth")
+        if auth:
+            self._tokens.add(auth[1])
+        start = time.time()
+        response = self._transport.send(method, url, **kwargs)
+        elapsed = time.time() - start
+        if "json" in kwargs:
+            body = json.dumps(kwargs["json"])
+        else:
+            body = kwargs.get("data") or ""
+            if isinstance(body, bytes):
+                body = body.decode("utf-8")
+        interaction = dict(
+            recorded_at=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+            elapsed=elapsed,
+            request=dict(
+                method=method.upper(),
+                uri=url,
+                headers={},
+                body=dict(encoding="utf-8", string=body),
+            ),
+            response=dict(
+                url=response.url,
+                status=dict(code=response.status_code, message=response.reason),
+                headers={k: [v] for k, v in response.headers.items()
+                         if k.lower() not in DROPPED_HEADERS},
+                body=dict(encoding="utf-8", string=response.text),
+            ),
+        )
+        with self._lock:
+            self._interactions.append(interaction)
+        return response
+
+    def _scrub(self, text):
+        for token in self._tokens:
+            text = text.replace(token, SCRUBBED_TOKEN)
+        return text
+
+    def save(self):
+        """Writes all interactions recorded so far to the cassette"""
+        with self._lock:
+            cassette = dict(
+                http_interactions=list(self._interactions),
+                recorded_with="dothub/{}".format(__version__),
+            )
+        data = self._scrub(json.dumps(cassette, indent=2, sort_keys=True))
+        with open(self.path, "w") as f:
+            f.write(data)
+        LOG.info("%d interactions recorded in %s", len(cassette["http_interactions"]),
+                 self.path)
+
+
+class ReplayTransport(object):
+    """Transport that serves the responses recorded in a cassette
+
+    Requests are matched by method and url (ignoring the page size). When the same
+    request was recorded multiple times the responses are served in order, and the
+    last one is repeated once exhausted.
+    """
+
+    def __init__(self, path, latency=0, sleep=time.sleep):
+        """Loads a cassette to replay
+
+        :param path: cassette file to replay
+        :param latency: seconds to wait before returning each response, to simulate
+         the network
+        :param sleep: function to wait for a number of seconds
+        """
+        self.latency = latency
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(collections.deque)
+        with open(path) as f:
+            cassette = json.load(f)
+        for interaction in cassette["http_interactions"]:
+            request = interaction["request"]
+            key = _request_key(request["method"], request["uri"])
+            self._responses[key].append(interaction["response"])
+
+    def send(self, method, url, **_):
+        """Returns the recorded response for a request
+
+        :raises RuntimeError: if the request was not recorded
+        """
+        key = _request_key(method, url)
+        with self._lock:
+            recorded = self._responses.get(key)
+            if not recorded:
+                raise RuntimeError("No recorded interaction for {} {}".format(method, url))
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.latency:
+            self._sleep(self.latency)
+        return _build_response(interaction, url)
+
+
+def _build_response(recorded, url):
+    """Builds a requests.Response from a recorded response"""
+    headers = CaseInsensitiveDict({
+        k: ", ".join(v) if isinstance(v, list) else v
+        for k, v in recorded["headers"].items()
+    })
+    body = recorded["body"]
+    encoding = body.get("encoding") or "utf-8"
+    if "base64_string" in body:
+        content = base64.b64decode(body["base64_string"])
+        if headers.get("Content-Encoding") == "gzip" and content:
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    else:
+        content = body.get("string", "").encode(encoding)
+    for header in DROPPED_HEADERS:
+        headers.pop(header, None)
+
+    response = requests.Response()
+    response.status_code = recorded["status"]["code"]
+    response.reason = recorded["status"]["message"]
+    response.headers = headers
+    response.url = recorded.get("url") or url
+    response.encoding = encoding
+    response._content = content
+    return response
@@ -1,19 +1,44 @@
 """Functions for the command line interface"""
 
+import json
 import logging
+import os.path
+from collections import namedtuple
+from concurrent import futures
+
 import click
 import fnmatch
 from dothub import github_helper
+from dothub import cassette
+from dothub import codec
+from dothub import graphql
+from dothub import metrics
 from dothub import utils
 from dothub.organization import Organization
+from dothub.plan import Plan, PlanError
 from dothub.repository import Repo
-from dothub.config import config_wizard, DEFAULT_API_URL
+from dothub.http_cache import HttpCache
+from dothub.config import config_wizard, DEFAULT_API_URL, APP_DIR
 
 REPO_CONFIG_FILE = ".dothub.repo.yml"
 ORG_CONFIG_FILE = ".dothub.org.yml"
 ORG_REPOS_CONFIG_FILE = ".dothub.org.repos.yml"
+HTTP_CACHE_DIR = os.path.join(APP_DIR, "http_cache")
+# Estimation of the requests needed to describe and update a repo in bulk updates
+REPO_UPDATE_COST = 10
 LOG = logging.getLogger(__name__)
 
+# Outcome of the update of a repo in a bulk push, status is one of
+# unchanged, updated, skipped or failed
+RepoResult = namedtuple("RepoResult", "name status reason")
+
+
+def _non_negative(ctx, param, value):
+    """Validates numeric options that cannot be negative"""
+    if value < 0:
+        raise click.BadParameter("{} is smaller than the minimum valid value 0.".format(value))
+    return value
+
 
 @click.group()
 @click.option("--user", help="GitHub user to use", envvar="GITHUB_USER", required=True)
@@ -22,15 +47,96 @@ LOG = logging.getLogger(__name__)
               envvar="GITHUB_API_URL", default=DEFAULT_API_URL)
 @click.option("--verbosity", help="verbosity of the log",
               default="INFO", type=click.Choice(["ERROR", "INFO", "DEBUG"]))
+@click.option("--http_cache/--no_http_cache", default=True,
+              help="Reuse responses stored in {} via conditional requests".format(HTTP_CACHE_DIR))
+@click.option("--max_retries", help="Times to resend requests that failed transiently",
+              default=3, type=int)
+@click.option("--max_workers", help="Max number of requests to send concurrently",
+              default=github_helper.DEFAULT_MAX_WORKERS, type=click.IntRange(1))
+@click.option("--adaptive_concurrency/--fixed_concurrency", default=True,
+              help="Adapt the reads sent concurrently (up to --max_workers) to the load "
+                   "github can take")
+@click.option("--write_interval", default=github_helper.DEFAULT_WRITE_INTERVAL,
+              type=float, callback=_non_negative,
+              help="Min seconds between writes, to stay within the secondary rate limits")
+@click.option("--max_concurrent_writes", default=github_helper.DEFAULT_MAX_CONCURRENT_WRITES,
+              type=click.IntRange(1), help="Max number of writes to send concurrently")
+@click.option("--graphql/--no_graphql", default=False,
+              help="Retrieve organization members and teams through the GraphQL api")
+@click.option("--stats", is_flag=True, help="Print a summary of the requests sent at exit")
+@click.option("--stats_file", type=click.Path(dir_okay=False, writable=True),
+              help="Write the summary of the requests sent as json to a file at exit")
+@click.option("--record", type=click.Path(dir_okay=False, writable=True),
+              help="Record all requests and responses to a cassette file")
+@click.option("--replay", type=click.Path(exists=True, dir_okay=False),
+              help="Serve the responses from a cassette file instead of github")
+@click.option("--replay_latency", default=0.0, type=float,
+              callback=_non_negative,
+              help="Seconds to wait on each replayed response to simulate the network")
+@click.option("--json_codec", type=click.Choice(sorted(codec.CODECS)),
+              help="Library to encode and decode json, the fastest one installed by default. "
+                   "orjson only speeds up encoding and the decoding of whole responses, "
+                   "resources retrieved with only some of their fields are always "
+                   "decoded with json")
 @click.pass_context
-def dothub(ctx, user, token, github_base_url, verbosity):
+def dothub(ctx, user, token, github_base_url, verbosity, http_cache, max_retries, max_workers,
+           adaptive_concurrency, write_interval, max_concurrent_writes, graphql, stats,
+           stats_file, record, replay, replay_latency, json_codec):
     """Configure github as code!
 
     Stop using the keyboard like a mere human and store your github config in a file"""
     logging.getLogger().setLevel(getattr(logging, verbosity))
 
-    gh = github_helper.GitHub(user, token, github_base_url)
+    if record and replay:
+        raise click.UsageError("--record and --replay cannot be used together")
+    # Reads in flight are limited to max_workers and writes to max_concurrent_writes
+    transport = github_helper.Transport(pool_size=max_workers + max_concurrent_writes)
+    if replay:
+        transport = cassette.ReplayTransport(replay, latency=replay_latency)
+    elif record:
+        transport = cassette.RecordingTransport(record, transport)
+        ctx.call_on_close(transport.save)
+    # Conditional requests would make the cassettes depend on the local cache
+    cache = HttpCache(HTTP_CACHE_DIR) if http_cache and not (record or replay) else None
+    retry_policy = github_helper.RetryPolicy(max_retries=max_retries)
+    try:
+        json_codec = codec.get_codec(json_codec)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--json_codec")
+    read_cache = github_helper.ReadCache()
+    write_pacer = github_helper.WritePacer(write_interval, max_concurrent_writes)
+    if adaptive_concurrency:
+        read_concurrency = github_helper.AdaptiveConcurrency(max_workers)
+    else:
+        read_concurrency = github_helper.AdaptiveConcurrency(
+            max_workers, initial=max_workers, min_limit=max_workers)
+    request_metrics = metrics.RequestMetrics() if stats or stats_file else None
+    gh = github_helper.GitHub(user, token, github_base_url, cache=cache,
+                              retry_policy=retry_policy, transport=transport,
+                              read_cache=read_cache, metrics=request_metrics,
+                              codec=json_codec, write_pacer=write_pacer,
+                              read_concurrency=read_concurrency)
+    ctx.call_on_close(lambda: LOG.debug("Read cache: %d hits, %d misses",
+                                        read_cache.hits, read_cache.misses))
+    if request_metrics:
+        ctx.call_on_close(lambda: _report_stats(gh, stats, stats_file))
+    ctx.call_on_close(gh.close)
     ctx.obj['github'] = gh
+    ctx.obj['max_workers'] = max_workers
+    ctx.obj['graphql'] = graphql
+
+
+def _report_stats(gh, stats, stats_file):
+    """Prints and/or saves the summary of the requests sent"""
+    summary = gh.metrics.summary()
+    summary["read_cache"] = dict(hits=gh.read_cache.hits, misses=gh.read_cache.misses)
+    if gh.read_concurrency:
+        summary["concurrency"] = gh.read_concurrency.history
+    if stats:
+        click.echo(metrics.format_summary(summary), err=True)
+    if stats_file:
+        with open(stats_file, "w") as f:
+            json.dump(summary, f, indent=4)
 
 
 @dothub.command()
@@ -53,15 +159,16 @@ def pull(ctx, target, file_):
     The config will be stored in YAML in `.dothub.repo/org.yml
     """
     gh = ctx.obj['github']
+    max_workers = ctx.obj['max_workers']
     org_name, repo_name = utils.split_org_repo(target)
-    org = Organization(gh, org_name)
+    org = Organization(gh, org_name, max_workers, ctx.obj['graphql'])
 
     if not repo_name:
         file_ = file_ or ORG_CONFIG_FILE
         LOG.info("Pulling '{}' into '{}'".format(org_name, file_))
         _pull_org(org, file_)
     else:
-        repo = Repo(gh, org_name, repo_name)
+        repo = Repo(gh, org_name, repo_name, max_workers)
         file_ = file_ or REPO_CONFIG_FILE
         LOG.info("Pulling '{}/{}' into '{}'".format(org_name, repo_name, file_))
         _pull_repo(repo, file_)
@@ -80,8 +187,10 @@ def pull(ctx, target, file_):
     By default {} is used instead of {}
     """.format(ORG_REPOS_CONFIG_FILE, REPO_CONFIG_FILE),
 )
+@click.option("--jobs", default=1, type=click.IntRange(1),
+              help="Number of repositories to update concurrently with --bulk")
 @click.pass_context
-def push(ctx, target, file_, bulk):
+def push(ctx, target, file_, bulk, jobs):
     """Push configuration from local files to github
 
     `dothub push organization/repository` will update the repository.
@@ -91,25 +200,105 @@ def push(ctx, target, file_, bulk):
     The config is retrieved by default from the same files used in pull
     """
     gh = ctx.obj['github']
+    max_workers = ctx.obj['max_workers']
     org_name, repo_name = utils.split_org_repo(target)
 
     if bulk:
-        org = Organization(gh, org_name)
+        org = Organization(gh, org_name, max_workers, ctx.obj['graphql'])
         file_ = file_ or ORG_REPOS_CONFIG_FILE
         LOG.info("Pushing config '{}' to multiple repos: '{}'".format(file_, target ))
-        _update_all_repos(gh, org, file_, repo_name)
+        _report_repo_results(_update_all_repos(gh, org, file_, repo_name, jobs))
     elif not repo_name:
-        org = Organization(gh, org_name)
+        org = Organization(gh, org_name, max_workers, ctx.obj['graphql'])
         file_ = file_ or ORG_CONFIG_FILE
         LOG.info("Pushing '{}' into '{}'".format(file_, org_name))
-        _push_repo(org, file_)
+        _push_org(org, file_)
     else:
-        repo = Repo(gh, org_name, repo_name)
+        repo = Repo(gh, org_name, repo_name, max_workers)
         file_ = file_ or REPO_CONFIG_FILE
         LOG.info("Pushing '{}' to '{}'".format(file_, target))
         _push_repo(repo, file_)
 
 
+@dothub.command("plan")
+@click.argument("target", required=True)
+@click.argument("file_", required=False)
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True),
+              help="Save the plan to a file to apply it later on through `dothub apply`")
+@click.pass_context
+def plan_command(ctx, target, file_, output):
+    """Shows the changes push would send, without sending them
+
+    `dothub plan organization/repository -o plan.json` computes the changes for the
+    repository and saves them to plan.json.
+
+    The config is retrieved by default from the same files used in pull. Organizations
+    are always read through the REST api, so all the resources read can be validated
+    when the plan is applied.
+    """
+    gh = ctx.obj['github']
+    model, default_file = _target_model(ctx, target, use_graphql=False)
+    file_ = file_ or default_file
+    new_config = utils.load_yaml(file_)
+    # Only the sections to update are retrieved, so the plan is not rejected as
+    # stale because of changes in the rest of the configuration
+    gh.record_validators()
+    current_config = model.describe([s for s in model.SECTIONS if s in new_config])
+    plan = model.plan(current_config, new_config)
+    plan.target = target
+    plan.validators = gh.validators
+    if not plan:
+        LOG.info("'{}' is up to date with '{}'".format(target, file_))
+    for mutation in plan:
+        click.echo("{} {} ({})".format(mutation.method.upper(), mutation.url, mutation))
+    if output:
+        plan.save(output)
+        LOG.info("Plan with %d changes saved to '%s'", len(plan), output)
+
+
+@dothub.command("apply")
+@click.argument("plan_file", type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def apply_command(ctx, plan_file):
+    """Applies a plan saved through `dothub plan`
+
+    The plan is rejected if any of the resources it was computed from changed since.
+    """
+    gh = ctx.obj['github']
+    try:
+        plan = Plan.load(plan_file)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="PLAN_FILE")
+    stale = plan.stale_resources(gh, ctx.obj['max_workers'])
+    if stale:
+        raise click.ClickException(
+            "The plan is stale, these resources changed after it was computed:\n{}"
+            .format("\n".join(stale)))
+    model, _ = _target_model(ctx, plan.target)
+    LOG.info("Applying %d changes to '%s'", len(plan), plan.target)
+    _apply_plan(model, plan)
+
+
+def _apply_plan(model, plan):
+    """Applies a plan reporting the changes that failed"""
+    try:
+        model.apply(plan)
+    except PlanError as error:
+        raise click.ClickException(str(error))
+
+
+def _target_model(ctx, target, use_graphql=None):
+    """Returns the repo or organization a target refers to and its default config file"""
+    if use_graphql is None:
+        use_graphql = ctx.obj['graphql']
+    gh = ctx.obj['github']
+    max_workers = ctx.obj['max_workers']
+    org_name, repo_name = utils.split_org_repo(target)
+    if repo_name:
+        return Repo(gh, org_name, repo_name, max_workers), REPO_CONFIG_FILE
+    return Organization(gh, org_name, max_workers, use_graphql), ORG_CONFIG_FILE
+
+
 def _pull_repo(repo, output_file):
     """Retrieve the repository config locally"""
     repo_config = repo.describe()
@@ -121,8 +310,9 @@ def _push_repo(repo, input_file):
     """Update the repository config in github"""
     new_config = utils.load_yaml(input_file)
     current_config = repo.describe()
-    if utils.confirm_changes(current_config, new_config, abort=True):
-        repo.update(new_config)
+    plan = repo.plan(current_config, new_config)
+    if utils.confirm_changes(current_config, new_config, abort=True, plan=plan):
+        _apply_plan(repo, plan)
 
 
 def _pull_org(org, output_file):
@@ -136,43 +326,157 @@ def _push_org(org, input_file):
     """Update the organization config in github"""
     new_config = utils.load_yaml(input_file)
     current_config = org.describe()
-    if utils.confirm_changes(current_config, new_config, abort=True):
-        org.update(new_config)
+    plan = org.plan(current_config, new_config)
+    if utils.confirm_changes(current_config, new_config, abort=True, plan=plan):
+        _apply_plan(org, plan)
 
 
-def _update_all_repos(gh, org, input_file, repo_filter=None):
+def _update_all_repos(gh, org, input_file, repo_filter=None, jobs=1):
     """Updates all repos of an org with the specified repo config
 
     This will iterate over all repos in the org and update them with the template provided
     "Repo specific fields" will be ignored if presents in the repo file
 
     If a repo filter is provided the name of the repo have to match with that
+
+    If the org uses GraphQL, the current config of all repos is retrieved in batches
+
+    The changes needed by each repo are computed first and shown together, grouping
+    the repos that need the same changes, to confirm all of them at once.
+
+    With multiple jobs, that many repos are described and updated concurrently
+    through the same github helper, so they share its connection pool and rate
+    limit budget.
+
+    :return: list of `RepoResult` sorted by repo name
     """
     ignored_options = ["name", "description", "homepage"]
 
     new_config = utils.load_yaml(input_file)
-    if any(_ in new_config["options"] for _ in ignored_options):
+    new_options = new_config.get("options", {})
+    if any(_ in new_options for _ in ignored_options):
         message = ("{} keys wont be updated but they are present in {}.\n"
                    "Continue anyway?".format(ignored_options, input_file))
         click.confirm(message, abort=True, default=True)
 
     for field in ignored_options:
-        new_config["options"].pop(field, None)
+        new_options.pop(field, None)
 
+    repo_names = []
     for repo_name in org.repos:
         if repo_filter and not fnmatch.fnmatch(repo_name, repo_filter):
             LOG.info("Skipping '{}/{}'".format(org.name, repo_name))
             continue
-        LOG.info("Updating %s", repo_name)
-        r = Repo(gh, org.name, repo_name)
-        current_config = r.describe()
-        for field in set(ignored_options) - {"name"}:
-            current_config["options"].pop(field, None)
-        new_config["options"]["name"] = repo_name
-        if utils.confirm_changes(current_config, new_config):
-            r.update(new_config)
+        repo_names.append(repo_name)
+
+    current_configs = dict()
+    if org.use_graphql:
+        sections = [section for section in Repo.SECTIONS if section in new_config]
+        current_configs = graphql.describe_org_repositories(gh, org.name, repo_names, sections,
+                                                            max_workers=org.max_workers)
+
+    max_workers = max(org.max_workers // jobs, 1)
+    results = dict()
+
+    def plan_repo(repo_name):
+        """Computes the changes a repo needs, returns the repo and its plan"""
+        # Wait for the rate limit to reset rather than failing halfway through the repo
+        gh.rate_limiter.wait(cost=REPO_UPDATE_COST)
+        LOG.info("Checking %s", repo_name)
+        if gh.rate_limit:
+            LOG.debug("Rate limit budget: %d requests left", gh.rate_limit.remaining)
+        r = Repo(gh, org.name, repo_name, max_workers)
+        try:
+            current_config = current_configs.get(repo_name) or r.describe()
+            repo_config = dict(new_config)
+            if "options" in new_config:
+                for field in set(ignored_options) - {"name"}:
+                    current_config["options"].pop(field, None)
+                repo_config["options"] = dict(new_options, name=repo_name)
+            return r, r.plan(current_config, repo_config)
+        except Exception as error:
+            results[repo_name] = _failed_result(repo_name, error)
+            return r, None
+
+    def apply_repo(repo, plan):
+        """Applies the plan of a repo, returns its `RepoResult`"""
+        LOG.info("Updating %s", repo.repository)
+        try:
+            repo.apply(plan)
+        except Exception as error:
+            return _failed_result(repo.repository, error)
+        return RepoResult(repo.repository, "updated", None)
+
+    with futures.ThreadPoolExecutor(jobs) as executor:
+        plans = [(repo, plan) for repo, plan in executor.map(plan_repo, repo_names)
+                 if plan is not None]
+        for repo, plan in plans:
+            if not plan:
+                results[repo.repository] = RepoResult(repo.repository, "unchanged", None)
+        plans = [(repo, plan) for repo, plan in plans if plan]
+
+        if plans:
+            click.echo(_format_bulk_changes(plans))
+        if plans and click.confirm("Apply the changes to {} repos?".format(len(plans)),
+                                   default=True):
+            for result in executor.map(lambda args: apply_repo(*args), plans):
+                results[result.name] = result
+        else:
+            for repo, _ in plans:
+                results[repo.repository] = RepoResult(repo.repository, "skipped",
+                                                      "changes not confirmed")
 
     LOG.info("All repos in %s processed", org.name)
+    return [results[name] for name in sorted(results)]
+
+
+def _failed_result(repo_name, error):
+    LOG.debug("Failed to update %s", repo_name, exc_info=True)
+    reason = str(error) or type(error).__name__
+    return RepoResult(repo_name, "failed", reason.splitlines()[0])
+
+
+def _plan_signature(plan):
+    """Key to group the plans that perform the same changes on different repos"""
+    signature = []
+    for mutation in plan:
+        payload = mutation.payload
+        if mutation.section == "options" and payload:
+            # The name of each repo is set in its options
+            payload = {k: v for k, v in payload.items() if k != "name"}
+        signature.append((str(mutation), json.dumps(payload, sort_keys=True)))
+    return tuple(sorted(signature))
+
+
+def _format_bulk_changes(plans):
+    """Formats the changes of multiple repos, grouping the repos with the same changes
+
+    :param plans: list of tuples of repo and its plan
+    """
+    groups = dict()
+    for repo, plan in plans:
+        groups.setdefault(_plan_signature(plan), []).append(repo.repository)
+    lines = []
+    for signature, names in sorted(groups.items(), key=lambda item: sorted(item[1])):
+        names = sorted(names)
+        lines.append("{} repo{}: {}".format(len(names), "s" if len(names) > 1 else "",
+                                            ", ".join(names)))
+        lines.extend("  {}".format(description) for description, _ in signature)
+    return "\n".join(lines)
+
+
+def _report_repo_results(results):
+    """Prints the outcome of the update of each repo of a bulk push
+
+    :raises click.ClickException: if any of the repos failed to be updated
+    """
+    for result in results:
+        line = "{}: {}".format(result.name, result.status)
+        click.echo(line + (" ({})".format(result.reason) if result.reason else ""))
+    failed = [result for result in results if result.status == "failed"]
+    if failed:
+        raise click.ClickException("{} of {} repos failed to be updated"
+                                   .format(len(failed), len(results)))
 
 
 # OLD DEPRECATED FUNCTIONS
@@ -200,7 +504,7 @@ def repo(ctx, owner, repository):
         )
 
     gh = ctx.obj['github']
-    ctx.obj['repository'] = Repo(gh, owner, repository)
+    ctx.obj['repository'] = Repo(gh, owner, repository, ctx.obj['max_workers'])
 
 
 @repo.command("pull")
@@ -229,7 +533,8 @@ def org(ctx, name):
         ws_owner, ws_repo = ws_repo_info
         name = name or ws_owner
     gh = ctx.obj['github']
-    ctx.obj['organization'] = Organization(gh, name)
+    ctx.obj['organization'] = Organization(gh, name, ctx.obj['max_workers'],
+                                           ctx.obj['graphql'])
 
 
 @org.command("pull")
@@ -259,5 +564,4 @@ def repos(ctx, input_file):
     """
     gh = ctx.obj['github']
     o = ctx.obj['organization']
-    new_config = utils.load_yaml(input_file)
-    _update_all_repos(gh, o, new_config)
+    _report_repo_results(_update_all_repos(gh, o, input_file))
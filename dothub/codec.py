@@ -0,0 +1,157 @@
+"""Encoding and decoding of the json documents exchanged with github
+
+Most github resources have dozens of fields (a repository has ~90, including
+nested objects like the owner) while dothub only uses a few of them.
+`loads_masked` decodes the objects of a listing one at a time and only keeps the
+fields requested, so the memory used by a listing scales with the fields used
+rather than with the size of the page. Each object is still decoded by the C
+scanner of the json module, which is faster than skipping the fields unused
+from Python.
+
+The codecs take the raw bytes of the responses. `JsonCodec` decodes them to
+text before parsing them, as the json module requires. `OrjsonCodec` uses
+orjson, which parses the bytes directly and is several times faster than the
+json module, and is the default when installed. It is only used to decode
+whole documents and to encode, masked decodes (all the listings and resources
+retrieved through `get`) still go through `loads_masked` to keep the memory
+bounded on large listings.
+"""
+import json
+from json.decoder import WHITESPACE
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Scanner of json values, the C implementation if available
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _skip_whitespace(text, index):
+    return WHITESPACE.match(text, index).end()
+
+
+def _expect(text, index, char):
+    if text[index] != char:
+        raise ValueError("Expecting '{}' at position {}".format(char, index))
+    return _skip_whitespace(text, index + 1)
+
+
+def _scan(text, index):
+    """Decodes the value at index
+
+    :return: a tuple of the value and the index where it ends
+    """
+    try:
+        return _scan_once(text, index)
+    except StopIteration:
+        raise ValueError("Expecting value at position {}".format(index))
+
+
+def _scan_masked(text, index, fields):
+    """Decodes the value at index keeping only the fields if it is an object
+
+    :return: a tuple of the value and the index where it ends
+    """
+    value, index = _scan(text, index)
+    if isinstance(value, dict):
+        value = {key: value[key] for key in fields if key in value}
+    return value, index
+
+
+def loads_masked(text, fields):
+    """Decodes a json document only keeping some fields of the top level objects
+
+    If the document is a list the mask is applied to each of its objects.
+    loads_masked('[{"a": 1, "b": 2}]', ["a"]) -> [{"a": 1}]
+
+    :param text: json document to decode
+    :param fields: fields to keep
+    :raises ValueError: if the document is not valid json
+    :return: the decoded document with the mask applied
+    """
+    fields = frozenset(fields)
+    try:
+        index = _skip_whitespace(text, 0)
+        if text[index] == "[":
+            result = []
+            index = _skip_whitespace(text, index + 1)
+            done = text[index] == "]"
+            while not done:
+                item, index = _scan_masked(text, index, fields)
+                result.append(item)
+                index = _skip_whitespace(text, index)
+                done = text[index] == "]"
+                if not done:
+                    index = _expect(text, index, ",")
+            index += 1
+        else:
+            result, index = _scan_masked(text, index, fields)
+    except IndexError:
+        raise ValueError("Unexpected end of the json document")
+    if _skip_whitespace(text, index) != len(text):
+        raise ValueError("Extra data at position {}".format(index))
+    return result
+
+
+class JsonCodec(object):
+    """Encodes and decodes json through the json module of the standard library"""
+
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        """Decodes a json document given as bytes or text"""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+    @staticmethod
+    def loads_masked(data, fields):
+        """Decodes a json document as `loads_masked` does, given as bytes or text"""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return loads_masked(data, fields)
+
+    @staticmethod
+    def dumps(obj):
+        """Encodes an object as json bytes"""
+        return json.dumps(obj).encode("utf-8")
+
+
+class OrjsonCodec(JsonCodec):
+    """Encodes and decodes json through orjson
+
+    orjson does not support incremental decoding, so `loads_masked` is
+    inherited from `JsonCodec` rather than decoding the whole document.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec)}
+
+
+def get_codec(name=None):
+    """Returns an instance of a codec given its name, the fastest one available if None
+
+    :raises ValueError: if the codec is unknown or its library is not installed
+    """
+    if name is None:
+        name = "orjson" if orjson else "json"
+    if name not in CODECS:
+        raise ValueError("Unknown json codec '{}'".format(name))
+    return CODECS[name]()
@@ -0,0 +1,648 @@
+"""Local stand-in of the github REST api to benchmark dothub at scale
+
+`generate_org` builds a synthetic organization with the requested number of
+repositories, teams and members, and `FakeGitHub` serves it through the REST
+endpoints used by dothub. Listings are paginated, responses carry ETags and the
+rate limit headers, and a latency can be added to each response to emulate the
+network.
+
+The server can run in process::
+
+    with FakeGitHubServer(FakeGitHub(generate_org(repos=500))) as server:
+        gh = GitHub("user", "token", api_url=server.url)
+
+Or as a subprocess: `python -m dothub.fake_github --repos 500 --port 8000`
+
+GraphQL is not supported, only the REST api.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+import click
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+# Page size used by github when none is requested and the max allowed
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+DEFAULT_RATE_LIMIT = 5000
+RATE_LIMIT_WINDOW = 3600
+PERMISSION_FLAGS = {
+    "admin": dict(admin=True, push=True, pull=True),
+    "push": dict(admin=False, push=True, pull=True),
+    "pull": dict(admin=False, push=False, pull=True),
+}
+LABEL_NAMES = ["bug", "duplicate", "enhancement", "help wanted", "invalid", "question",
+               "wontfix"]
+LOG = logging.getLogger(__name__)
+
+
+class FakeOrg(object):
+    """State of an organization served by the fake github
+
+    All sections are plain dicts that can be inspected and modified directly.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.options = dict(name=name, company=None, email=None, location=None,
+                            description="", billing_email="billing@example.com")
+        self.members = dict()  # login -> role
+        self.teams = dict()  # id -> team (with "members" and "repos")
+        self.hooks = dict()  # id -> hook
+        self.repos = dict()  # name -> dict with options, labels, collaborators and hooks
+        self._ids = itertools.count(1)
+
+    def next_id(self):
+        """Returns an id not used before in the org"""
+        return next(self._ids)
+
+    def add_repo(self, name, **options):
+        """Adds a repository with default options"""
+        repo_options = dict(name=name, description="", homepage=None, private=False,
+                            has_issues=True, has_wiki=True, has_downloads=True,
+                            allow_rebase_merge=True, allow_squash_merge=True,
+                            allow_merge_commit=True, fork=False)
+        repo_options.update(options)
+        self.repos[name] = dict(id=self.next_id(), options=repo_options, labels=dict(),
+                                collaborators=dict(), hooks=dict())
+        return self.repos[name]
+
+    def add_team(self, name, **fields):
+        """Adds a team without members nor repositories"""
+        team = dict(id=self.next_id(), name=name, slug=_slugify(name), description="",
+                    privacy="secret", permission="pull", members=dict(), repos=dict())
+        team.update(fields)
+        self.teams[team["id"]] = team
+        return team
+
+    def add_hook(self, hooks, **fields):
+        """Adds a hook to the dict of hooks passed in"""
+        hook = dict(id=self.next_id(), name="web", events=["push"], active=True,
+                    config=dict(url="https://example.com/hook", content_type="json"))
+        hook.update(fields)
+        hooks[hook["id"]] = hook
+        return hook
+
+
+def generate_org(name="fake-org", repos=10, teams=3, members=20, labels=3, collaborators=2,
+                 hooks=1, seed=0):
+    """Generates an organization with synthetic data
+
+    :param name: name of the organization
+    :param repos: number of repositories
+    :param teams: number of teams, each with a sample of the members and repos
+    :param members: number of members of the organization
+    :param labels: labels per repository
+    :param collaborators: outside collaborators per repository
+    :param hooks: hooks per repository and in the organization
+    :param seed: seed of the random generator, the same seed generates the same org
+    :rtype: FakeOrg
+    """
+    rnd = random.Random(seed)
+    org = FakeOrg(name)
+    logins = ["user{}".format(i) for i in range(members)]
+    for login in logins:
+        org.members[login] = "admin" if rnd.random() < 0.1 else "member"
+    for i in range(hooks):
+        org.add_hook(org.hooks, config=dict(url="https://example.com/org/{}".format(i),
+                                            content_type="json"))
+
+    repo_names = ["repo{}".format(i) for i in range(repos)]
+    for repo_name in repo_names:
+        repo = org.add_repo(repo_name, description="Synthetic repo {}".format(repo_name))
+        for label in (LABEL_NAMES * (labels // len(LABEL_NAMES) + 1))[:labels]:
+            if label in repo["labels"]:
+                label = "{}-{}".format(label, len(repo["labels"]))
+            repo["labels"][label] = "{:06x}".format(rnd.randrange(0x1000000))
+        for i in range(collaborators):
+            login = "outside-{}-{}".format(repo_name, i)
+            repo["collaborators"][login] = rnd.choice(list(PERMISSION_FLAGS))
+        for i in range(hooks):
+            org.add_hook(repo["hooks"], config=dict(
+                url="https://example.com/{}/{}".format(repo_name, i), content_type="json"))
+
+    for i in range(teams):
+        team = org.add_team("Team {}".format(i), description="Synthetic team {}".format(i))
+        for login in rnd.sample(logins, min(len(logins), max(1, members // max(teams, 1)))):
+            team["members"][login] = "maintainer" if rnd.random() < 0.2 else "member"
+        for repo_name in rnd.sample(repo_names, min(len(repo_names), 10)):
+            team["repos"][repo_name] = rnd.choice(list(PERMISSION_FLAGS))
+    return org
+
+
+def _slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+class _Response(Exception):
+    """Raised by the handlers to reply early with an error"""
+
+    def __init__(self, status, message):
+        super(_Response, self).__init__(message)
+        self.status = status
+        self.payload = dict(message=message)
+
+
+class FakeGitHub(object):
+    """Application that answers github api requests given an organization
+
+    It is independent of the HTTP server, `handle` receives the parts of a request
+    and returns the parts of the response.
+    """
+
+    ROUTES = [
+        ("GET", r"/orgs/(?P<org>[^/]+)", "get_org"),
+        ("PATCH", r"/orgs/(?P<org>[^/]+)", "patch_org"),
+        ("GET", r"/orgs/(?P<org>[^/]+)/repos", "list_org_repos"),
+        ("GET", r"/orgs/(?P<org>[^/]+)/members", "list_members"),
+        ("DELETE", r"/orgs/(?P<org>[^/]+)/members/(?P<user>[^/]+)", "delete_member"),
+        ("GET", r"/orgs/(?P<org>[^/]+)/memberships/(?P<user>[^/]+)", "get_membership"),
+        ("PUT", r"/orgs/(?P<org>[^/]+)/memberships/(?P<user>[^/]+)", "put_membership"),
+        ("DELETE", r"/orgs/(?P<org>[^/]+)/memberships/(?P<user>[^/]+)", "delete_member"),
+        ("GET", r"/orgs/(?P<org>[^/]+)/teams", "list_teams"),
+        ("POST", r"/orgs/(?P<org>[^/]+)/teams", "create_team"),
+        ("GET", r"/orgs/(?P<org>[^/]+)/hooks", "list_org_hooks"),
+        ("POST", r"/orgs/(?P<org>[^/]+)/hooks", "create_org_hook"),
+        ("PATCH", r"/orgs/(?P<org>[^/]+)/hooks/(?P<hook_id>\d+)", "patch_org_hook"),
+        ("DELETE", r"/orgs/(?P<org>[^/]+)/hooks/(?P<hook_id>\d+)", "delete_org_hook"),
+        ("GET", r"/teams/(?P<team_id>\d+)", "get_team"),
+        ("PATCH", r"/teams/(?P<team_id>\d+)", "patch_team"),
+        ("DELETE", r"/teams/(?P<team_id>\d+)", "delete_team"),
+        ("GET", r"/teams/(?P<team_id>\d+)/members", "list_team_members"),
+        ("PUT", r"/teams/(?P<team_id>\d+)/members/(?P<user>[^/]+)", "put_team_membership"),
+        ("DELETE", r"/teams/(?P<team_id>\d+)/members/(?P<user>[^/]+)", "delete_team_member"),
+        ("GET", r"/teams/(?P<team_id>\d+)/memberships/(?P<user>[^/]+)", "get_team_membership"),
+        ("PUT", r"/teams/(?P<team_id>\d+)/memberships/(?P<user>[^/]+)", "put_team_membership"),
+        ("DELETE", r"/teams/(?P<team_id>\d+)/memberships/(?P<user>[^/]+)",
+         "delete_team_member"),
+        ("GET", r"/teams/(?P<team_id>\d+)/repos", "list_team_repos"),
+        ("PUT", r"/teams/(?P<team_id>\d+)/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)",
+         "put_team_repo"),
+        ("DELETE", r"/teams/(?P<team_id>\d+)/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)",
+         "delete_team_repo"),
+        ("GET", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)", "get_repo"),
+        ("PATCH", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)", "patch_repo"),
+        ("GET", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/labels", "list_labels"),
+        ("POST", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/labels", "create_label"),
+        ("PATCH", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/labels/(?P<label>[^/]+)",
+         "patch_label"),
+        ("DELETE", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/labels/(?P<label>[^/]+)",
+         "delete_label"),
+        ("GET", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/collaborators", "list_collaborators"),
+        ("PUT", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/collaborators/(?P<user>[^/]+)",
+         "put_collaborator"),
+        ("DELETE", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/collaborators/(?P<user>[^/]+)",
+         "delete_collaborator"),
+        ("GET", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/hooks", "list_repo_hooks"),
+        ("POST", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/hooks", "create_repo_hook"),
+        ("PATCH", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/hooks/(?P<hook_id>\d+)",
+         "patch_repo_hook"),
+        ("DELETE", r"/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)/hooks/(?P<hook_id>\d+)",
+         "delete_repo_hook"),
+    ]
+
+    def __init__(self, org, latency=0, rate_limit=DEFAULT_RATE_LIMIT, clock=time.time,
+                 sleep=time.sleep):
+        """Creates the application to serve an organization
+
+        :param org: organization to serve
+        :type org: FakeOrg
+        :param latency: seconds to wait before answering each request
+        :param rate_limit: requests allowed per hour
+        :param clock: function that returns the current time as a timestamp
+        :param sleep: function to wait for a number of seconds
+        """
+        self.org = org
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._remaining = rate_limit
+        self._reset = int(clock()) + RATE_LIMIT_WINDOW
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile(pattern + "/?$"), getattr(self, handler))
+                        for method, pattern, handler in self.ROUTES]
+
+    def handle(self, method, url, headers, body, base_url="http://localhost"):
+        """Answers a request
+
+        :param method: http method of the request
+        :param url: path and query of the request
+        :param headers: dict like object with the headers of the request
+        :param body: raw body of the request
+        :param base_url: url the server is reachable at, used in the Link headers
+        :return: a tuple of the status, a dict of headers and the body as bytes
+        """
+        if self.latency:
+            self._sleep(self.latency)
+        parsed = urlparse(url)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        response_headers = {"Content-Type": "application/json; charset=utf-8"}
+        with self._lock:
+            self.requests += 1
+            response_headers.update(self._consume_rate_limit())
+            try:
+                if self._remaining < 0:
+                    raise _Response(403, "API rate limit exceeded")
+                status, payload = self._dispatch(method, parsed.path, body, query)
+            except _Response as error:
+                status, payload = error.status, error.payload
+
+        if isinstance(payload, list):
+            payload, links = self._paginate(payload, parsed.path, query, base_url)
+            if links:
+                response_headers["Link"] = links
+        content = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        if method == "GET" and status == 200:
+            etag = 'W/"{}"'.format(hashlib.sha1(content).hexdigest())
+            response_headers["ETag"] = etag
+            if headers.get("If-None-Match") == etag:
+                with self._lock:  # Not modified responses are free on github
+                    self._remaining += 1
+                    response_headers["X-RateLimit-Remaining"] = str(self._remaining)
+                return 304, response_headers, b""
+        return status, response_headers, content
+
+    def _consume_rate_limit(self):
+        now = self._clock()
+        if now >= self._reset:
+            self._reset = int(now) + RATE_LIMIT_WINDOW
+            self._remaining = self.rate_limit
+        self._remaining = max(self._remaining - 1, -1)
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(max(self._remaining, 0)),
+            "X-RateLimit-Reset": str(self._reset),
+        }
+
+    def _dispatch(self, method, path, body, query):
+        path = path.rstrip("/") or "/"
+        allowed = False
+        for route_method, pattern, handler in self._routes:
+            match = pattern.match(path)
+            if not match:
+                continue
+            allowed = True
+            if route_method == method.upper():
+                kwargs = {k: unquote(v) for k, v in match.groupdict().items()}
+                if "org" in kwargs and kwargs.pop("org") != self.org.name:
+                    raise _Response(404, "Not Found")
+                # Gets have no body, their handlers get the query instead
+                payload = json.loads(body.decode("utf-8")) if body else dict(query)
+                return handler(payload, **kwargs)
+        if allowed:
+            raise _Response(405, "Method not allowed")
+        raise _Response(404, "Not Found")
+
+    @staticmethod
+    def _paginate(items, path, query, base_url):
+        """Returns the page of the items requested and the Link header"""
+        per_page = min(int(query.get("per_page", DEFAULT_PER_PAGE)), MAX_PER_PAGE)
+        page = max(int(query.get("page", 1)), 1)
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        links = []
+
+        def link(number, rel):
+            params = dict(query, per_page=per_page, page=number)
+            links.append('<{}{}?{}>; rel="{}"'.format(base_url, path,
+                                                      urlencode(sorted(params.items())), rel))
+
+        if page < last:
+            link(page + 1, "next")
+            link(last, "last")
+        if page > 1:
+            link(1, "first")
+            link(page - 1, "prev")
+        return items[(page - 1) * per_page:page * per_page], ", ".join(links)
+
+    # ###############
+    # REPRESENTATIONS
+    # ###############
+
+    def _user(self, login):
+        return dict(login=login, id=int(hashlib.md5(login.encode("utf-8")).hexdigest()[:8], 16),
+                    url="https://api.github.com/users/{}".format(login),
+                    html_url="https://github.com/{}".format(login), type="User",
+                    site_admin=False)
+
+    def _repo(self, name):
+        repo = self.org.repos[name]
+        full_name = "{}/{}".format(self.org.name, name)
+        result = dict(
+            id=repo["id"], full_name=full_name,
+            owner=dict(self._user(self.org.name), type="Organization"),
+            url="https://api.github.com/repos/{}".format(full_name),
+            html_url="https://github.com/{}".format(full_name),
+            clone_url="https://github.com/{}.git".format(full_name),
+            default_branch="master", created_at="2017-01-01T00:00:00Z",
+        )
+        result.update(repo["options"])
+        return result
+
+    @staticmethod
+    def _team(team):
+        return {k: v for k, v in team.items() if k not in ("members", "repos")}
+
+    def _get_team(self, team_id):
+        team = self.org.teams.get(int(team_id))
+        if team is None:
+            raise _Response(404, "Not Found")
+        return team
+
+    def _get_repo(self, repo):
+        if repo not in self.org.repos:
+            raise _Response(404, "Not Found")
+        return self.org.repos[repo]
+
+    @staticmethod
+    def _filter_role(members, query):
+        """Sorted logins of the members with the role asked for in the query, if any"""
+        role = query.get("role", "all")
+        return sorted(login for login, member_role in members.items()
+                      if role in ("all", member_role))
+
+    @staticmethod
+    def _get_item(items, key):
+        if key not in items:
+            raise _Response(404, "Not Found")
+        return items[key]
+
+    # ########
+    # HANDLERS
+    # ########
+
+    def get_org(self, _):
+        return 200, dict(self.org.options, login=self.org.name)
+
+    def patch_org(self, payload):
+        self.org.options.update(payload)
+        return self.get_org(payload)
+
+    def list_org_repos(self, _):
+        return 200, [self._repo(name) for name in sorted(self.org.repos)]
+
+    def list_members(self, query):
+        members = self._filter_role(self.org.members, query)
+        return 200, [self._user(login) for login in members]
+
+    def get_membership(self, _, user):
+        role = self._get_item(self.org.members, user)
+        return 200, dict(state="active", role=role, user=self._user(user))
+
+    def put_membership(self, payload, user):
+        self.org.members[user] = payload.get("role", "member")
+        return self.get_membership(payload, user)
+
+    def delete_member(self, _, user):
+        self._get_item(self.org.members, user)
+        del self.org.members[user]
+        for team in self.org.teams.values():
+            team["members"].pop(user, None)
+        return 204, None
+
+    def list_teams(self, _):
+        return 200, [self._team(team) for _, team in sorted(self.org.teams.items())]
+
+    def create_team(self, payload):
+        if any(team["name"] == payload.get("name") for team in self.org.teams.values()):
+            raise _Response(422, "Validation Failed")
+        team = self.org.add_team(**payload)
+        return 201, self._team(team)
+
+    def get_team(self, _, team_id):
+        return 200, self._team(self._get_team(team_id))
+
+    def patch_team(self, payload, team_id):
+        self._get_team(team_id).update(payload)
+        return self.get_team(payload, team_id)
+
+    def delete_team(self, _, team_id):
+        del self.org.teams[self._get_team(team_id)["id"]]
+        return 204, None
+
+    def list_team_members(self, query, team_id):
+        members = self._filter_role(self._get_team(team_id)["members"], query)
+        return 200, [self._user(login) for login in members]
+
+    def get_team_membership(self, _, team_id, user):
+        role = self._get_item(self._get_team(team_id)["members"], user)
+        return 200, dict(state="active", role=role)
+
+    def put_team_membership(self, payload, team_id, user):
+        self._get_team(team_id)["members"][user] = payload.get("role", "member")
+        return self.get_team_membership(payload, team_id, user)
+
+    def delete_team_member(self, _, team_id, user):
+        members = self._get_team(team_id)["members"]
+        self._get_item(members, user)
+        del members[user]
+        return 204, None
+
+    def list_team_repos(self, _, team_id):
+        repos = self._get_team(team_id)["repos"]
+        return 200, [dict(self._repo(name), permissions=PERMISSION_FLAGS[permission])
+                     for name, permission in sorted(repos.items()) if name in self.org.repos]
+
+    def put_team_repo(self, payload, team_id, repo):
+        self._get_repo(repo)
+        self._get_team(team_id)["repos"][repo] = payload.get("permission", "pull")
+        return 204, None
+
+    def delete_team_repo(self, _, team_id, repo):
+        self._get_team(team_id)["repos"].pop(repo, None)
+        return 204, None
+
+    def get_repo(self, _, repo):
+        self._get_repo(repo)
+        return 200, self._repo(repo)
+
+    def patch_repo(self, payload, repo):
+        self._get_repo(repo)["options"].update(payload)
+        name = payload.get("name", repo)
+        self.org.repos[name] = self.org.repos.pop(repo)
+        return self.get_repo(payload, name)
+
+    def list_labels(self, _, repo):
+        labels = self._get_repo(repo)["labels"]
+        return 200, [dict(name=name, color=color, default=False)
+                     for name, color in sorted(labels.items())]
+
+    def create_label(self, payload, repo):
+        labels = self._get_repo(repo)["labels"]
+        if payload["name"] in labels:
+            raise _Response(422, "Validation Failed")
+        labels[payload["name"]] = payload.get("color", "ffffff")
+        return 201, dict(name=payload["name"], color=labels[payload["name"]], default=False)
+
+    def patch_label(self, payload, repo, label):
+        labels = self._get_repo(repo)["labels"]
+        color = payload.get("color", self._get_item(labels, label))
+        del labels[label]
+        name = payload.get("name", label)
+        labels[name] = color
+        return 200, dict(name=name, color=color, default=False)
+
+    def delete_label(self, _, repo, label):
+        labels = self._get_repo(repo)["labels"]
+        self._get_item(labels, label)
+        del labels[label]
+        return 204, None
+
+    def list_collaborators(self, _, repo):
+        collaborators = self._get_repo(repo)["collaborators"]
+        return 200, [dict(self._user(login), permissions=PERMISSION_FLAGS[permission])
+                     for login, permission in sorted(collaborators.items())]
+
+    def put_collaborator(self, payload, repo, user):
+        self._get_repo(repo)["collaborators"][user] = payload.get("permission", "push")
+        return 201, None
+
+    def delete_collaborator(self, _, repo, user):
+        self._get_repo(repo)["collaborators"].pop(user, None)
+        return 204, None
+
+    def _list_hooks(self, hooks):
+        return 200, [hook for _, hook in sorted(hooks.items())]
+
+    def _create_hook(self, hooks, payload):
+        return 201, self.org.add_hook(hooks, **payload)
+
+    def _patch_hook(self, hooks, payload, hook_id):
+        hook = self._get_item(hooks, int(hook_id))
+        hook.update(payload)
+        return 200, hook
+
+    def _delete_hook(self, hooks, hook_id):
+        self._get_item(hooks, int(hook_id))
+        del hooks[int(hook_id)]
+        return 204, None
+
+    def list_org_hooks(self, _):
+        return self._list_hooks(self.org.hooks)
+
+    def create_org_hook(self, payload):
+        return self._create_hook(self.org.hooks, payload)
+
+    def patch_org_hook(self, payload, hook_id):
+        return self._patch_hook(self.org.hooks, payload, hook_id)
+
+    def delete_org_hook(self, _, hook_id):
+        return self._delete_hook(self.org.hooks, hook_id)
+
+    def list_repo_hooks(self, _, repo):
+        return self._list_hooks(self._get_repo(repo)["hooks"])
+
+    def create_repo_hook(self, payload, repo):
+        return self._create_hook(self._get_repo(repo)["hooks"], payload)
+
+    def patch_repo_hook(self, payload, repo, hook_id):
+        return self._patch_hook(self._get_repo(repo)["hooks"], payload, hook_id)
+
+    def delete_repo_hook(self, _, repo, hook_id):
+        return self._delete_hook(self._get_repo(repo)["hooks"], hook_id)
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Forwards the requests received to the FakeGitHub of the server"""
+
+    protocol_version = "HTTP/1.1"  # Keep alive, as github does
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        base_url = "http://{}".format(self.headers.get("Host") or self.server.address)
+        status, headers, content = self.server.app.handle(self.command, self.path,
+                                                          self.headers, body, base_url)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, fmt, *args):
+        LOG.debug(fmt, *args)
+
+
+class FakeGitHubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server for a FakeGitHub, each request is handled in a thread
+
+    Used as a context manager it serves requests in a background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        """Creates the server, a free port is used if the port is 0
+
+        :param app: application to answer the requests
+        :type app: FakeGitHub
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _RequestHandler)
+        self.app = app
+        self._thread = None
+
+    @property
+    def address(self):
+        return "{}:{}".format(*self.server_address[:2])
+
+    @property
+    def url(self):
+        """Base url of the api, to use as api_url of dothub.github_helper.GitHub"""
+        return "http://{}".format(self.address)
+
+    def start(self):
+        """Serves the requests in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving requests and releases the port"""
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on")
+@click.option("--port", default=8000, type=int, help="Port to listen on, 0 for any free one")
+@click.option("--org", default="fake-org", help="Name of the organization")
+@click.option("--repos", default=10, type=int, help="Repositories in the organization")
+@click.option("--teams", default=3, type=int, help="Teams in the organization")
+@click.option("--members", default=20, type=int, help="Members of the organization")
+@click.option("--latency", default=0.0, type=float, help="Seconds to wait on each response")
+@click.option("--rate_limit", default=DEFAULT_RATE_LIMIT, type=int,
+              help="Requests allowed per hour")
+@click.option("--seed", default=0, type=int, help="Seed to generate the organization")
+def main(host, port, org, repos, teams, members, latency, rate_limit, seed):
+    """Serves a synthetic organization through a fake github api"""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    fake_org = generate_org(org, repos=repos, teams=teams, members=members, seed=seed)
+    server = FakeGitHubServer(FakeGitHub(fake_org, latency, rate_limit), host, port)
+    click.echo("Serving '{}' at {}".format(org, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        server.server_close()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -1,17 +1,502 @@
 """Helper to retrieve/push data from/to github"""
+import contextlib
+import hashlib
+import json
 import logging
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+
 import requests
-from requests.compat import urljoin
+from requests.adapters import HTTPAdapter
+from requests.compat import urljoin, urlparse, urlencode
+from six.moves.urllib.parse import parse_qsl
+
+from . import codec as json_codec
 
 DEFAULT_API_URL = "https://api.github.com"
+# Maximum page size allowed by the github api, used to minimize the requests on listings
+PER_PAGE = 100
+# Requests kept in reserve of the rate limit budget before waiting for it to reset
+DEFAULT_RATE_LIMIT_RESERVE = 10
+# Times a request is resent after being rejected by the rate limit
+MAX_RATE_LIMITED_RETRIES = 3
+# Methods safe to resend as they produce the same result when repeated
+IDEMPOTENT_METHODS = frozenset(["get", "put", "delete"])
+# Status codes that signal a transient failure on github side
+TRANSIENT_STATUS_CODES = frozenset([500, 502, 503, 504])
+# Seconds to wait to connect and to read from github
+DEFAULT_TIMEOUT = (10, 60)
+# Requests sent concurrently by default when fanning out
+DEFAULT_MAX_WORKERS = 8
+# Pages of a listing retrieved concurrently by default
+DEFAULT_PAGE_WORKERS = 4
+# Methods that modify resources, limited by the secondary rate limits of github
+WRITE_METHODS = frozenset(["post", "put", "patch", "delete"])
+# Seconds between writes and writes in flight recommended by github to avoid the
+# secondary rate limits
+DEFAULT_WRITE_INTERVAL = 1.0
+DEFAULT_MAX_CONCURRENT_WRITES = 1
+# Factor applied to the reads allowed in flight when github shows signs of overload
+CONCURRENCY_BACKOFF = 0.5
+# Times the fastest latency seen a read can take before the load is considered too high
+LATENCY_TOLERANCE = 3.0
 LOG = logging.getLogger(__name__)
 
+RateBudget = namedtuple("RateBudget", "limit remaining reset")
+# Rate limit resources of the REST and GraphQL apis
+CORE_RESOURCE = "core"
+GRAPHQL_RESOURCE = "graphql"
+
+
+def fingerprint(data):
+    """Returns a hash of a json serializable object, equal for equal objects"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def gather(named_futures):
+    """Combines a dict of futures into a single future of a dict with their results
+
+    The combined future is resolved once all the futures are done. If any of them
+    failed, the combined future fails with that exception.
+
+    :param named_futures: dict of key to `concurrent.futures.Future`
+    :rtype: concurrent.futures.Future
+    """
+    result = futures.Future()
+    pending = [len(named_futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        try:
+            result.set_result({k: f.result() for k, f in named_futures.items()})
+        except Exception as exc:
+            result.set_exception(exc)
+
+    if not named_futures:
+        result.set_result({})
+    for future in named_futures.values():
+        future.add_done_callback(on_done)
+    return result
+
+
+def then(future, func):
+    """Chains a function to run on the result of a future, without blocking
+
+    :param future: future to wait for
+    :type future: concurrent.futures.Future
+    :param func: function called with the result of the future. It can return
+     another future to chain more requests on it
+    :return: a future of the result of func, or of the result of the future it
+     returned. It fails if the future, func or the future it returned failed
+    :rtype: concurrent.futures.Future
+    """
+    result = futures.Future()
+
+    def copy_outcome(done):
+        if done.exception() is not None:
+            result.set_exception(done.exception())
+        else:
+            result.set_result(done.result())
+
+    def on_done(_):
+        try:
+            value = func(future.result())
+        except Exception as exc:
+            result.set_exception(exc)
+            return
+        if isinstance(value, futures.Future):
+            value.add_done_callback(copy_outcome)
+        else:
+            result.set_result(value)
+
+    future.add_done_callback(on_done)
+    return result
+
+
+class RateLimiter(object):
+    """Tracks the rate limit budgets of github and paces the requests
+
+    The budgets are refreshed from the `X-RateLimit-*` headers of each response.
+    Github has a budget per resource (Ex: core for the REST api and graphql for
+    the GraphQL one), reported in `X-RateLimit-Resource`. Requests are held back
+    once the budget of their resource falls under the reserve until it resets,
+    and responses rejected by the rate limit (including the secondary limits,
+    which report a `Retry-After`) block all requests for the time requested by
+    github.
+    """
+
+    def __init__(self, reserve=DEFAULT_RATE_LIMIT_RESERVE, clock=time.time, sleep=time.sleep):
+        """Creates a rate limiter without any known budget
+
+        :param reserve: number of requests to keep unused from the budget
+        :param clock: function that returns the current time as a timestamp
+        :param sleep: function to wait for a number of seconds
+        """
+        self.reserve = reserve
+        self.budgets = dict()  # resource -> RateBudget
+        self._clock = clock
+        self._sleep = sleep
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    @property
+    def budget(self):
+        """Last known budget of the REST api, None before any response"""
+        return self.budgets.get(CORE_RESOURCE)
+
+    def wait(self, cost=1, resource=CORE_RESOURCE):
+        """Blocks until there is budget to send `cost` requests
+
+        :param resource: rate limit resource the requests count against
+        """
+        now = self._clock()
+        with self._lock:
+            budget = self.budgets.get(resource)
+            pause = self._blocked_until - now
+            if (budget and budget.remaining - cost < self.reserve and
+                    budget.reset > now):
+                pause = max(pause, budget.reset - now + 1)
+        if pause > 0:
+            LOG.info("Waiting %d seconds for the github rate limit", pause)
+            self._sleep(pause)
+
+    def update(self, response, block=True):
+        """Refreshes the budget with the headers of a response
+
+        :param block: whether a `Retry-After` blocks all requests, disable it for
+         requests that handle the wait themselves. Ex: writes paced by `WritePacer`
+        :return: seconds to wait before retrying if the response was rejected
+         because of the rate limit, None otherwise
+        """
+        headers = response.headers
+        now = self._clock()
+        resource = headers.get("X-RateLimit-Resource", CORE_RESOURCE)
+        with self._lock:
+            if "X-RateLimit-Remaining" in headers:
+                self.budgets[resource] = RateBudget(
+                    limit=int(headers.get("X-RateLimit-Limit", 0)),
+                    remaining=int(headers["X-RateLimit-Remaining"]),
+                    reset=int(headers.get("X-RateLimit-Reset", 0)),
+                )
+            budget = self.budgets.get(resource)
+            if response.status_code not in (403, 429):
+                return None
+            if "Retry-After" in headers:
+                delay = int(headers["Retry-After"])
+            elif budget and budget.remaining == 0:
+                delay = max(budget.reset - now + 1, 1)
+            else:  # Not a rate limit error
+                return None
+            if block:
+                self._blocked_until = max(self._blocked_until, now + delay)
+            return delay
+
+
+class WritePacer(object):
+    """Queues the writes sent to github to stay within the secondary rate limits
+
+    Github limits the content created in a short period of time on top of the
+    hourly budget. Writes wait in line for one of `max_concurrent` slots and
+    leave at least `interval` seconds between each other. When github rejects a
+    write anyway, only the writes are held back for the `Retry-After` requested,
+    reads keep being sent.
+    """
+
+    def __init__(self, interval=DEFAULT_WRITE_INTERVAL,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT_WRITES, clock=time.time,
+                 sleep=time.sleep):
+        """Creates a pacer of writes
+
+        :param interval: min seconds between the start of two writes
+        :param max_concurrent: max number of writes in flight
+        :param clock: function that returns the current time as a timestamp
+        :param sleep: function to wait for a number of seconds
+        """
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self._clock = clock
+        self._sleep = sleep
+        self._next_write = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Blocks until a write can be sent, which should be sent within the context"""
+        with self._slots:
+            with self._lock:
+                now = self._clock()
+                start = max(now, self._next_write)
+                self._next_write = start + self.interval
+            if start > now:
+                self._sleep(start - now)
+            yield
+
+    def back_off(self, delay):
+        """Holds back the writes not yet started for `delay` seconds"""
+        with self._lock:
+            self._next_write = max(self._next_write, self._clock() + delay)
+
+
+class AdaptiveConcurrency(object):
+    """Adapts the number of reads in flight to how github copes with them
+
+    It follows an additive increase, multiplicative decrease (AIMD) strategy.
+    The limit grows by one read for each round of reads answered healthily,
+    and it is cut by `backoff` on transient errors (5xx), timeouts, connection
+    errors or rate limit rejections. Reads slower than `latency_tolerance` times
+    the fastest one seen are a sign of load as well and stop the growth.
+
+    Each change of the limit is stored in `history`, as a list of the seconds
+    since the creation of the object and the new limit.
+    """
+
+    def __init__(self, max_limit=DEFAULT_MAX_WORKERS, initial=None, min_limit=1,
+                 backoff=CONCURRENCY_BACKOFF, latency_tolerance=LATENCY_TOLERANCE,
+                 clock=time.time):
+        """Creates an adaptive limit of reads in flight
+
+        :param max_limit: max number of reads in flight
+        :param initial: number of reads allowed in flight at the start,
+         half of max_limit if None
+        :param min_limit: min number of reads in flight
+        :param backoff: factor to apply to the limit on failures
+        :param latency_tolerance: times the fastest latency seen a healthy read can take
+        :param clock: function that returns the current time as a timestamp
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self._clock = clock
+        self._created = clock()
+        self._limit = float(initial or max(max_limit // 2, min_limit))
+        self._in_flight = 0
+        self._min_latency = None
+        self._last_cut = None
+        self._condition = threading.Condition()
+        self.history = [[0.0, self.limit]]
+
+    @property
+    def limit(self):
+        """Number of reads currently allowed in flight"""
+        return int(self._limit)
+
+    def acquire(self):
+        """Blocks until a read can be sent
+
+        :return: the time the read started, to pass to `release`
+        """
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        return self._clock()
+
+    def release(self, start, overloaded=False):
+        """Reports a read as finished, adjusting the limit to its outcome
+
+        :param start: time the read started as returned by `acquire`
+        :param overloaded: whether the read failed because of the load on github
+        """
+        now = self._clock()
+        latency = now - start
+        with self._condition:
+            self._in_flight -= 1
+            previous = self.limit
+            if overloaded:
+                # All reads started before a cut saw the same load, cut only once for them
+                if self._last_cut is None or start >= self._last_cut:
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._last_cut = now
+            else:
+                if self._min_latency is None or latency < self._min_latency:
+                    self._min_latency = latency
+                if latency <= self._min_latency * self.latency_tolerance:
+                    self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            if self.limit != previous:
+                LOG.debug("Reads allowed in flight: %d", self.limit)
+                self.history.append([round(now - self._created, 3), self.limit])
+            self._condition.notify_all()
+
+
+class RetryPolicy(object):
+    """Decides which failed requests are sent again and how long to wait in between
+
+    Requests that failed to connect, timed out or got a transient error from github
+    are retried with exponential backoff and full jitter. The number of retries
+    is limited per request and for the whole run through the retry budget.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30, budget=100,
+                 methods=IDEMPOTENT_METHODS, timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+        """Creates a retry policy
+
+        :param max_retries: retries allowed for a single request
+        :param backoff: base number of seconds to wait, doubled on each retry
+        :param max_backoff: max number of seconds to wait before a retry
+        :param budget: retries allowed across all requests
+        :param methods: methods that can be retried, add "post" to opt-in for it
+        :param timeout: timeout to set in each request, as accepted by requests
+        :param sleep: function to wait for a number of seconds
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.methods = frozenset(methods)
+        self.timeout = timeout
+        self.sleep = sleep
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def should_retry(self, method, attempt, response=None, error=None, safe=False):
+        """Checks whether a request should be resent, consuming the budget if so
+
+        :param method: method of the request that failed
+        :param attempt: number of retries already performed for the request
+        :param response: response received if any
+        :param error: connection error or timeout raised if any
+        :param safe: whether the request can be resent regardless of its method.
+         Ex: GraphQL queries, which are sent as posts
+        """
+        if not (safe or method in self.methods) or attempt >= self.max_retries:
+            return False
+        if error is None and response.status_code not in TRANSIENT_STATUS_CODES:
+            return False
+        with self._lock:
+            if self.retries >= self.budget:
+                LOG.warning("Retry budget exhausted, not retrying failed requests")
+                return False
+            self.retries += 1
+        return True
+
+    def delay(self, attempt):
+        """Seconds to wait before the retry number `attempt` (starting at 0)"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+# Teams are modified through /teams/{id} but listed within their org
+TEAM_PATH = re.compile(r"(^|/)teams/[^/]+$")
+ORG_TEAMS_PATH = re.compile(r"(^|/)orgs/[^/]+/teams$")
+
+
+class ReadCache(object):
+    """Run scoped cache of the pages retrieved from github
+
+    Identical gets are only sent once per run. Requests in flight are shared as
+    well, concurrent callers asking for the same url wait for the first request.
+
+    Writes invalidate the pages of the resource they modify and the listings that
+    contain it, so reads after a write always see the changes.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = dict()  # url -> (resource path, future of the page)
+        self._lock = threading.Lock()
+
+    def fetch(self, url, path, loader):
+        """Returns the page of an url, loading it only if not cached
+
+        :param url: full url of the page, including the query
+        :param path: path of the resource, used for invalidation
+        :param loader: function that retrieves the page from github
+        :return: the result of the loader, a tuple of the body and the next
+         and last page urls
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                entry = (path, futures.Future())
+                self._entries[url] = entry
+                self.misses += 1
+            else:
+                self.hits += 1
+                loader = None
+        future = entry[1]
+        if loader:
+            try:
+                future.set_result(loader())
+            except Exception as exc:
+                with self._lock:
+                    if self._entries.get(url) is entry:
+                        del self._entries[url]
+                future.set_exception(exc)
+        return future.result()
+
+    def invalidate(self, path, deleted=False):
+        """Drops the pages affected by a write to the resource at `path`
+
+        This includes the resource itself, the listings it belongs to and,
+        if the resource was deleted, all the resources within it. Writes to a
+        team drop the listings of teams of all orgs, as the org of a team is
+        not part of its path.
+        """
+        def is_listing(future):
+            if not future.done() or future.exception():
+                return True  # Unknown, better safe than sorry
+            body = future.result()[0]
+            return body.lstrip()[:1] in (b"[", u"[")
+
+        team_write = TEAM_PATH.search(path)
+        with self._lock:
+            for url, (entry_path, future) in list(self._entries.items()):
+                if (entry_path == path or
+                        (deleted and entry_path.startswith(path + "/")) or
+                        (path.startswith(entry_path + "/") and is_listing(future)) or
+                        (team_write and ORG_TEAMS_PATH.search(entry_path))):
+                    LOG.debug("Invalidating '%s' from the read cache", url)
+                    del self._entries[url]
+
 
-def _mask_dict(in_dict, mask):
-    """Given a dict and a list of fields removes all fields not in the list"""
-    for key in (set(in_dict.keys()) - set(mask)):
-        in_dict.pop(key)
-    return in_dict
+class Transport(object):
+    """Sends the HTTP requests to github through a pool of connections
+
+    Each thread gets its own `requests.Session`, but all of them share a single
+    `HTTPAdapter`. This makes the transport safe to use from multiple threads
+    while connections are kept alive and reused across all of them.
+
+    Any object with a compatible `send` method can be used as transport,
+    which allows to replace it in tests.
+    """
+
+    def __init__(self, pool_size=DEFAULT_MAX_WORKERS):
+        """Creates a transport with a connection pool
+
+        :param pool_size: connections to keep open per host, should match the
+         number of workers sending requests concurrently
+        """
+        self.pool_size = pool_size
+        self._adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """Session to use in the current thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def send(self, method, url, **kwargs):
+        """Sends a request, accepts the same arguments as `requests.request`
+
+        :rtype: requests.Response
+        """
+        return self.session.request(method, url, **kwargs)
 
 
 class GitHub(object):
@@ -21,20 +506,94 @@ class GitHub(object):
     on top of Python requests.
     """
 
-    # Single global ugly horrible session to ease testing
-    # set this value to any kind of mock  and it will be used
-    # instead of an instance of requests.Session
-    _session = None
-
-    def __init__(self, user, token, api_url=DEFAULT_API_URL):
+    def __init__(self, user, token, api_url=DEFAULT_API_URL, cache=None, rate_limiter=None,
+                 retry_policy=None, transport=None, read_cache=None, metrics=None,
+                 codec=None, write_pacer=None, read_concurrency=None,
+                 page_workers=DEFAULT_PAGE_WORKERS):
         """Creates a repo object
 
         :param user: user to authenticate
         :param token: token to use for authentication. It can also be the user password
+        :param cache: cache to send conditional requests on gets, disabled if None
+        :type cache: dothub.http_cache.HttpCache
+        :param rate_limiter: tracker of the rate limit, a default one is used if None
+        :type rate_limiter: RateLimiter
+        :param retry_policy: policy to resend failed requests, a default one is used if None
+        :type retry_policy: RetryPolicy
+        :param transport: object used to send the requests, a default one is used if None
+        :type transport: Transport
+        :param read_cache: cache to reuse gets until a write invalidates them,
+         disabled if None
+        :type read_cache: ReadCache
+        :param metrics: collector of metrics of all requests sent, disabled if None
+        :type metrics: dothub.metrics.RequestMetrics
+        :param codec: codec to encode the payloads and decode the responses,
+         the fastest one available is used if None
+        :type codec: dothub.codec.JsonCodec
+        :param write_pacer: queue to pace the writes, writes are sent as soon as
+         possible if None
+        :type write_pacer: WritePacer
+        :param read_concurrency: limit of reads in flight, adapted to the load of
+         github, reads are only bound by the callers if None
+        :type read_concurrency: AdaptiveConcurrency
+        :param page_workers: max number of pages of a listing to retrieve concurrently
         """
         self.api_url = api_url
-        self._session = self._session or requests.Session()
-        self._session.auth = (user, token)
+        self._transport = transport or Transport()
+        self._auth = (user, token)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._cache = cache
+        self.read_cache = read_cache
+        self.metrics = metrics
+        self.codec = codec or json_codec.get_codec()
+        self.write_pacer = write_pacer
+        self.read_concurrency = read_concurrency
+        self.page_workers = page_workers
+        self._page_executor = None
+        self._page_executor_lock = threading.Lock()
+        # Validators of the resources retrieved, only recorded after record_validators
+        self.validators = None
+        self._etags = dict()
+        # Cached responses are only shared between requests with the same credentials
+        self._identity = hashlib.sha256(
+            "{}:{}".format(user, token).encode("utf-8")).hexdigest()
+
+    def record_validators(self):
+        """Starts recording a validator for each resource retrieved through `get`
+
+        Validators are stored in `validators` as a dict of url to a dict with
+        the fields retrieved, the ETag (if github returned one) and a fingerprint
+        of the content, and allow to check later on whether the resource changed
+        through `is_unchanged`.
+        """
+        self.validators = dict()
+
+    def is_unchanged(self, url, validator):
+        """Checks whether a resource still matches a validator recorded through `get`
+
+        If the ETag is known a conditional request is sent, so unchanged resources are
+        verified without retrieving them. Otherwise, or if github reports the resource
+        as modified (ETags change with fields not retrieved as well), the fields
+        retrieved are compared with the fingerprint.
+
+        :param url: url of the resource, as passed to get
+        :param validator: validator recorded for the resource
+        """
+        if validator.get("etag"):
+            response = self._send("get", self._page_url(url),
+                                  headers={"If-None-Match": validator["etag"]})
+            if response.status_code == 304:
+                return True
+            if not response.links.get("next"):
+                data = self.codec.loads_masked(response.content, validator["fields"])
+                return fingerprint(data) == validator["fingerprint"]
+        return fingerprint(self.get(url, validator["fields"])) == validator["fingerprint"]
+
+    @property
+    def rate_limit(self):
+        """Last known rate limit budget as a `RateBudget`, None before any request"""
+        return self.rate_limiter.budget
 
     def get(self, url, fields):
         """Retrieves all fields from an url using a mask
@@ -43,7 +602,9 @@ class GitHub(object):
         and mask the result through the fields passed in.
 
         If the Github API returns a list of objects the mask will be applied to
-        each of the objects
+        each of the objects. Listings split in multiple pages are followed through
+        the `Link` header and returned as a single list. Once the number of pages
+        is known from the first one, the rest are retrieved concurrently.
 
         :param url: url to get the fields from (within the github api). Ex: /repos/mario/repo1/tags
         :param fields: fields that we look for from the response,
@@ -51,15 +612,40 @@ class GitHub(object):
         :raises: if anything goes wrong with the request
         :return: the same object/list that github returns but masked
         """
-        result = self._request("get", url)
-        if isinstance(result, dict):
-            return _mask_dict(result, fields)
-        elif isinstance(result, list):
-            return [_mask_dict(item, fields)
-                    for item in result]
-        else:
+        result, next_url, last_url = self._get_page(url, fields)
+        if isinstance(result, list):
+            if next_url:
+                result.extend(self._get_following_pages(next_url, last_url, fields))
+        elif not isinstance(result, dict):
             raise ValueError("Unexpected type from github: {}"
                              .format(repr(result)))
+        if self.validators is not None:
+            self.validators[url] = dict(
+                fields=list(fields),
+                # The ETag of the first page does not cover the following ones
+                etag=None if next_url else self._etags.get(self._page_url(url)),
+                fingerprint=fingerprint(result),
+            )
+        return result
+
+    def iter_get(self, url, fields):
+        """Yields all the items of a listing applying a mask to each of them
+
+        Pages are requested lazily as the items are consumed, which allows the caller
+        to start working before the full listing is retrieved.
+
+        :param url: url of the listing (within the github api). Ex: /orgs/mario/repos
+        :param fields: fields that we look for on each item, only those will be returned
+        :raises: if anything goes wrong with the request or the url is not a listing
+        :return: a generator of the masked items
+        """
+        while url:
+            result, url, _ = self._get_page(url, fields)
+            if not isinstance(result, list):
+                raise ValueError("Unexpected type from github: {}"
+                                 .format(repr(result)))
+            for item in result:
+                yield item
 
     def put(self, url, payload):
         """Sends a put to the url
@@ -69,7 +655,7 @@ class GitHub(object):
         :param payload: the payload to send
         :type payload: dict
         """
-        return self._request("put", url, json=payload)
+        return self._request("put", url, payload)
 
     def patch(self, url, payload):
         """Sends a patch to the url
@@ -79,7 +665,7 @@ class GitHub(object):
         :param payload: the payload to send
         :type payload: dict
         """
-        return self._request("patch", url, json=payload)
+        return self._request("patch", url, payload)
 
     def post(self, url, payload):
         """Sends a post to the url
@@ -89,7 +675,7 @@ class GitHub(object):
         :param payload: the payload to send
         :type payload: dict
         """
-        return self._request("post", url, json=payload)
+        return self._request("post", url, payload)
 
     def delete(self, url):
         """Sends a delete to the url
@@ -99,17 +685,310 @@ class GitHub(object):
         """
         self._request("delete", url)
 
-    def _request(self, method, url, **kwargs):
-        """Shared plumbing to send a request"""
-        req_func = getattr(self._session, method)
+    def graphql(self, query, **variables):
+        """Runs a query against the github GraphQL api (v4)
+
+        :param query: GraphQL query to run
+        :param variables: values for the variables declared in the query
+        :raises: if anything goes wrong with the request or github reports errors
+        :return: the data returned for the query
+        """
+        # Relative to the base url to support enterprise instances (/api/v3 -> /api/graphql)
+        result = self._request("post", "graphql", dict(query=query, variables=variables),
+                               safe=True)
+        if result.get("errors"):
+            raise RuntimeError("GraphQL query failed: {}".format(result["errors"]))
+        return result["data"]
+
+    def _resource_path(self, url):
+        """Path of the resource an url points to, used to invalidate the read cache"""
+        path = urlparse(urljoin(self.api_url, url)).path.strip("/")
+        # Memberships are just another view of the members of an org or team
+        return "/".join("members" if part == "memberships" else part
+                        for part in path.split("/"))
+
+    @staticmethod
+    def _page_url(url):
+        """Adds the page size to the url of the first page of a listing"""
+        # urls of following pages already carry the pagination query
+        query = dict(parse_qsl(urlparse(url).query))
+        if "page" not in query and "per_page" not in query:
+            url = "{}{}per_page={}".format(url, "&" if "?" in url else "?", PER_PAGE)
+        return url
+
+    def _get_following_pages(self, next_url, last_url, fields):
+        """Retrieves the items of the pages of a listing after the first one
+
+        If the url of the last page is known the pages up to it are retrieved
+        concurrently, pages added after the first one was retrieved are followed
+        one after the other from the last one.
+        """
+        page_urls = _page_range(next_url, last_url) if self.page_workers > 1 else []
+        if len(page_urls) < 2:
+            return self.iter_get(next_url, fields)
+        result = []
+        pages = self._get_page_executor().map(
+            lambda page_url: self._get_page(page_url, fields), page_urls)
+        for items, next_url, _ in pages:
+            result.extend(items)
+        if next_url:  # The listing grew while retrieving it
+            result.extend(self.iter_get(next_url, fields))
+        return result
+
+    def _get_page_executor(self):
+        with self._page_executor_lock:
+            if self._page_executor is None:
+                self._page_executor = futures.ThreadPoolExecutor(self.page_workers)
+            return self._page_executor
+
+    def close(self):
+        """Releases the threads used to retrieve pages concurrently
+
+        The helper can still be used afterwards, the threads are created again if needed.
+        """
+        with self._page_executor_lock:
+            executor, self._page_executor = self._page_executor, None
+        if executor:
+            executor.shutdown()
+
+    def _get_page(self, url, fields):
+        """Retrieves a single page from github
+
+        :param fields: fields to keep on the objects of the page
+        :return: a tuple of the decoded payload and the urls of the next and
+         last pages (if any)
+        """
+        url = self._page_url(url)
+        if self.read_cache:
+            body, next_url, last_url = self.read_cache.fetch(
+                urljoin(self.api_url, url), self._resource_path(url),
+                lambda: self._fetch_page(url)
+            )
+        else:
+            body, next_url, last_url = self._fetch_page(url)
+        # Decoded for each caller, as they are free to modify the result
+        return self.codec.loads_masked(body, fields), next_url, last_url
+
+    def _fetch_page(self, url):
+        """Sends the get for a page
+
+        If a cache is configured the request is sent as a conditional request and
+        the cached body is used when github reports it as not modified.
+
+        :return: a tuple of the body and the urls of the next and last pages (if any)
+        """
+        if not self._cache:
+            response = self._send("get", url)
+            self._record_etag(url, response.headers.get("ETag"))
+            return (response.content, response.links.get("next", {}).get("url"),
+                    response.links.get("last", {}).get("url"))
+
+        cache_key = "{}:{}".format(self._identity, urljoin(self.api_url, url))
+        entry = self._cache.get(cache_key)
+        headers = self._cache.conditional_headers(entry) if entry else {}
+        response = self._send("get", url, headers=headers)
+        if entry and response.status_code == 304:
+            LOG.debug("Request to '%s' served from the http cache", url)
+            self._record_etag(url, entry["etag"])
+            return entry["body"], entry["next"], entry.get("last")
+        self._cache.store(cache_key, response)
+        self._record_etag(url, response.headers.get("ETag"))
+        return (response.content, response.links.get("next", {}).get("url"),
+                response.links.get("last", {}).get("url"))
+
+    def _record_etag(self, url, etag):
+        if self.validators is not None and etag:
+            self._etags[url] = etag
+
+    def _request(self, method, url, payload=None, safe=False):
+        """Shared plumbing to send a request and decode the response
+
+        :param safe: whether the request only reads, so it can be retried
+        """
+        kwargs = dict()
+        if payload is not None:
+            kwargs["data"] = self.codec.dumps(payload)
+            kwargs["headers"] = {"Content-Type": "application/json"}
+        try:
+            return self._decode(self._send(method, url, safe=safe, **kwargs).content)
+        finally:
+            if self.read_cache and not (method == "get" or safe):
+                self.read_cache.invalidate(self._resource_path(url),
+                                           deleted=method == "delete")
+
+    def _decode(self, body):
+        """Returns the json payload of a response body, None if empty"""
+        if body:
+            return self.codec.loads(body)
+
+    def _send(self, method, url, safe=False, **kwargs):
+        """Shared plumbing to send a request
+
+        Failed requests are resent as allowed by the retry policy
+
+        :param safe: whether the request only reads, so it can be retried
+        """
+        kwargs.setdefault("timeout", self.retry_policy.timeout)
+        retries = 0
+        response = None
+        start = time.time()
         try:
-            response = req_func(urljoin(self.api_url, url), **kwargs)
+            while True:
+                try:
+                    response = self._send_within_rate_limit(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as error:
+                    if not self.retry_policy.should_retry(method, retries, error=error,
+                                                          safe=safe):
+                        raise
+                else:
+                    if not self.retry_policy.should_retry(method, retries, response=response,
+                                                          safe=safe):
+                        break
+                delay = self.retry_policy.delay(retries)
+                retries += 1
+                LOG.debug("Retry %d of %s request to '%s' in %.2f seconds",
+                          retries, method, url, delay)
+                self.retry_policy.sleep(delay)
             response.raise_for_status()
         except:
-            LOG.debug("Failed to send %s request to %s", method, url, exc_info=True)
+            LOG.debug("Failed to send %s request to %s after %d retries",
+                      method, url, retries, exc_info=True)
             raise
         else:
-            LOG.debug("Request to '%s' returned %s", url, response.text)
-        if response.text:
-            return response.json()
+            if LOG.isEnabledFor(logging.DEBUG):  # Avoid decoding the body otherwise
+                LOG.debug("Request to '%s' returned %s after %d retries",
+                          url, response.text, retries)
+        finally:
+            if self.metrics:
+                self.metrics.record(
+                    method, urlparse(urljoin(self.api_url, url)).path,
+                    status=response.status_code if response is not None else None,
+                    latency=time.time() - start,
+                    size=len(response.content) if response is not None else 0,
+                    retries=retries,
+                )
+        return response
+
+    def _send_within_rate_limit(self, method, url, **kwargs):
+        """Sends a request, waiting and resending it if rejected by the rate limit
+
+        Writes are paced through the write pacer if any, which also takes care of
+        the waits requested by github for them. Reads are limited by the adaptive
+        concurrency if any.
+        """
+        # GraphQL queries are sent as posts but do not write anything
+        paced = self.write_pacer and method in WRITE_METHODS and url != "graphql"
+        adaptive = self.read_concurrency and method == "get"
+        resource = GRAPHQL_RESOURCE if url == "graphql" else CORE_RESOURCE
+        for attempt in range(MAX_RATE_LIMITED_RETRIES + 1):
+            self.rate_limiter.wait(resource=resource)
+            if adaptive:
+                start = self.read_concurrency.acquire()
+            overloaded = True
+            try:
+                with self.write_pacer.slot() if paced else _no_slot():
+                    response = self._transport.send(method, urljoin(self.api_url, url),
+                                                    auth=self._auth, **kwargs)
+                delay = self.rate_limiter.update(response, block=not paced)
+                overloaded = (delay is not None or
+                              response.status_code in TRANSIENT_STATUS_CODES)
+            finally:
+                if adaptive:
+                    self.read_concurrency.release(start, overloaded)
+            if delay is None or attempt == MAX_RATE_LIMITED_RETRIES:
+                break
+            if paced:
+                self.write_pacer.back_off(delay)
+            LOG.warning("Request to '%s' rejected by the rate limit, retrying in %d seconds",
+                        url, delay)
+        return response
+
+
+@contextlib.contextmanager
+def _no_slot():
+    yield
+
+
+def _page_range(next_url, last_url):
+    """Urls of the pages from next_url to last_url, empty if unknown
+
+    _page_range("x?page=2", "x?page=4") -> ["x?page=2", "x?page=3", "x?page=4"]
+    """
+    if not last_url:
+        return []
+    next_page = urlparse(next_url)
+    query = parse_qsl(next_page.query)
+    first = dict(query).get("page")
+    last = dict(parse_qsl(urlparse(last_url).query)).get("page")
+    if not (first and last and first.isdigit() and last.isdigit()):
+        return []
+    return [
+        next_page._replace(query=urlencode([(k, v if k != "page" else str(page))
+                                            for k, v in query])).geturl()
+        for page in range(int(first), int(last) + 1)
+    ]
+
+
+class AsyncGitHub(object):
+    """Concurrent counterpart of `GitHub`
+
+    It exposes the same methods as `GitHub` but they return a
+    `concurrent.futures.Future` instead of blocking. Everything submitted runs on
+    a pool of threads, which bounds the concurrency to `max_workers`.
+
+    Writes run on a pool of threads of their own, so reads are not stuck behind
+    writes waiting for their turn in the write pacer of the helper.
+
+    Use it as a context manager to release the threads when done.
+    """
+
+    def __init__(self, github, max_workers=DEFAULT_MAX_WORKERS):
+        """Creates an async handle on top of a github helper
+
+        :param github: helper used to send the requests
+        :type github: GitHub
+        :param max_workers: max number of calls to run concurrently
+        """
+        self.github = github
+        self.max_workers = max_workers
+        self._executor = futures.ThreadPoolExecutor(max_workers)
+        self._write_executor = futures.ThreadPoolExecutor(max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def submit(self, func, *args, **kwargs):
+        """Runs any callable in the pool, returns a future of its result"""
+        return self._executor.submit(func, *args, **kwargs)
+
+    def submit_write(self, func, *args, **kwargs):
+        """Runs a callable that writes to github in the pool of writes"""
+        return self._write_executor.submit(func, *args, **kwargs)
+
+    def get(self, url, fields):
+        """Async version of `GitHub.get`"""
+        return self.submit(self.github.get, url, fields)
+
+    def put(self, url, payload):
+        """Async version of `GitHub.put`"""
+        return self.submit_write(self.github.put, url, payload)
+
+    def patch(self, url, payload):
+        """Async version of `GitHub.patch`"""
+        return self.submit_write(self.github.patch, url, payload)
+
+    def post(self, url, payload):
+        """Async version of `GitHub.post`"""
+        return self.submit_write(self.github.post, url, payload)
+
+    def delete(self, url):
+        """Async version of `GitHub.delete`"""
+        return self.submit_write(self.github.delete, url)
 
+    def shutdown(self, wait=True):
+        """Releases the threads once all the submitted work is done"""
+        self._executor.shutdown(wait=wait)
+        self._write_executor.shutdown(wait=wait)
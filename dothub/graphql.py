@@ -0,0 +1,284 @@
+"""Retrieves configuration through the github GraphQL api (v4)
+
+The REST api needs a request per member to find out their role, which makes
+describing a big organization really slow. The GraphQL api returns the roles and
+permissions together with the listings, so the same information is retrieved in a
+handful of paginated queries.
+
+All functions return the data in the same format as the REST based code does.
+"""
+
+import functools
+import operator
+
+from . import github_helper, repository
+
+
+ORG_MEMBERS_QUERY = """
+query($org: String!, $cursor: String) {
+  organization(login: $org) {
+    membersWithRole(first: 100, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      edges { role node { login } }
+    }
+  }
+}
+"""
+
+ORG_TEAMS_QUERY = """
+query($org: String!, $cursor: String) {
+  organization(login: $org) {
+    teams(first: 50, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        slug
+        members(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          edges { role node { login } }
+        }
+        repositories(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          edges { permission node { name } }
+        }
+      }
+    }
+  }
+}
+"""
+
+TEAM_MEMBERS_QUERY = """
+query($org: String!, $slug: String!, $cursor: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      members(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { role node { login } }
+      }
+    }
+  }
+}
+"""
+
+TEAM_REPOS_QUERY = """
+query($org: String!, $slug: String!, $cursor: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      repositories(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { permission node { name } }
+      }
+    }
+  }
+}
+"""
+
+# Connections retrieved for each repository when describing repositories in batch
+REPO_CONNECTIONS = {
+    "labels": """
+      labels(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { name color }
+      }""",
+    "collaborators": """
+      collaborators(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { permission node { login } }
+      }""",
+}
+
+# Options of the repositories that are not part of the listing of repositories of
+# an organization, retrieved through GraphQL by their field name
+REPO_GRAPHQL_OPTIONS = {
+    "allow_rebase_merge": "rebaseMergeAllowed",
+    "allow_squash_merge": "squashMergeAllowed",
+    "allow_merge_commit": "mergeCommitAllowed",
+}
+
+REPO_CONNECTION_QUERY = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {%s
+  }
+}
+"""
+
+# Repositories to retrieve on each query when describing repositories in batch
+DEFAULT_BATCH_SIZE = 25
+
+# Translation of the GraphQL repository permissions to the REST ones
+# as returned by dothub.utils.decode_permissions
+REPO_PERMISSIONS = {
+    "ADMIN": "admin",
+    "MAINTAIN": "push",
+    "WRITE": "push",
+    "TRIAGE": "pull",
+    "READ": "pull",
+}
+
+
+def _connection(data, path):
+    """Given the data of a query returns the connection at the path"""
+    return functools.reduce(operator.getitem, path, data)
+
+
+def paginate(github, query, path, first_page=None, **variables):
+    """Yields all the items of a connection following its cursor
+
+    The query has to declare a `$cursor` variable that is used as the `after`
+    argument of the connection.
+
+    :param github: helper to run the queries
+    :type github: dothub.github_helper.GitHub
+    :param query: query that retrieves the connection
+    :param path: keys to reach the connection within the data of the query
+    :param first_page: connection already retrieved (Ex: nested in a bigger query)
+    :param variables: variables of the query other than the cursor
+    :return: a generator of the edges (or nodes if no edges were requested)
+    """
+    connection = first_page
+    if connection is None:
+        connection = _connection(github.graphql(query, **variables), path)
+    while True:
+        for item in connection.get("edges", connection.get("nodes")):
+            yield item
+        page_info = connection["pageInfo"]
+        if not page_info["hasNextPage"]:
+            return
+        variables["cursor"] = page_info["endCursor"]
+        connection = _connection(github.graphql(query, **variables), path)
+
+
+def get_org_members(github, org):
+    """Retrieves the members of an organization with their roles
+
+    :return: dict of login to a dict with the role. Ex: {"mario": {"role": "admin"}}
+    """
+    path = ["organization", "membersWithRole"]
+    return {
+        edge["node"]["login"]: dict(role=edge["role"].lower())
+        for edge in paginate(github, ORG_MEMBERS_QUERY, path, org=org)
+    }
+
+
+def get_org_teams_access(github, org):
+    """Retrieves the members and repositories of all the teams of an organization
+
+    :return: dict of team slug to a dict with the "members" and "repositories" of
+     the team, as returned by dothub.organization.Organization.teams
+    """
+    result = dict()
+    path = ["organization", "teams"]
+    for team in paginate(github, ORG_TEAMS_QUERY, path, org=org):
+        slug = team["slug"]
+        members = paginate(github, TEAM_MEMBERS_QUERY, path[:1] + ["team", "members"],
+                           first_page=team["members"], org=org, slug=slug)
+        repos = paginate(github, TEAM_REPOS_QUERY, path[:1] + ["team", "repositories"],
+                         first_page=team["repositories"], org=org, slug=slug)
+        result[slug] = dict(
+            members={
+                edge["node"]["login"]: dict(role=edge["role"].lower())
+                for edge in members
+            },
+            repositories={
+                edge["node"]["name"]: dict(permission=REPO_PERMISSIONS[edge["permission"]])
+                for edge in repos
+            },
+        )
+    return result
+
+
+def _repos_batch_query(count, sections):
+    """Builds a query that retrieves the connections of `count` repositories
+
+    Each repository is aliased as r<index> and its name passed as $name<index>.
+    If "options" is within the sections, the options in REPO_GRAPHQL_OPTIONS are
+    retrieved as well.
+    """
+    declarations = "".join(", $name{}: String!".format(i) for i in range(count))
+    fields = "".join(REPO_CONNECTIONS[section] for section in sections
+                     if section in REPO_CONNECTIONS)
+    if "options" in sections:
+        fields += "\n      " + " ".join(sorted(REPO_GRAPHQL_OPTIONS.values()))
+    # The cursor is only used to retrieve next pages through REPO_CONNECTION_QUERY
+    fields = fields.replace(", after: $cursor", "")
+    repos = "".join(
+        "\n  r{0}: repository(owner: $owner, name: $name{0}) {{{1}\n  }}".format(i, fields)
+        for i in range(count)
+    )
+    return "query($owner: String!%s) {%s\n}" % (declarations, repos)
+
+
+def _repo_connection(github, owner, name, section, first_page):
+    """Returns all the items of a connection of a repo given its first page"""
+    query = REPO_CONNECTION_QUERY % REPO_CONNECTIONS[section]
+    return paginate(github, query, ["repository", section], first_page=first_page,
+                    owner=owner, name=name)
+
+
+def describe_org_repositories(github, org, names, sections=repository.Repo.SECTIONS,
+                              batch_size=DEFAULT_BATCH_SIZE,
+                              max_workers=github_helper.DEFAULT_MAX_WORKERS):
+    """Describes multiple repositories of an organization in a few requests
+
+    Labels and collaborators are retrieved through GraphQL for `batch_size`
+    repositories at once. The options come from the listing of repositories of
+    the organization as some of them are not available in GraphQL, except for
+    the merge options which are not part of the listing and come from GraphQL.
+    Hooks are not available in GraphQL either, so they are retrieved per
+    repository, `max_workers` of them concurrently.
+
+    :param github: helper to send the requests
+    :type github: dothub.github_helper.GitHub
+    :param org: name of the organization
+    :param names: names of the repositories to describe
+    :param sections: sections of the config to retrieve, all by default
+    :param batch_size: number of repositories to retrieve on each query
+    :param max_workers: max number of requests to send concurrently
+    :return: dict of repository name to the same config `Repo.describe` returns,
+     limited to the sections requested
+    """
+    names = list(names)
+    result = {name: dict() for name in names}
+
+    if "options" in sections:
+        fields = [field for field in repository.FIELDS["repo"]["options"]
+                  if field not in REPO_GRAPHQL_OPTIONS]
+        for options in github.iter_get("orgs/{}/repos".format(org), fields):
+            if options["name"] in result:
+                result[options["name"]]["options"] = options
+
+    connections = [s for s in sections if s in REPO_CONNECTIONS]
+    batched = connections + ["options"] if "options" in sections else connections
+    for start in range(0, len(names) if batched else 0, batch_size):
+        batch = names[start:start + batch_size]
+        variables = {"name{}".format(i): name for i, name in enumerate(batch)}
+        data = github.graphql(_repos_batch_query(len(batch), batched),
+                              owner=org, **variables)
+        for i, name in enumerate(batch):
+            repo_data = data["r{}".format(i)]
+            config = result[name]
+            if "options" in config:
+                for field, graphql_field in REPO_GRAPHQL_OPTIONS.items():
+                    config["options"][field] = repo_data[graphql_field]
+            if "labels" in connections:
+                labels = _repo_connection(github, org, name, "labels", repo_data["labels"])
+                config["labels"] = {
+                    label["name"]: dict(color=label["color"]) for label in labels
+                }
+            if "collaborators" in connections:
+                collaborators = _repo_connection(github, org, name, "collaborators",
+                                                 repo_data["collaborators"])
+                config["collaborators"] = {
+                    edge["node"]["login"]: dict(permission=REPO_PERMISSIONS[edge["permission"]])
+                    for edge in collaborators
+                }
+
+    if "hooks" in sections:
+        with github_helper.AsyncGitHub(github, max_workers) as agh:
+            hooks = github_helper.gather({
+                name: agh.submit(getattr, repository.Repo(github, org, name), "hooks")
+                for name in names
+            }).result()
+        for name in names:
+            result[name]["hooks"] = hooks[name]
+
+    return result
@@ -0,0 +1,125 @@
+"""Persistent cache of github responses based on conditional requests
+
+Responses with validators (ETag or Last-Modified) are stored on disk so the next
+request to the same url can be sent as a conditional request. When github replies
+with a 304 the stored body is used instead, which saves bandwidth and does not
+count against the rate limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# Max size in bytes of all the entries stored on disk
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+LOG = logging.getLogger(__name__)
+
+
+class HttpCache(object):
+    """Stores github responses on disk keyed by an opaque key (Ex: auth + url)
+
+    Each entry is a json file named after the hash of the key. The modification
+    time of the files is used to track the last access, so when the cache grows
+    above `max_size` the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """Creates a cache stored in the directory passed in
+
+        :param directory: folder to store the entries, created if missing
+        :param max_size: max number of bytes used by the cache
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+
+    def _path(self, key):
+        file_name = hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+        return os.path.join(self.directory, file_name)
+
+    def get(self, key):
+        """Retrieves an entry from the cache, None if not present
+
+        The entry is a dict with the validators of the response ("etag" and
+        "last_modified"), the "body" as text and the "next" and "last" page urls.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path, None)  # Mark as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Returns the headers to send a conditional request for a cached entry"""
+        headers = dict()
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key, response):
+        """Saves a response in the cache if it can be validated later on"""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        entry = dict(
+            etag=etag,
+            last_modified=last_modified,
+            next=response.links.get("next", {}).get("url"),
+            last=response.links.get("last", {}).get("url"),
+            body=response.text,
+        )
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._path(key)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        # Write and rename so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.rename(tmp_path, path)
+        self._track_size(os.path.getsize(path) - previous_size)
+
+    def _track_size(self, delta):
+        """Updates the total size of the cache and evicts entries if too big"""
+        if self._size is None:
+            self._size = sum(size for _, _, size in self._entries())
+        else:
+            self._size += delta
+        if self._size > self.max_size:
+            self._evict()
+
+    def _entries(self):
+        """Returns a list of (last access, path, size) of all entries"""
+        result = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed by someone else
+                continue
+            result.append((stat.st_mtime, path, stat.st_size))
+        return result
+
+    def _evict(self):
+        """Removes the least recently used entries until the size cap is met"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._size <= self.max_size:
+                break
+            LOG.debug("Evicting %s from the http cache", path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
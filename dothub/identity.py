@@ -0,0 +1,54 @@
+"""Index of the identifiers github gives to the resources of a configuration
+
+The configuration refers to resources by name (Ex: team "devs") but some of
+the github endpoints to modify them need the id github generated for them
+(Ex: /teams/123). The ids are captured while the configuration is retrieved so
+the changes can be sent without listing the resources again. They are kept
+apart from the configuration as they are not meant to be part of the yaml.
+"""
+import threading
+
+
+def hook_name(hook):
+    """Name that identifies a hook in the configuration, its url for web hooks"""
+    return hook["config"]["url"] if hook["name"] == "web" else hook["name"]
+
+
+class IdentityIndex(object):
+    """Identifiers of resources per section of the configuration
+
+    index.capture("teams", {"devs": dict(id=123, slug="devs")})
+    index.section("teams", loader)["devs"]["id"] -> 123
+    """
+
+    def __init__(self):
+        self._sections = dict()
+        self._lock = threading.Lock()
+
+    def capture(self, section, identities):
+        """Replaces the identifiers of a section
+
+        :param section: section of the configuration. Ex: hooks
+        :param identities: dict of the name of each resource to its identifiers
+        """
+        with self._lock:
+            self._sections[section] = dict(identities)
+
+    def section(self, section, loader):
+        """Returns the identifiers of a section, retrieving them if not captured yet
+
+        :param section: section of the configuration. Ex: hooks
+        :param loader: function that retrieves the identifiers of the section
+         if they were not captured, returning them as passed to capture
+        :return: dict of the name of each resource to its identifiers
+        """
+        with self._lock:
+            identities = self._sections.get(section)
+        if identities is None:
+            identities = loader()
+            self.capture(section, identities)
+        return identities
+
+    def __contains__(self, section):
+        with self._lock:
+            return section in self._sections
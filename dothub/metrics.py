@@ -0,0 +1,132 @@
+"""Collects metrics of the requests sent to github
+
+Requests are grouped by method and endpoint template (Ex: /repos/{owner}/{repo}/labels)
+so it is easy to find out which kind of request dominates a command.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+# Placeholders for the path segments that follow each github collection
+ITEM_PLACEHOLDERS = {
+    "repos": ["{owner}", "{repo}"],
+    "orgs": ["{org}"],
+    "teams": ["{team_id}"],
+    "users": ["{user}"],
+    "labels": ["{name}"],
+    "hooks": ["{hook_id}"],
+    "collaborators": ["{user}"],
+    "members": ["{user}"],
+    "memberships": ["{user}"],
+}
+PERCENTILES = (50, 95, 99)
+
+
+def endpoint_template(path):
+    """Replaces the identifiers in a github api path by placeholders
+
+    endpoint_template("/repos/mario/dothub/labels/bug") -> /repos/{owner}/{repo}/labels/{name}
+    """
+    parts = [p for p in path.split("?")[0].split("/") if p]
+    result = []
+    index = 0
+    while index < len(parts):
+        part = parts[index]
+        result.append(part)
+        index += 1
+        for placeholder in ITEM_PLACEHOLDERS.get(part, []):
+            if index >= len(parts):
+                break
+            result.append(placeholder)
+            index += 1
+    return "/" + "/".join(result)
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of a list of values, None if empty"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+class RequestMetrics(object):
+    """Thread safe collector of request metrics"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._endpoints = dict()  # (method, template) -> stats dict
+
+    def record(self, method, path, status, latency, size, retries=0):
+        """Records a request
+
+        :param method: http method of the request
+        :param path: path of the url requested
+        :param status: status code of the response, None if no response was received
+        :param latency: seconds spent on the request, retries included
+        :param size: bytes received in the response
+        :param retries: times the request was retried
+        """
+        key = (method.upper(), endpoint_template(path))
+        with self._lock:
+            stats = self._endpoints.setdefault(key, dict(
+                latencies=[], bytes=0, statuses=Counter(), retries=0,
+            ))
+            stats["latencies"].append(latency)
+            stats["bytes"] += size
+            stats["statuses"][str(status or "error")] += 1
+            stats["retries"] += retries
+
+    def summary(self):
+        """Returns a dict with the totals and the metrics per endpoint"""
+        with self._lock:
+            endpoints = []
+            for (method, template), stats in sorted(self._endpoints.items()):
+                latencies = stats["latencies"]
+                endpoint = dict(
+                    method=method,
+                    endpoint=template,
+                    count=len(latencies),
+                    seconds=sum(latencies),
+                    bytes=stats["bytes"],
+                    statuses=dict(stats["statuses"]),
+                    retries=stats["retries"],
+                )
+                for pct in PERCENTILES:
+                    endpoint["p{}".format(pct)] = percentile(latencies, pct)
+                endpoints.append(endpoint)
+        return dict(
+            elapsed=self._clock() - self._start,
+            requests=sum(e["count"] for e in endpoints),
+            bytes=sum(e["bytes"] for e in endpoints),
+            retries=sum(e["retries"] for e in endpoints),
+            endpoints=sorted(endpoints, key=lambda e: e["seconds"], reverse=True),
+        )
+
+
+def format_summary(summary):
+    """Formats the summary of the metrics as a human readable table"""
+    lines = ["{requests} requests in {elapsed:.2f}s, {bytes} bytes received, "
+             "{retries} retries".format(**summary)]
+    row = "{:<7}{:<50}{:>7}{:>9}{:>9}{:>9}{:>12}  {}"
+    lines.append(row.format("METHOD", "ENDPOINT", "COUNT", "P50", "P95", "P99",
+                            "BYTES", "STATUS"))
+    for e in summary["endpoints"]:
+        statuses = " ".join("{}:{}".format(k, v) for k, v in sorted(e["statuses"].items()))
+        lines.append(row.format(
+            e["method"], e["endpoint"], e["count"], "{:.3f}".format(e["p50"]),
+            "{:.3f}".format(e["p95"]), "{:.3f}".format(e["p99"]), e["bytes"], statuses,
+        ))
+    if summary.get("concurrency"):  # Reads allowed in flight over time
+        lines.append("concurrency: {}".format(" -> ".join(
+            "{} at {:.1f}s".format(limit, seconds)
+            for seconds, limit in summary["concurrency"])))
+    for key, value in sorted(summary.items()):
+        if isinstance(value, dict):  # Extra sections added by the caller
+            lines.append("{}: {}".format(key, ", ".join(
+                "{} {}".format(v, k) for k, v in sorted(value.items()))))
+    return "\n".join(lines)
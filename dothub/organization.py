@@ -5,7 +5,9 @@ Via an instance of `Organization` the configuration can be retrieved and updated
 
 import functools
 import os
-from . import dict_diff, utils
+from . import dict_diff, utils, github_helper, graphql
+from .identity import IdentityIndex, hook_name
+from .plan import Mutation, Plan, PlanError
 
 
 # These fields define the properties that are available in each of the subgroups of
@@ -14,13 +16,15 @@ FIELDS = {
     "options": ["billing_email", "company", "email", "location", "name", "description"],
     # default_repository_permission, members_can_create_repositories
     "member": ["login"],
-    "membership": ["role"],
     "team": ["name", "description", "privacy", "permission"],  # slug
     "team_member": ["login"],
-    "team_membership": ["role"],
     "team_repos": ["permissions", "name"],
     "hooks": ["name", "events", "active", "config"],
 }
+# Roles the members of an organization and of a team can have, the listings of
+# members can be filtered by them
+ORG_ROLES = ("admin", "member")
+TEAM_ROLES = ("maintainer", "member")
 
 
 class Organization(object):
@@ -32,17 +36,29 @@ class Organization(object):
 
     In addition, all repositories of the org can be retrieved via the `repos` attribute.
     """
+    # Parts of the configuration, all of them can be retrieved/updated independently
+    SECTIONS = ("options", "members", "teams", "hooks")
 
-    def __init__(self, github_handle, name):
+    def __init__(self, github_handle, name, max_workers=github_helper.DEFAULT_MAX_WORKERS,
+                 use_graphql=False):
         """Creates an Organization object given the github api handle and the org name
 
         :param github_handle: Helper to use the github api
         :type github_handle: dothub.github_helper.Github
         :param name: name of the organization to sync
         :type name: str
+        :param max_workers: max number of requests to send concurrently
+        :type max_workers: int
+        :param use_graphql: retrieve members and teams through the GraphQL api,
+         which needs far less requests than the REST api on big organizations
+        :type use_graphql: bool
         """
         self._gh = github_handle
         self.name = name
+        self.max_workers = max_workers
+        self.use_graphql = use_graphql
+        # Ids of the teams and hooks, captured when they are retrieved
+        self.identities = IdentityIndex()
 
     @staticmethod
     def _get_team_url(team_id, *url_parts):
@@ -72,113 +88,173 @@ class Organization(object):
     @options.setter
     def options(self, new):
         """Updates the organization general parameters"""
-        current = self.options
-        if current == new:
-            return
+        self._apply(self.plan_options(self.options, new))
 
-        url = self._get_url()
-        self._gh.patch(url, new)
+    def plan_options(self, current, new):
+        """Mutations to go from the current options to the new ones"""
+        if current == new:
+            return []
+        return [Mutation("patch", self._get_url(), new, "options", "Update options")]
 
     @property
     def members(self):
         """Retrieve the plain members of an organization.
 
         These members don't need to be linked to any team but for an user to
-        be added to a team they need to be in this list"""
-        result = dict()
-        url = self._get_url("members")
-        members = self._gh.get(url, FIELDS["member"])
-        for member in members:
-            member_name = member["login"]
-            member_url = self._get_url("memberships", member_name)
-            member_fields = self._gh.get(member_url, FIELDS["membership"])
-            result[member_name] = dict(role=member_fields["role"])
-        return result
+        be added to a team they need to be in this list.
+
+        The role of the members is known by listing the members of each role"""
+        if self.use_graphql:
+            return graphql.get_org_members(self._gh, self.name)
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            return self._members_async(agh).result()
+
+    def _members_async(self, agh):
+        """Retrieves the members through agh, returns a future of them"""
+        if self.use_graphql:
+            return agh.submit(graphql.get_org_members, self._gh, self.name)
+        members = github_helper.gather({
+            role: agh.get(self._get_url("members") + "?role=" + role, FIELDS["member"])
+            for role in ORG_ROLES
+        })
+        return github_helper.then(members, _members_by_role)
 
     @members.setter
     def members(self, new):
-        current = self.members
+        self._apply(self.plan_members(self.members, new))
+
+    def plan_members(self, current, new):
+        """Mutations to go from the current members to the new ones"""
+        result = []
         added, missing, updated = dict_diff.diff(current, new)
         for member_name in missing:
             url = self._get_url("members", member_name)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "members",
+                                   "Remove member '{}'".format(member_name)))
 
         for member_name in updated.union(added):
             member = new[member_name]
             url = self._get_url("memberships", member_name)
-            self._gh.put(url, member)
+            result.append(Mutation("put", url, member, "members",
+                                   "Set membership of '{}' ({})".format(
+                                       member_name, member.get("role"))))
+        return result
 
     @property
     def teams(self):
         """Full configuration of all the teams in the org
 
-        This contains a list of teams with their members, repos and respective permissions
+        This contains a list of teams with their members, repos and respective permissions.
+        The members (listed per role) and repos of all the teams are retrieved concurrently.
+        """
+        if self.use_graphql:
+            return self._get_teams_graphql()
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            return self._teams_async(agh).result()
+
+    def _teams_async(self, agh):
+        """Retrieves the teams through agh, returns a future of them
+
+        The requests for each team are submitted once the teams are listed,
+        without blocking any of the threads of agh while waiting.
+        """
+        if self.use_graphql:
+            return agh.submit(self._get_teams_graphql)
+        teams = agh.get(self._get_url("teams"), FIELDS["team"] + ["id", "slug"])
+        return github_helper.then(teams, functools.partial(self._teams_access_async, agh))
+
+    def _teams_access_async(self, agh, teams):
+        """Retrieves the members and repos of the teams listed, returns a future of
+        the teams as returned by the teams property
+        """
+        self.identities.capture("teams", _teams_identities(teams))
+        teams_members = github_helper.gather({
+            (team["id"], role): agh.get(
+                self._get_team_url(team["id"], "members") + "?role=" + role,
+                FIELDS["team_member"])
+            for team in teams
+            for role in TEAM_ROLES
+        })
+        teams_repos = github_helper.gather({
+            team["id"]: agh.get(self._get_team_url(team["id"], "repos"),
+                                FIELDS["team_repos"])
+            for team in teams
+        })
+        access = github_helper.gather(dict(members=teams_members, repos=teams_repos))
+        return github_helper.then(access, lambda access: _teams_config(
+            teams, access["members"], access["repos"]))
+
+    def _get_teams_graphql(self):
+        """Retrieves the teams as the teams property but through GraphQL
+
+        The REST listing is still used for the team fields, as some of them
+        (Ex: permission) are not available in GraphQL.
         """
         result = dict()
-        url = self._get_url("teams")
-        teams = self._gh.get(url, FIELDS["team"] + ["id"])
+        teams_access = graphql.get_org_teams_access(self._gh, self.name)
+        teams = self._gh.get(self._get_url("teams"), FIELDS["team"] + ["id", "slug"])
+        self.identities.capture("teams", _teams_identities(teams))
         for team in teams:
             team_name = team.pop("name")
-            team_id = team.pop("id")
-            team["members"] = {}
-            team["repositories"] = {}
-            members_url = self._get_team_url(team_id, "members")
-            members = self._gh.get(members_url, FIELDS["team_member"])
-            for member in members:
-                member_name = member.pop("login")
-                membership_url = self._get_team_url(team_id, "memberships", member_name)
-                membership = self._gh.get(membership_url, FIELDS["team_membership"])
-                team["members"][member_name] = membership
-
-            repos_url = self._get_team_url(team_id, "repos")
-            repos = self._gh.get(repos_url, FIELDS["team_repos"])
-            for repo in repos:
-                repo_name = repo.pop("name")
-                permissions = repo.pop("permissions")
-                permission = utils.decode_permissions(permissions)
-                repo["permission"] = permission
-                team["repositories"][repo_name] = repo
-
+            team.pop("id")
+            team.update(teams_access[team.pop("slug")])
             result[team_name] = team
-
         return result
 
     @teams.setter
     def teams(self, new):
-        current = self.teams
+        self._apply(self.plan_teams(self.teams, new))
+
+    def plan_teams(self, current, new, removed_members=()):
+        """Mutations to go from the current teams to the new ones
+
+        The ids of the teams created are referenced as `{team:<name>}` in the urls
+        of the mutations that add repositories and members to them.
+
+        :param removed_members: members removed from the organization in the same
+         plan. Their team memberships are not removed, as leaving the organization
+         already removes them from its teams.
+        """
+        result = []
         added, missing, updated = dict_diff.diff(current, new)
 
-        teams_id_mapping = {
-            v["name"]: v["id"] for v in
-            self._gh.get(self._get_url("teams"), ["name", "id"])
-        }
+        teams_identities = self.identities.section("teams", self._get_teams_identities)
 
         for team_name in missing:
-            team_id = teams_id_mapping[team_name]
+            team_id = teams_identities[team_name]["id"]
             url = self._get_team_url(team_id)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "teams",
+                                   "Delete team '{}'".format(team_name)))
 
         for team_name in added:
-            team = new[team_name]
+            team = dict(new[team_name])
             repos = team.pop("repositories", {})
             members = team.pop("members", {})
             team["name"] = team_name
+            team_ref = "team:{}".format(team_name)
 
             url = self._get_url("teams")
-            team_id = self._gh.post(url, team)["id"]
+            result.append(Mutation("post", url, team, "teams",
+                                   "Create team '{}'".format(team_name), ref=team_ref))
+            team_id = "{%s}" % team_ref
 
             for repo_name, repo in repos.items():
                 url = self._get_team_url(team_id, "repos", self.name, repo_name)
-                self._gh.put(url, repo)
+                result.append(Mutation("put", url, repo, "teams",
+                                       "Add repository '{}' to team '{}' ({})".format(
+                                           repo_name, team_name, repo.get("permission"))))
 
             for member_name, member in members.items():
                 url = self._get_team_url(team_id, "members", member_name)
-                self._gh.put(url, member)
+                result.append(Mutation("put", url, member, "teams",
+                                       "Add member '{}' to team '{}' ({})".format(
+                                           member_name, team_name, member.get("role")),
+                                       after=[self._get_url("memberships", member_name)]))
 
         for team_name in updated:
-            new_team = new[team_name]
-            old_team = current[team_name]
-            team_id = teams_id_mapping[team_name]
+            new_team = dict(new[team_name])
+            old_team = dict(current[team_name])
+            team_id = teams_identities[team_name]["id"]
             new_repos = new_team.pop("repositories", {})
             old_repos = old_team.pop("repositories", {})
             new_members = new_team.pop("members", {})
@@ -186,88 +262,176 @@ class Organization(object):
 
             if old_team != new_team:
                 url = self._get_team_url(team_id)
-                self._gh.patch(url, new_team)
+                result.append(Mutation("patch", url, new_team, "teams",
+                                       "Update team '{}'".format(team_name)))
 
             # update repos
             r_added, r_missing, r_updated = dict_diff.diff(old_repos, new_repos)
             for repo_name in r_added.union(r_updated):
                 repo = new_repos[repo_name]
                 url = self._get_team_url(team_id, "repos", self.name, repo_name)
-                self._gh.put(url, repo)
+                result.append(Mutation("put", url, repo, "teams",
+                                       "Add repository '{}' to team '{}' ({})".format(
+                                           repo_name, team_name, repo.get("permission"))))
 
             for repo_name in r_missing:
                 url = self._get_team_url(team_id, "repos", self.name, repo_name)
-                self._gh.delete(url)
+                result.append(Mutation("delete", url, None, "teams",
+                                       "Remove repository '{}' from team '{}'".format(
+                                           repo_name, team_name)))
 
             # update members
             m_added, m_missing, m_updated = dict_diff.diff(old_members, new_members)
             for member_name in m_added.union(m_updated):
                 member = new_members[member_name]
                 url = self._get_team_url(team_id, "members", member_name)
-                self._gh.put(url, member)
+                result.append(Mutation("put", url, member, "teams",
+                                       "Add member '{}' to team '{}' ({})".format(
+                                           member_name, team_name, member.get("role")),
+                                       after=[self._get_url("memberships", member_name)]))
 
-            for member_name in m_missing:
+            for member_name in m_missing.difference(removed_members):
                 url = self._get_team_url(team_id, "memberships", member_name)
-                self._gh.delete(url)
+                result.append(Mutation("delete", url, None, "teams",
+                                       "Remove member '{}' from team '{}'".format(
+                                           member_name, team_name)))
+        return result
 
     @property
     def hooks(self):
         """Retrieve the organization level web hooks"""
         url = self._get_url("hooks")
-        return self._gh.get(url, FIELDS["hooks"])
+        hooks = self._gh.get(url, FIELDS["hooks"] + ["id"])
+        self.identities.capture("hooks", {hook_name(h): dict(id=h.pop("id")) for h in hooks})
+        return hooks
 
     @hooks.setter
     def hooks(self, new):
+        self._apply(self.plan_hooks(self.hooks, new))
+
+    def plan_hooks(self, current, new):
+        """Mutations to go from the current hooks to the new ones"""
         assert isinstance(new, (list, tuple)), "Orgs need to be a list of dict"
-        get_hook_name = lambda h: h["config"]["url"] if h["name"] == "web" else h["name"]
-        current = {get_hook_name(h): h for h in self.hooks}
-        new = {get_hook_name(h): h for h in new}
-        raw_curr_hooks = self._gh.get(self._get_url("hooks"), ["name", "config", "id"])
-        hooks_id = {get_hook_name(h): h["id"] for h in raw_curr_hooks}
+        result = []
+        current = {hook_name(h): h for h in current}
+        new = {hook_name(h): h for h in new}
+        hooks_id = self.identities.section("hooks", self._get_hooks_identities)
 
         added, missing, updated = dict_diff.diff(current, new)
-        for hook_name in missing:
-            hook_id = hooks_id[hook_name]
+        for name in missing:
+            hook_id = hooks_id[name]["id"]
             url = self._get_url("hooks", hook_id)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "hooks",
+                                   "Delete hook '{}'".format(name)))
 
-        for hook_name in updated:
-            hook_id = hooks_id[hook_name]
-            hook = new[hook_name]
+        for name in updated:
+            hook_id = hooks_id[name]["id"]
+            hook = new[name]
             # Safe check updating the config
             new_config = hook.get("config")
-            current_config = current[hook_name].get("config")
+            current_config = current[name].get("config")
             forbidden_keys = ['token', 'secret']
             if current_config != new_config and any(k in forbidden_keys
                                                     for k in new_config):
                 raise RuntimeError("Updating hooks with secrets is not supported")
             url = self._get_url("hooks", hook_id)
-            self._gh.patch(url, hook)
+            result.append(Mutation("patch", url, hook, "hooks",
+                                   "Update hook '{}'".format(name)))
 
-        for hook_name in added:
-            hook = new[hook_name]
+        for name in added:
+            hook = new[name]
             url = self._get_url("hooks")
-            self._gh.post(url, hook)
-
-    def describe(self):
-        """Serializes the whole configuration into a dict"""
-        return dict(
-            options=self.options,
-            members=self.members,
-            teams=self.teams,
-            hooks=self.hooks
+            result.append(Mutation("post", url, hook, "hooks",
+                                   "Create hook '{}'".format(name)))
+        return result
+
+    def _get_hooks_identities(self):
+        """Ids of the hooks, for configurations not retrieved through this object"""
+        hooks = self._gh.get(self._get_url("hooks"), ["name", "config", "id"])
+        return {hook_name(h): dict(id=h["id"]) for h in hooks}
+
+    def _get_teams_identities(self):
+        """Ids of the teams, for configurations not retrieved through this object"""
+        return _teams_identities(self._gh.get(self._get_url("teams"), ["name", "id", "slug"]))
+
+    def _apply(self, mutations):
+        Plan(mutations).apply(self._gh)
+
+    def describe(self, sections=SECTIONS):
+        """Serializes the whole configuration into a dict
+
+        :param sections: sections of the configuration to retrieve, all by default
+        """
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            return self.describe_async(agh, sections).result()
+
+    def describe_async(self, agh, sections=SECTIONS):
+        """Retrieves the sections of the configuration concurrently
+
+        :param agh: handle to run the requests
+        :type agh: dothub.github_helper.AsyncGitHub
+        :param sections: sections of the configuration to retrieve, all by default
+        :return: a future of the same dict returned by describe
+        """
+        retrievers = dict(
+            options=lambda: agh.submit(getattr, self, "options"),
+            members=lambda: self._members_async(agh),
+            teams=lambda: self._teams_async(agh),
+            hooks=lambda: agh.submit(getattr, self, "hooks"),
         )
+        return github_helper.gather({section: retrievers[section]() for section in sections})
+
+    def plan(self, current, data):
+        """Computes the changes needed to go from the current configuration to a new one
+
+        Only the sections present in the new configuration are taken into account.
+
+        :param current: configuration as returned by describe
+        :param data: desired configuration
+        :rtype: dothub.plan.Plan
+        """
+        result = Plan()
+        for section in self.SECTIONS:
+            if section in data:
+                plan_section = getattr(self, "plan_" + section)
+                if section == "teams" and "members" in data:
+                    removed_members = set(current["members"]) - set(data["members"])
+                    plan_section = functools.partial(plan_section,
+                                                     removed_members=removed_members)
+                result.extend(plan_section(current[section], data[section]))
+        return result
 
     def update(self, data):
         """Updates the github configuration with the configuration data passed in """
-        if "options" in data:
-            self.options = data["options"]
-        if "members" in data:
-            self.members = data["members"]
-        if "teams" in data:
-            self.teams = data["teams"]
-        if "hooks" in data:
-            self.hooks = data["hooks"]
+        self.apply(self.plan(self.describe(), data))
+
+    def apply(self, plan):
+        """Sends all the changes of a plan computed through `plan`
+
+        :raises dothub.plan.PlanError: if any of the changes failed, once all the
+         changes that do not depend on them were applied
+        :rtype: dothub.plan.PlanResult
+        """
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            result = self.apply_async(plan, agh).result()
+        if not result.ok:
+            raise PlanError(result)
+        return result
+
+    def apply_async(self, plan, agh):
+        """Applies a plan, independent changes concurrently
+
+        Changes are ordered following the dependencies between them, Ex: users
+        join the organization before being added to a team and teams are created
+        before adding repositories to them. See `dothub.plan.Plan.dependencies`.
+
+        :param plan: plan computed through `plan`
+        :type plan: dothub.plan.Plan
+        :param agh: handle to run the requests
+        :type agh: dothub.github_helper.AsyncGitHub
+        :return: a future of the `dothub.plan.PlanResult`
+        """
+        return plan.apply_async(agh)
 
     @property
     def repos(self):
@@ -275,6 +439,52 @@ class Organization(object):
 
         :return: yields all the repos
         """
-        for repo in self._gh.get(self._get_url("repos"), ["name", "fork"]):
+        for repo in self._gh.iter_get(self._get_url("repos"), ["name", "fork"]):
             if not repo["fork"]:
                 yield repo["name"]
+
+
+def _members_by_role(members):
+    """Given a dict of role to the members with that role returns the role of each member
+
+    _members_by_role({"admin": [{"login": "mario"}]}) -> {"mario": {"role": "admin"}}
+    """
+    return {
+        member["login"]: dict(role=role)
+        for role, role_members in members.items()
+        for member in role_members
+    }
+
+
+def _teams_config(teams, teams_members, teams_repos):
+    """Builds the configuration of the teams listed given their members and repos
+
+    :param teams: listing of the teams
+    :param teams_members: dict of (team id, role) to the members with that role
+    :param teams_repos: dict of team id to the repos of the team
+    """
+    result = dict()
+    for team in teams:
+        team_name = team.pop("name")
+        team_id = team.pop("id")
+        team.pop("slug", None)
+        team["members"] = _members_by_role({
+            role: teams_members[(team_id, role)] for role in TEAM_ROLES
+        })
+        team["repositories"] = {}
+
+        for repo in teams_repos[team_id]:
+            repo_name = repo.pop("name")
+            permissions = repo.pop("permissions")
+            permission = utils.decode_permissions(permissions)
+            repo["permission"] = permission
+            team["repositories"][repo_name] = repo
+
+        result[team_name] = team
+
+    return result
+
+
+def _teams_identities(teams):
+    """Ids and slugs of a listing of teams by name"""
+    return {team["name"]: dict(id=team["id"], slug=team.get("slug")) for team in teams}
@@ -0,0 +1,333 @@
+"""Plans of the changes to send to github
+
+A plan is computed once from a snapshot of the current configuration and the
+desired one. It holds the exact list of writes (mutations) needed to go from one
+to the other, which can be reviewed before being applied as they are, without
+reading the configuration again.
+
+Mutations that do not depend on each other can be applied concurrently, see
+`Plan.dependencies` for how the order between them is derived.
+
+Plans can be saved to a file to be applied later on. They record a validator for
+each resource read to compute them, so a plan is only applied if none of those
+resources changed in the meantime.
+"""
+import collections
+import json
+import logging
+import threading
+
+import requests
+from concurrent import futures
+
+from . import github_helper
+
+# Version of the format of the plan files
+PLAN_FORMAT_VERSION = 1
+LOG = logging.getLogger(__name__)
+
+
+class Mutation(collections.namedtuple(
+        "Mutation", "method url payload section description ref after")):
+    """A single write to send to github
+
+    :ivar method: method of the github helper to use: post, put, patch or delete
+    :ivar url: url to write to (within the github api)
+    :ivar payload: payload to send, None for deletes
+    :ivar section: section of the configuration the mutation belongs to. Ex: labels
+    :ivar description: human readable description of the change
+    :ivar ref: if set, the id of the resource created is stored under this name, so
+     the urls of the following mutations can reference it as `{<ref>}`
+    :ivar after: urls of resources that need to be written before this mutation
+     if they are part of the same plan. Ex: the membership of an user in the org
+     before adding it to a team
+    """
+    __slots__ = ()
+
+    def __new__(cls, method, url, payload=None, section=None, description=None, ref=None,
+                after=()):
+        return super(Mutation, cls).__new__(cls, method, url, payload, section,
+                                            description, ref, tuple(after))
+
+    def send(self, github, refs):
+        """Sends the mutation through a github helper
+
+        :param github: helper to send the request
+        :type github: dothub.github_helper.GitHub
+        :param refs: dict of reference name to the id of the resources created,
+         updated with the resource created by this mutation if it has a ref
+        """
+        url = self.resolve(refs)
+        if self.method == "delete":
+            result = github.delete(url)
+        else:
+            result = getattr(github, self.method)(url, self.payload)
+        if self.ref:
+            refs[self.ref] = result["id"]
+        return result
+
+    def resolve(self, refs):
+        """Returns the url replacing the references to created resources
+
+        :param refs: dict of reference name to the id of the resource
+        """
+        url = self.url
+        for name, value in refs.items():
+            url = url.replace("{%s}" % name, str(value))
+        return url
+
+    def __str__(self):
+        return self.description or "{} {}".format(self.method.upper(), self.url)
+
+
+class PlanError(RuntimeError):
+    """Some mutations of a plan failed to be applied
+
+    :ivar result: result of the execution of the plan
+    :type result: PlanResult
+    """
+
+    def __init__(self, result):
+        lines = ["{}: {}".format(mutation, error) for mutation, error in result.failed]
+        lines += ["{}: not applied, depends on a failed change".format(mutation)
+                  for mutation in result.skipped]
+        super(PlanError, self).__init__(
+            "{} changes could not be applied:\n{}".format(len(lines), "\n".join(lines)))
+        self.result = result
+
+
+class PlanResult(object):
+    """Outcome of each of the mutations of a plan applied concurrently
+
+    :ivar applied: mutations applied successfully
+    :ivar failed: list of tuples of the mutations that failed and their exception
+    :ivar skipped: mutations not sent as a mutation they depend on failed
+    """
+
+    def __init__(self):
+        self.applied = []
+        self.failed = []
+        self.skipped = []
+
+    @property
+    def ok(self):
+        """Whether all the mutations were applied"""
+        return not self.failed and not self.skipped
+
+
+class Plan(object):
+    """Ordered list of mutations
+
+    Mutations are applied in the order they were added, or concurrently
+    respecting the dependencies between them through `apply_async`.
+    """
+
+    def __init__(self, mutations=(), target=None, validators=None):
+        """Creates a plan
+
+        :param mutations: mutations of the plan
+        :param target: what the plan applies to. Ex: org/repo
+        :param validators: validators of the resources the plan depends on,
+         as recorded by `dothub.github_helper.GitHub.record_validators`
+        """
+        self.mutations = list(mutations)
+        self.target = target
+        self.validators = dict(validators or {})
+
+    def add(self, method, url, payload=None, section=None, description=None, ref=None,
+            after=()):
+        """Appends a mutation to the plan, see `Mutation` for the arguments"""
+        mutation = Mutation(method, url, payload, section, description, ref, after)
+        self.mutations.append(mutation)
+        return mutation
+
+    def extend(self, mutations):
+        """Appends multiple mutations to the plan"""
+        self.mutations.extend(mutations)
+
+    def by_section(self):
+        """Splits the plan into a plan per section
+
+        :return: an ordered dict of section to plan
+        """
+        result = collections.OrderedDict()
+        for mutation in self.mutations:
+            result.setdefault(mutation.section, Plan()).mutations.append(mutation)
+        return result
+
+    def apply(self, github):
+        """Sends all the mutations of the plan in order
+
+        :param github: helper to send the requests
+        :type github: dothub.github_helper.GitHub
+        """
+        refs = dict()
+        for mutation in self.mutations:
+            LOG.debug("Applying: %s", mutation)
+            mutation.send(github, refs)
+
+    def dependencies(self):
+        """Computes the mutations each mutation needs to wait for
+
+        A mutation depends on the previous mutations that:
+        - create a resource it references (see `Mutation.ref`)
+        - write to the same url, Ex: deleting and adding back a collaborator
+        - write to any of the urls listed in its `Mutation.after`
+
+        As mutations only depend on previous ones there are no cycles.
+
+        :return: a list with the set of indexes each mutation depends on
+        """
+        result = []
+        last_by_url = dict()
+        index_by_ref = dict()
+        for index, mutation in enumerate(self.mutations):
+            depends = set(index_by_ref[ref] for ref in index_by_ref
+                          if "{%s}" % ref in mutation.url)
+            for url in (mutation.url,) + mutation.after:
+                if url in last_by_url:
+                    depends.add(last_by_url[url])
+            result.append(depends)
+            last_by_url[mutation.url] = index
+            if mutation.ref:
+                index_by_ref[mutation.ref] = index
+        return result
+
+    def apply_async(self, agh):
+        """Applies the mutations concurrently respecting their dependencies
+
+        Each mutation is sent as soon as the ones it depends on are applied, so
+        the concurrency is only bound by the workers of agh. A failure does not
+        abort the rest of the plan, only the mutations depending on the one that
+        failed are skipped.
+
+        :param agh: handle to run the requests
+        :type agh: dothub.github_helper.AsyncGitHub
+        :return: a future of a `PlanResult` resolved once all mutations are done
+        """
+        mutations = self.mutations
+        dependencies = self.dependencies()
+        dependents = [[] for _ in mutations]
+        for index, depends in enumerate(dependencies):
+            for dependency in depends:
+                dependents[dependency].append(index)
+        pending = [len(depends) for depends in dependencies]
+        blocked = [False] * len(mutations)
+        remaining = [len(mutations)]
+        refs = dict()
+        lock = threading.Lock()
+        result = PlanResult()
+        done = futures.Future()
+
+        def finish(index, error=None):
+            """Records the outcome of a mutation and sends the ones unblocked"""
+            ready = []
+            with lock:
+                finished = [(index, error)]
+                while finished:
+                    index, error = finished.pop()
+                    remaining[0] -= 1
+                    failed = blocked[index] or error is not None
+                    if blocked[index]:
+                        result.skipped.append(mutations[index])
+                    elif error is not None:
+                        result.failed.append((mutations[index], error))
+                    else:
+                        result.applied.append(mutations[index])
+                    for dependent in dependents[index]:
+                        blocked[dependent] = blocked[dependent] or failed
+                        pending[dependent] -= 1
+                        if pending[dependent]:
+                            continue
+                        if blocked[dependent]:
+                            finished.append((dependent, None))
+                        else:
+                            ready.append(dependent)
+                is_done = not remaining[0]
+            for dependent in ready:
+                agh.submit_write(send, dependent)
+            if is_done:
+                done.set_result(result)
+
+        def send(index):
+            mutation = mutations[index]
+            LOG.debug("Applying: %s", mutation)
+            with lock:
+                known_refs = dict(refs)
+            try:
+                mutation.send(agh.github, known_refs)
+            except Exception as error:
+                LOG.debug("Failed to apply %s: %s", mutation, error)
+                finish(index, error)
+            else:
+                with lock:
+                    refs.update(known_refs)
+                finish(index)
+
+        if not mutations:
+            done.set_result(result)
+        for index, depends in enumerate(dependencies):
+            if not depends:
+                agh.submit_write(send, index)
+        return done
+
+    def stale_resources(self, github, max_workers=github_helper.DEFAULT_MAX_WORKERS):
+        """Checks which resources the plan depends on changed since it was computed
+
+        :param github: helper to send the requests
+        :type github: dothub.github_helper.GitHub
+        :param max_workers: max number of resources to check concurrently
+        :return: sorted list of the urls of the resources that changed, including
+         the ones that can no longer be retrieved (Ex: deleted)
+        """
+        def is_unchanged(url, validator):
+            try:
+                return github.is_unchanged(url, validator)
+            except requests.HTTPError as error:
+                LOG.debug("Failed to validate '%s': %s", url, error)
+                return False
+
+        with github_helper.AsyncGitHub(github, max_workers) as agh:
+            unchanged = github_helper.gather({
+                url: agh.submit(is_unchanged, url, validator)
+                for url, validator in self.validators.items()
+            }).result()
+        return sorted(url for url, is_unchanged in unchanged.items() if not is_unchanged)
+
+    def save(self, path):
+        """Writes the plan to a json file"""
+        data = dict(
+            version=PLAN_FORMAT_VERSION,
+            target=self.target,
+            validators=self.validators,
+            mutations=[mutation._asdict() for mutation in self.mutations],
+        )
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a plan saved through `save`
+
+        :raises ValueError: if the file is not a plan of a supported version
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("version") != PLAN_FORMAT_VERSION:
+            raise ValueError("{} is not a plan in a supported format".format(path))
+        try:
+            mutations = [Mutation(**mutation) for mutation in data["mutations"]]
+            return cls(mutations, data["target"], data["validators"])
+        except (KeyError, TypeError) as error:
+            raise ValueError("{} is not a valid plan: {!r}".format(path, error))
+
+    def __iter__(self):
+        return iter(self.mutations)
+
+    def __len__(self):
+        return len(self.mutations)
+
+    def __bool__(self):
+        return bool(self.mutations)
+
+    __nonzero__ = __bool__
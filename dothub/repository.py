@@ -5,7 +5,9 @@ Via an instance of `Repository` the configuration can be retrieved and updated.
 
 import os.path
 import functools
-from . import dict_diff, utils
+from . import dict_diff, utils, github_helper
+from .identity import IdentityIndex, hook_name
+from .plan import Mutation, Plan, PlanError
 
 
 # These fields define the properties that are available in each of the subgroups of
@@ -41,7 +43,11 @@ class Repo(object):
 
     To perform a full retrieve/update, use the describe/update methods.
     """
-    def __init__(self, github, owner, repository):
+    # Parts of the configuration, all of them can be retrieved/updated independently
+    SECTIONS = ("options", "collaborators", "labels", "hooks")
+
+    def __init__(self, github, owner, repository,
+                 max_workers=github_helper.DEFAULT_MAX_WORKERS):
         """Creates a repo object
 
         :param github: Github helper to handle communications with the API
@@ -50,10 +56,15 @@ class Repo(object):
         :type owner: str
         :param repository: repository name in github
         :type repository: str
+        :param max_workers: max number of requests to send concurrently
+        :type max_workers: int
         """
         self._gh = github
         self.owner = owner
         self.repository = repository
+        self.max_workers = max_workers
+        # Ids of the hooks, captured when they are retrieved
+        self.identities = IdentityIndex()
 
     def _get_url(self, *url_parts):
         """Given some url parts that are part of a repo returns the full url path
@@ -78,12 +89,13 @@ class Repo(object):
 
     @options.setter
     def options(self, new):
-        current = self.options
-        if current == new:
-            return
+        self._apply(self.plan_options(self.options, new))
 
-        url = self._get_url("")
-        self._gh.patch(url, new)
+    def plan_options(self, current, new):
+        """Mutations to go from the current options to the new ones"""
+        if current == new:
+            return []
+        return [Mutation("patch", self._get_url(""), new, "options", "Update options")]
 
     @property
     def labels(self):
@@ -97,21 +109,27 @@ class Repo(object):
 
     @labels.setter
     def labels(self, new):
-        current = self.labels
+        self._apply(self.plan_labels(self.labels, new))
+
+    def plan_labels(self, current, new):
+        """Mutations to go from the current labels to the new ones"""
+        result = []
         added, missing, updated = dict_diff.diff(current, new)
         for label in added:
-            new_label = new[label]
-            new_label["name"] = label
+            new_label = dict(new[label], name=label)
             url = self._get_url("labels")
-            self._gh.post(url, new_label)
+            result.append(Mutation("post", url, new_label, "labels",
+                                   "Create label '{}'".format(label)))
         for label in missing:
             url = self._get_url("labels", label)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "labels",
+                                   "Delete label '{}'".format(label)))
         for label in updated:
-            new_label = new[label]
-            new_label["name"] = label
+            new_label = dict(new[label], name=label)
             url = self._get_url("labels", label)
-            self._gh.patch(url, new_label)
+            result.append(Mutation("patch", url, new_label, "labels",
+                                   "Update label '{}'".format(label)))
+        return result
 
     @property
     def collaborators(self):
@@ -128,7 +146,11 @@ class Repo(object):
 
     @collaborators.setter
     def collaborators(self, new):
-        current = self.collaborators
+        self._apply(self.plan_collaborators(self.collaborators, new))
+
+    def plan_collaborators(self, current, new):
+        """Mutations to go from the current collaborators to the new ones"""
+        result = []
         added, missing, updated = dict_diff.diff(current, new)
         if updated:
             # Update by recreating
@@ -136,63 +158,131 @@ class Repo(object):
             added = added.union(updated)
         for user in missing:
             url = self._get_url("collaborators", user)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "collaborators",
+                                   "Remove collaborator '{}'".format(user)))
         for user in added:
             url = self._get_url("collaborators", user)
             values = new[user]
-            self._gh.put(url, values)
+            result.append(Mutation("put", url, values, "collaborators",
+                                   "Add collaborator '{}' ({})".format(
+                                       user, values.get("permission"))))
+        return result
 
     @property
     def hooks(self):
         """List of hooks"""
         url = self._get_url("hooks")
-        return self._gh.get(url, FIELDS["repo"]["hooks"])
+        hooks = self._gh.get(url, FIELDS["repo"]["hooks"] + ["id"])
+        self.identities.capture("hooks", {hook_name(h): dict(id=h.pop("id")) for h in hooks})
+        return hooks
 
     @hooks.setter
     def hooks(self, new):
-        get_hook_name = lambda h: h["config"]["url"] if h["name"] == "web" else h["name"]
-        current = {get_hook_name(h): h for h in self.hooks}
-        new = {get_hook_name(h): h for h in new}
-        raw_curr_hooks = self._gh.get(self._get_url("hooks"), ["name", "config", "id"])
-        hooks_id = {get_hook_name(h): h["id"] for h in raw_curr_hooks}
+        self._apply(self.plan_hooks(self.hooks, new))
+
+    def plan_hooks(self, current, new):
+        """Mutations to go from the current hooks to the new ones"""
+        result = []
+        current = {hook_name(h): h for h in current}
+        new = {hook_name(h): h for h in new}
+        hooks_id = self.identities.section("hooks", self._get_hooks_identities)
 
         added, missing, updated = dict_diff.diff(current, new)
-        for hook_name in missing:
-            hook_id = hooks_id[hook_name]
+        for name in missing:
+            hook_id = hooks_id[name]["id"]
             url = self._get_url("hooks", hook_id)
-            self._gh.delete(url)
+            result.append(Mutation("delete", url, None, "hooks",
+                                   "Delete hook '{}'".format(name)))
 
-        for hook_name in updated:
-            hook_id = hooks_id[hook_name]
-            hook = new[hook_name]
+        for name in updated:
+            hook_id = hooks_id[name]["id"]
+            hook = new[name]
             new_config = hook.get("config")
-            current_config = current[hook_name].get("config")
+            current_config = current[name].get("config")
             forbidden_keys = ['token', 'secret']
             if current_config != new_config and any(k in forbidden_keys
                                                     for k in new_config):
                 raise RuntimeError("Updating hooks with secrets is not supported")
             url = self._get_url("hooks", hook_id)
-            self._gh.patch(url, hook)
+            result.append(Mutation("patch", url, hook, "hooks",
+                                   "Update hook '{}'".format(name)))
 
-        for hook_name in added:
-            hook = new[hook_name]
+        for name in added:
+            hook = new[name]
             url = self._get_url("hooks")
-            self._gh.post(url, hook)
+            result.append(Mutation("post", url, hook, "hooks",
+                                   "Create hook '{}'".format(name)))
+        return result
+
+    def _get_hooks_identities(self):
+        """Ids of the hooks, for configurations not retrieved through this object"""
+        hooks = self._gh.get(self._get_url("hooks"), ["name", "config", "id"])
+        return {hook_name(h): dict(id=h["id"]) for h in hooks}
+
+    def _apply(self, mutations):
+        Plan(mutations).apply(self._gh)
+
+    def describe(self, sections=SECTIONS):
+        """Serializes the whole configuration into a dict
+
+        :param sections: sections of the configuration to retrieve, all by default
+        """
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            return self.describe_async(agh, sections).result()
 
-    def describe(self):
-        config = dict()
-        config["options"] = self.options
-        config["collaborators"] = self.collaborators
-        config["labels"] = self.labels
-        config["hooks"] = self.hooks
-        return config
+    def describe_async(self, agh, sections=SECTIONS):
+        """Retrieves the sections of the configuration concurrently
+
+        :param agh: handle to run the requests
+        :type agh: dothub.github_helper.AsyncGitHub
+        :param sections: sections of the configuration to retrieve, all by default
+        :return: a future of the same dict returned by describe
+        """
+        return github_helper.gather({
+            section: agh.submit(getattr, self, section)
+            for section in sections
+        })
+
+    def plan(self, current, config):
+        """Computes the changes needed to go from the current configuration to a new one
+
+        Only the sections present in the new configuration are taken into account.
+
+        :param current: configuration as returned by describe
+        :param config: desired configuration
+        :rtype: dothub.plan.Plan
+        """
+        result = Plan()
+        for section in self.SECTIONS:
+            if section in config:
+                plan_section = getattr(self, "plan_" + section)
+                result.extend(plan_section(current[section], config[section]))
+        return result
 
     def update(self, config):
-        if "options" in config:
-            self.options = config["options"]
-        if "collaborators" in config:
-            self.collaborators = config["collaborators"]
-        if "labels" in config:
-            self.labels = config["labels"]
-        if "hooks" in config:
-            self.hooks = config["hooks"]
+        """Updates the github configuration with the configuration data passed in"""
+        self.apply(self.plan(self.describe(), config))
+
+    def apply(self, plan):
+        """Sends all the changes of a plan computed through `plan`
+
+        :raises dothub.plan.PlanError: if any of the changes failed, once all the
+         changes that do not depend on them were applied
+        :rtype: dothub.plan.PlanResult
+        """
+        with github_helper.AsyncGitHub(self._gh, self.max_workers) as agh:
+            result = self.apply_async(plan, agh).result()
+        if not result.ok:
+            raise PlanError(result)
+        return result
+
+    def apply_async(self, plan, agh):
+        """Applies a plan, independent changes concurrently
+
+        :param plan: plan computed through `plan`
+        :type plan: dothub.plan.Plan
+        :param agh: handle to run the requests
+        :type agh: dothub.github_helper.AsyncGitHub
+        :return: a future of the `dothub.plan.PlanResult`
+        """
+        return plan.apply_async(agh)
@@ -65,7 +65,7 @@ def workspace_repo():
         return None
 
 
-def confirm_changes(current, new, abort=False):
+def confirm_changes(current, new, abort=False, plan=None):
     """Prints the proposed changes and asks for confirmation
 
     Keys present in current but missing in new are considered unchanged
@@ -73,10 +73,14 @@ def confirm_changes(current, new, abort=False):
     :param current: Current config to compare with
     :param new: new changes to apply
     :param abort: abort app if the user rejects changes (return false otherwise)
+    :param plan: plan with the requests that will be sent to apply the changes
+    :type plan: dothub.plan.Plan
     :return: True if the user wants the changes, False if there are no changes or rejected
     """
     added, removed, changed = diff_configs(current, new)
-    if not(added or removed or changed):
+    if plan is not None and not plan:
+        return False
+    if not(added or removed or changed or plan):
         return False
 
     LOG.info("Changes: ")
@@ -88,6 +92,11 @@ def confirm_changes(current, new, abort=False):
     for l, v in changed.items():
         LOG.info(click.style("C {0} ({1[old_value]} -> {1[new_value]})".format(l, v), fg='yellow'))
 
+    if plan:
+        LOG.info("Requests to send: ")
+        for mutation in plan:
+            LOG.info("  {} {} ({})".format(mutation.method.upper(), mutation.url, mutation))
+
     return click.confirm("Apply changes?", abort=abort, default=True)
 
 
@@ -20,7 +20,11 @@ setup(
     keywords=['configuration', 'github', 'code'],
     license='MIT',
     use_2to3=True,
-    install_requires=['requests', 'click', 'github_token', 'pyyaml', 'deepdiff', 'GitPython', 'six'],
+    install_requires=['requests', 'click', 'github_token', 'pyyaml', 'deepdiff', 'GitPython', 'six',
+                      'futures; python_version < "3"'],
+    extras_require={
+        'fast': ['orjson; python_version >= "3.6"'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',
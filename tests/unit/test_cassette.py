@@ -0,0 +1,120 @@
+"""Validates functionality on the cassette module
+
+Interactions are recorded against `requests_mock` and replayed without it, so any
+request not served from the cassette would fail.
+"""
+import json
+import os.path
+
+import pytest
+import requests_mock
+from mock import Mock
+
+from dothub import github_helper
+from dothub.cassette import RecordingTransport, ReplayTransport
+from dothub.repository import Repo
+
+CASSETTES_DIR = os.path.join(os.path.dirname(__file__), "..", "integration", "cassettes")
+URL = "https://api.github.com/repos/org/repo/labels"
+
+
+# #######
+# HELPERS
+# #######
+
+def github(transport):
+    """Gives a github helper that sends the requests through the transport"""
+    return github_helper.GitHub("user", "secret-token", transport=transport)
+
+
+def record(path, callback):
+    """Records the requests sent by callback while mocking github"""
+    transport = RecordingTransport(path)
+    with requests_mock.Mocker() as mock:
+        mock.register_uri("GET", URL, json=[{"name": "bug", "color": "f00"}],
+                          headers={"ETag": '"1"'})
+        mock.register_uri("POST", URL, json={"name": "new"}, status_code=201)
+        callback(github(transport))
+    transport.save()
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_record_and_replay(tmpdir):
+    """Recorded responses are served back without network access"""
+    path = str(tmpdir.join("cassette.json"))
+    record(path, lambda gh: gh.get("repos/org/repo/labels", ["name", "color"]))
+
+    gh = github(ReplayTransport(path))
+    assert gh.get("repos/org/repo/labels", ["name"]) == [{"name": "bug"}]
+
+
+def test_recorded_requests_contain_no_token(tmpdir):
+    """Neither the authorization nor any appearance of the token is stored"""
+    path = str(tmpdir.join("cassette.json"))
+    record(path, lambda gh: gh.post("repos/org/repo/labels", {"name": "secret-token"}))
+
+    with open(path) as f:
+        content = f.read()
+    assert "secret-token" not in content
+    interaction = json.loads(content)["http_interactions"][0]
+    assert interaction["request"]["method"] == "POST"
+    assert interaction["request"]["headers"] == {}
+    assert interaction["response"]["status"]["code"] == 201
+
+
+def test_replayed_responses_keep_headers(tmpdir):
+    """Headers are replayed so validators and links keep working"""
+    path = str(tmpdir.join("cassette.json"))
+    record(path, lambda gh: gh.get("repos/org/repo/labels", ["name"]))
+
+    response = ReplayTransport(path).send("GET", URL + "?per_page=100")
+    assert response.headers["etag"] == '"1"'
+    assert response.json() == [{"name": "bug", "color": "f00"}]
+
+
+def test_repeated_requests_are_replayed_in_order(tmpdir):
+    """Each recorded response is used once, the last one is repeated"""
+    path = str(tmpdir.join("cassette.json"))
+    interactions = [
+        dict(request=dict(method="GET", uri=URL),
+             response=dict(status=dict(code=200, message="OK"), headers={},
+                           body=dict(encoding="utf-8", string=str(i))))
+        for i in range(2)
+    ]
+    with open(path, "w") as f:
+        json.dump(dict(http_interactions=interactions), f)
+
+    transport = ReplayTransport(path)
+    assert [transport.send("GET", URL).text for _ in range(3)] == ["0", "1", "1"]
+
+
+def test_request_not_recorded_fails(tmpdir):
+    """Requests not present in the cassette are not silently ignored"""
+    path = str(tmpdir.join("cassette.json"))
+    record(path, lambda gh: None)
+
+    with pytest.raises(RuntimeError):
+        ReplayTransport(path).send("GET", URL)
+
+
+def test_replay_latency(tmpdir):
+    """The latency configured is waited on each response"""
+    path = str(tmpdir.join("cassette.json"))
+    record(path, lambda gh: gh.get("repos/org/repo/labels", ["name"]))
+    sleep = Mock()
+
+    ReplayTransport(path, latency=0.2, sleep=sleep).send("GET", URL)
+    sleep.assert_called_once_with(0.2)
+
+
+def test_replay_betamax_cassette():
+    """The cassettes recorded for the integration tests can be replayed"""
+    transport = ReplayTransport(os.path.join(CASSETTES_DIR, "configure_repo.json"))
+    repo = Repo(github(transport), "dothub-sandbox", "test-repo")
+
+    config = repo.describe()
+    assert config["options"]["name"] == "test-repo"
+    assert "bug" in config["labels"]
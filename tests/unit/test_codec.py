@@ -0,0 +1,92 @@
+"""Validates functionality on the codec module"""
+import json
+
+import pytest
+
+from dothub.codec import loads_masked, get_codec, JsonCodec, OrjsonCodec, CODECS
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_mask_object():
+    """Only the fields requested are kept"""
+    assert loads_masked('{"a": 1, "b": 2}', ["a"]) == {"a": 1}
+
+
+def test_mask_listing():
+    """The mask is applied to each object of a listing"""
+    text = json.dumps([{"name": "repo{}".format(i), "id": i, "owner": {"login": "mario"}}
+                       for i in range(3)])
+    assert loads_masked(text, ["name"]) == [{"name": "repo0"}, {"name": "repo1"},
+                                            {"name": "repo2"}]
+
+
+def test_nested_values_are_kept_whole():
+    """The mask only applies to the top level objects"""
+    text = '[{"permissions": {"admin": true, "push": false}, "extra": [1, {"a": 2}]}]'
+    assert loads_masked(text, ["permissions"]) == [{"permissions": {"admin": True,
+                                                                    "push": False}}]
+
+
+def test_empty_listing_and_whitespace():
+    """Whitespace between values is accepted"""
+    assert loads_masked(" [ ] ", ["a"]) == []
+    assert loads_masked(' [ {"a" : 1} ,\n {"b": 2} ] \n', ["a"]) == [{"a": 1}, {}]
+
+
+def test_scalars_are_not_masked():
+    """Values that are not objects are returned as they are"""
+    assert loads_masked('["a", 1, null]', ["a"]) == ["a", 1, None]
+    assert loads_masked('"text"', []) == "text"
+
+
+@pytest.mark.parametrize("text", ["", "[1,", "[1 2]", '{"a": }', "[1] x"])
+def test_invalid_json(text):
+    """Invalid documents raise a ValueError"""
+    with pytest.raises(ValueError):
+        loads_masked(text, ["a"])
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codecs_round_trip(name):
+    """All codecs encode to bytes and decode bytes and text"""
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    codec = get_codec(name)
+    data = codec.dumps({"a": [1, "b"]})
+    assert isinstance(data, bytes)
+    assert codec.loads(data) == {"a": [1, "b"]}
+    assert codec.loads(data.decode("utf-8")) == {"a": [1, "b"]}
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_codecs_mask(name):
+    """All codecs apply the mask in the same way"""
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    text = b'[{"a": 1, "b": {"c": 2}}, 3]'
+    assert get_codec(name).loads_masked(text, ["b"]) == [{"b": {"c": 2}}, 3]
+    assert get_codec(name).loads_masked(b'{"a": 1, "b": 2}', ["a"]) == {"a": 1}
+
+
+def test_orjson_masks_incrementally():
+    """orjson is not used for masked decodes, which would decode whole documents"""
+    assert OrjsonCodec.loads_masked == JsonCodec.loads_masked
+
+
+def test_unknown_codec():
+    """Asking for an unknown codec raises a ValueError"""
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+def test_default_codec_is_the_fastest_available():
+    """orjson is used when installed"""
+    try:
+        import orjson  # noqa
+    except ImportError:
+        assert isinstance(get_codec(), JsonCodec)
+    else:
+        assert isinstance(get_codec(), OrjsonCodec)
@@ -0,0 +1,171 @@
+"""Validates functionality on the fake_github module
+
+The server is run in process and used through the same helpers as github.
+"""
+import pytest
+import requests
+
+from dothub import github_helper
+from dothub.fake_github import FakeGitHub, FakeGitHubServer, generate_org
+from dothub.organization import Organization
+from dothub.repository import Repo
+
+
+# ########
+# FIXTURES
+# ########
+
+@pytest.fixture
+def org():
+    """Gives a small synthetic organization"""
+    return generate_org("fake-org", repos=3, teams=2, members=5)
+
+
+@pytest.fixture
+def server(org):
+    """Gives a running server of the organization"""
+    with FakeGitHubServer(FakeGitHub(org)) as server:
+        yield server
+
+
+@pytest.fixture
+def gh(server):
+    """Gives a github helper pointing to the fake server"""
+    return github_helper.GitHub("user", "token", api_url=server.url)
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_generated_org_is_deterministic():
+    """The same seed generates the same organization"""
+    first, second = generate_org(seed=3), generate_org(seed=3)
+    assert first.members == second.members
+    assert first.repos == second.repos
+
+
+def test_describe_repo(gh, org):
+    """The config of a repository can be retrieved"""
+    config = Repo(gh, "fake-org", "repo0").describe()
+
+    repo = org.repos["repo0"]
+    assert config["options"]["description"] == "Synthetic repo repo0"
+    assert config["labels"] == {k: dict(color=v) for k, v in repo["labels"].items()}
+    assert config["collaborators"] == {k: dict(permission=v)
+                                       for k, v in repo["collaborators"].items()}
+    assert len(config["hooks"]) == 1
+
+
+def test_describe_org(gh, org):
+    """The config of an organization can be retrieved"""
+    config = Organization(gh, "fake-org").describe()
+
+    assert config["members"] == {k: dict(role=v) for k, v in org.members.items()}
+    assert sorted(config["teams"]) == ["Team 0", "Team 1"]
+    assert sorted(Organization(gh, "fake-org").repos) == ["repo0", "repo1", "repo2"]
+
+
+def test_update_repo(gh, org):
+    """Changes sent are applied to the organization"""
+    repo = Repo(gh, "fake-org", "repo0")
+    config = repo.describe()
+    config["labels"] = {"new": dict(color="000000")}
+    config["collaborators"] = {}
+
+    repo.update(config)
+    assert org.repos["repo0"]["labels"] == {"new": "000000"}
+    assert org.repos["repo0"]["collaborators"] == {}
+
+
+def test_create_team(gh, org):
+    """Teams created get members and repositories assigned"""
+    organization = Organization(gh, "fake-org")
+    teams = organization.teams
+    teams["New team"] = dict(description="", privacy="closed", permission="pull",
+                             members={"user0": dict(role="member")},
+                             repositories={"repo1": dict(permission="push")})
+
+    organization.teams = teams
+    new_team = [t for t in org.teams.values() if t["name"] == "New team"][0]
+    assert new_team["members"] == {"user0": "member"}
+    assert new_team["repos"] == {"repo1": "push"}
+
+
+def test_listings_are_paginated(server):
+    """Listings follow the page size requested and link the next pages"""
+    server.app.org = generate_org("fake-org", repos=5)
+    response = requests.get(server.url + "/orgs/fake-org/repos?per_page=2")
+
+    assert [r["name"] for r in response.json()] == ["repo0", "repo1"]
+    assert response.links["next"]["url"].endswith("page=2&per_page=2")
+    assert response.links["last"]["url"].endswith("page=3&per_page=2")
+    gh = github_helper.GitHub("user", "token", api_url=server.url)
+    assert len(gh.get("orgs/fake-org/repos?per_page=2", ["name"])) == 5
+
+
+def test_etags_allow_conditional_requests(server):
+    """Unmodified resources return a 304 that does not consume the rate limit"""
+    url = server.url + "/orgs/fake-org"
+    response = requests.get(url)
+    remaining = response.headers["X-RateLimit-Remaining"]
+
+    response = requests.get(url, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["X-RateLimit-Remaining"] == remaining
+
+
+def test_rate_limit_is_enforced(org):
+    """Requests over the rate limit are rejected until it resets"""
+    app = FakeGitHub(org, rate_limit=1)
+    status, headers, _ = app.handle("GET", "/orgs/fake-org", {}, b"")
+    assert status == 200
+    assert headers["X-RateLimit-Remaining"] == "0"
+
+    status, headers, _ = app.handle("GET", "/orgs/fake-org", {}, b"")
+    assert status == 403
+
+
+def test_latency_is_added(org):
+    """The latency configured is waited on each request"""
+    sleeps = []
+    app = FakeGitHub(org, latency=0.1, sleep=sleeps.append)
+    app.handle("GET", "/orgs/fake-org", {}, b"")
+    assert sleeps == [0.1]
+
+
+def test_unknown_resources(org):
+    """Unknown urls and resources return a 404"""
+    app = FakeGitHub(org)
+    assert app.handle("GET", "/unknown", {}, b"")[0] == 404
+    assert app.handle("GET", "/repos/fake-org/missing", {}, b"")[0] == 404
+    assert app.handle("GET", "/orgs/other-org", {}, b"")[0] == 404
+
+
+def test_describe_many_teams(server):
+    """The members and repos of each team are matched to it"""
+    org = server.app.org = generate_org("fake-org", repos=4, teams=6, members=8, seed=1)
+    teams = Organization(github_helper.GitHub("user", "token", api_url=server.url),
+                         "fake-org", max_workers=4).teams
+
+    assert teams == {
+        team["name"]: dict(
+            description=team["description"], privacy=team["privacy"],
+            permission=team["permission"],
+            members={k: dict(role=v) for k, v in team["members"].items()},
+            repositories={k: dict(permission=v) for k, v in team["repos"].items()},
+        )
+        for team in org.teams.values()
+    }
+
+
+def test_member_roles_come_from_filtered_listings(server, gh, org):
+    """The roles of the members are known without a request per member"""
+    admins = requests.get(server.url + "/orgs/fake-org/members?role=admin").json()
+    assert sorted(m["login"] for m in admins) == sorted(
+        login for login, role in org.members.items() if role == "admin")
+
+    server.app.requests = 0
+    members = Organization(gh, "fake-org").members
+    assert members == {k: dict(role=v) for k, v in org.members.items()}
+    assert server.app.requests == 2
@@ -6,10 +6,19 @@ code under test in github_helper.py
 To mock out the HTTP requests being sent `requests_mock` is used
 """
 import pytest
+import requests
 import requests_mock
 import os.path
+import threading
+import time
+from mock import Mock, PropertyMock, ANY
 
-from dothub.github_helper import GitHub, DEFAULT_API_URL
+from dothub.github_helper import (GitHub, AsyncGitHub, AdaptiveConcurrency, RateLimiter,
+                                  RateBudget, RetryPolicy, Transport, ReadCache, WritePacer,
+                                  gather, then, DEFAULT_API_URL)
+from dothub import github_helper
+from dothub.codec import JsonCodec
+from dothub.http_cache import HttpCache
 
 
 # #######
@@ -153,3 +162,603 @@ def test_use_different_base_url():
         assert result is not None
 
 
+def test_get_follows_pagination(gh):
+    """Listings split in pages are retrieved as a single list"""
+    next_url = DEFAULT_API_URL + "/url?page=2"
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url?page=2", json=[dict(key1=2, key3=3)])
+        register_uri(mock, "GET", "url?per_page=100", json=[dict(key1=1, key3=3)],
+                     headers={"Link": '<{}>; rel="next"'.format(next_url)})
+        result = gh.get("url", fields=["key1"])
+        assert result == [dict(key1=1), dict(key1=2)]
+
+
+def test_get_retrieves_known_pages_concurrently():
+    """Once the last page is known the following pages are requested concurrently"""
+    page_url = DEFAULT_API_URL + "/url?per_page=100&page={}"
+    in_flight = [0]
+    max_in_flight = [0]
+    lock = threading.Lock()
+
+    def send(method, url, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        page = int(url.split("&page=")[-1]) if "&page=" in url else 1
+        response = Mock(status_code=200, headers={}, links={})
+        response.content = '[{{"key1": {}}}]'.format(page).encode("utf-8")
+        if page == 1:
+            response.links = dict(next=dict(url=page_url.format(2)),
+                                  last=dict(url=page_url.format(4)))
+        return response
+
+    transport = Mock()
+    transport.send.side_effect = send
+    gh = GitHub(user="User", token="TOKEN", transport=transport)
+
+    result = gh.get("url", fields=["key1"])
+    assert result == [dict(key1=1), dict(key1=2), dict(key1=3), dict(key1=4)]
+    assert max_in_flight[0] == 3
+
+
+def test_close_releases_the_page_threads():
+    """Closing the helper shuts down the threads used to retrieve pages"""
+    gh = GitHub(user="User", token="TOKEN")
+    executor = gh._get_page_executor()
+    gh.close()
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: None)
+    assert gh._get_page_executor() is not executor
+    gh.close()
+
+
+def test_page_range():
+    """The urls of the pages between the next and the last one are generated"""
+    assert github_helper._page_range("http://x/y?per_page=2&page=2",
+                                     "http://x/y?per_page=2&page=4") == [
+        "http://x/y?per_page=2&page=2",
+        "http://x/y?per_page=2&page=3",
+        "http://x/y?per_page=2&page=4",
+    ]
+    assert github_helper._page_range("http://x/y?page=2", None) == []
+    assert github_helper._page_range("http://x/y?cursor=a", "http://x/y?cursor=b") == []
+
+
+def test_get_requests_max_page_size(gh):
+    """Requests ask for the biggest page github allows"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=[])
+        gh.get("url", fields=["key1"])
+        assert mock.last_request.qs == {"per_page": ["100"]}
+
+
+def test_iter_get_yields_items_lazily(gh):
+    """iter_get only requests the next page once the previous one is consumed"""
+    next_url = DEFAULT_API_URL + "/url?page=2"
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url?page=2", json=[dict(key1=2)])
+        register_uri(mock, "GET", "url?per_page=100", json=[dict(key1=1, key3=3)],
+                     headers={"Link": '<{}>; rel="next"'.format(next_url)})
+        items = gh.iter_get("url", fields=["key1"])
+        assert next(items) == dict(key1=1)
+        assert mock.call_count == 1
+        assert list(items) == [dict(key1=2)]
+        assert mock.call_count == 2
+
+
+def test_iter_get_on_single_object_raises(gh):
+    """iter_get can only be used against listings"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1=1))
+        with pytest.raises(ValueError):
+            list(gh.iter_get("url", fields=["key1"]))
+
+
+def test_get_not_modified_is_served_from_cache(tmpdir):
+    """A 304 from github returns the body stored in the cache"""
+    gh = GitHub(user="User", token="TOKEN", cache=HttpCache(str(tmpdir)))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a"), headers={"ETag": '"v1"'})
+        assert gh.get("url", fields=["key1"]) == dict(key1="a")
+
+        register_uri(mock, "GET", "url", status_code=304)
+        assert gh.get("url", fields=["key1"]) == dict(key1="a")
+        assert mock.last_request.headers["If-None-Match"] == '"v1"'
+
+
+def test_cache_is_not_shared_across_credentials(tmpdir):
+    """Responses cached for a user are not sent as conditional for other users"""
+    cache = HttpCache(str(tmpdir))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a"), headers={"ETag": '"v1"'})
+        GitHub(user="User", token="TOKEN", cache=cache).get("url", fields=["key1"])
+        GitHub(user="Other", token="TOKEN2", cache=cache).get("url", fields=["key1"])
+        assert "If-None-Match" not in mock.last_request.headers
+
+
+def test_rate_limit_budget_is_tracked(gh):
+    """The budget reported by github is exposed in the helper"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json={}, headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4999",
+            "X-RateLimit-Reset": "1372700873",
+        })
+        gh.get("url", fields=[])
+        assert gh.rate_limit == RateBudget(5000, 4999, 1372700873)
+
+
+def test_rate_limited_request_is_retried_after_waiting():
+    """Requests rejected by a secondary limit are resent after Retry-After"""
+    sleeps = []
+    gh = GitHub(user="User", token="TOKEN",
+                rate_limiter=RateLimiter(clock=lambda: 1000, sleep=sleeps.append))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", response_list=[
+            dict(status_code=403, headers={"Retry-After": "30"}),
+            dict(json=dict(key1="a")),
+        ])
+        assert gh.get("url", fields=["key1"]) == dict(key1="a")
+        assert sleeps == [30]
+
+
+def test_requests_wait_for_reset_when_budget_is_low():
+    """Once the remaining budget goes under the reserve requests wait for the reset"""
+    sleeps = []
+    gh = GitHub(user="User", token="TOKEN",
+                rate_limiter=RateLimiter(reserve=10, clock=lambda: 1000, sleep=sleeps.append))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json={}, headers={
+            "X-RateLimit-Remaining": "5",
+            "X-RateLimit-Reset": "1100",
+        })
+        gh.get("url", fields=[])
+        assert sleeps == []
+        gh.get("url", fields=[])
+        assert sleeps == [101]
+
+
+def test_graphql_budget_is_tracked_apart():
+    """GraphQL queries do not count against the budget of the REST api"""
+    sleeps = []
+    gh = GitHub(user="User", token="TOKEN",
+                rate_limiter=RateLimiter(reserve=10, clock=lambda: 1000, sleep=sleeps.append))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json={}, headers={
+            "X-RateLimit-Remaining": "4000",
+            "X-RateLimit-Reset": "1100",
+            "X-RateLimit-Resource": "core",
+        })
+        register_uri(mock, "POST", "graphql", json=dict(data={}), headers={
+            "X-RateLimit-Remaining": "5",
+            "X-RateLimit-Reset": "1100",
+            "X-RateLimit-Resource": "graphql",
+        })
+        gh.get("url", fields=[])
+        gh.graphql("query {}")
+        gh.get("url", fields=[])
+        assert gh.rate_limit.remaining == 4000
+        assert sleeps == []
+        gh.graphql("query {}")
+        assert sleeps == [101]
+
+
+def test_forbidden_without_rate_limit_is_not_retried(gh):
+    """A plain 403 raises without retrying"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", status_code=403)
+        with pytest.raises(requests.HTTPError):
+            gh.get("url", fields=[])
+        assert mock.call_count == 1
+
+
+def test_transient_errors_are_retried():
+    """A get failing with a 502 is resent"""
+    sleeps = []
+    gh = GitHub(user="User", token="TOKEN", retry_policy=RetryPolicy(sleep=sleeps.append))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", response_list=[
+            dict(status_code=502),
+            dict(exc=requests.ConnectionError),
+            dict(json=dict(key1="a")),
+        ])
+        assert gh.get("url", fields=["key1"]) == dict(key1="a")
+        assert len(sleeps) == 2
+        assert 0 <= sleeps[1] <= 1  # backoff * 2 ** 1
+        assert gh.retry_policy.retries == 2
+
+
+def test_post_is_not_retried_by_default():
+    """Non idempotent methods are not resent unless opted in"""
+    gh = GitHub(user="User", token="TOKEN", retry_policy=RetryPolicy(sleep=lambda _: None))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", "url", status_code=503)
+        with pytest.raises(requests.HTTPError):
+            gh.post("url", {})
+        assert mock.call_count == 1
+
+
+def test_post_retried_when_opted_in():
+    """Post requests can be retried by adding them to the methods of the policy"""
+    policy = RetryPolicy(methods=["post"], sleep=lambda _: None)
+    gh = GitHub(user="User", token="TOKEN", retry_policy=policy)
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", "url", response_list=[
+            dict(status_code=503),
+            dict(json={}),
+        ])
+        assert gh.post("url", {}) == {}
+
+
+def test_graphql_queries_are_retried():
+    """GraphQL queries are sent as posts but they are resent as any other read"""
+    gh = GitHub(user="User", token="TOKEN", retry_policy=RetryPolicy(sleep=lambda _: None))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", "graphql", response_list=[
+            dict(status_code=502),
+            dict(json=dict(data=dict(key1="a"))),
+        ])
+        assert gh.graphql("query {}") == dict(key1="a")
+        assert mock.call_count == 2
+
+
+def test_retries_stop_when_budget_is_exhausted():
+    """No more retries are performed once the budget of the run is consumed"""
+    policy = RetryPolicy(max_retries=5, budget=2, sleep=lambda _: None)
+    gh = GitHub(user="User", token="TOKEN", retry_policy=policy)
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", status_code=503)
+        with pytest.raises(requests.HTTPError):
+            gh.get("url", fields=[])
+        assert mock.call_count == 3
+
+
+def test_async_get_returns_future(gh):
+    """The async helper returns futures of the same results"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a", key2=1))
+        with AsyncGitHub(gh) as agh:
+            future = agh.get("url", fields=["key1"])
+            assert future.result() == dict(key1="a")
+
+
+def test_gather_combines_results():
+    """gather resolves into a dict with the result of each future"""
+    with AsyncGitHub(None, max_workers=2) as agh:
+        result = gather(dict(
+            a=agh.submit(lambda: 1),
+            b=agh.submit(lambda: 2),
+        ))
+        assert result.result() == dict(a=1, b=2)
+
+
+def test_gather_propagates_failures():
+    """If any of the futures fails the combined future fails"""
+    def fail():
+        raise RuntimeError("Boom")
+
+    with AsyncGitHub(None, max_workers=2) as agh:
+        result = gather(dict(a=agh.submit(lambda: 1), b=agh.submit(fail)))
+        with pytest.raises(RuntimeError):
+            result.result()
+
+
+def test_then_chains_futures():
+    """then resolves with the result of the function, following returned futures"""
+    with AsyncGitHub(None, max_workers=1) as agh:
+        assert then(agh.submit(lambda: 1), lambda x: x + 1).result() == 2
+        # A single thread is enough, as nothing blocks waiting for the chained futures
+        chained = then(agh.submit(lambda: 1), lambda x: agh.submit(lambda: x + 2))
+        assert chained.result() == 3
+
+
+def test_then_propagates_failures():
+    """then fails if the future or the function failed"""
+    def fail(*_):
+        raise RuntimeError("Boom")
+
+    with AsyncGitHub(None, max_workers=1) as agh:
+        with pytest.raises(RuntimeError):
+            then(agh.submit(fail), lambda x: x).result()
+        with pytest.raises(RuntimeError):
+            then(agh.submit(lambda: 1), fail).result()
+
+
+def test_requests_are_sent_through_the_transport():
+    """A custom transport can be injected to send the requests"""
+    transport = Mock()
+    transport.send.return_value.status_code = 200
+    transport.send.return_value.headers = {}
+    transport.send.return_value.links = {}
+    transport.send.return_value.content = b'{"key1": "a"}'
+    transport.send.return_value.json.return_value = dict(key1="a")
+    gh = GitHub(user="User", token="TOKEN", transport=transport)
+
+    assert gh.get("url", fields=["key1"]) == dict(key1="a")
+    transport.send.assert_called_once_with("get", DEFAULT_API_URL + "/url?per_page=100",
+                                           auth=("User", "TOKEN"), timeout=ANY)
+
+
+def test_transport_uses_a_session_per_thread():
+    """Sessions are not shared across threads but the connection pool is"""
+    transport = Transport(pool_size=4)
+    with AsyncGitHub(None, max_workers=1) as agh:
+        other_session = agh.submit(lambda: transport.session).result()
+    assert transport.session is transport.session
+    assert transport.session is not other_session
+    assert (transport.session.get_adapter("https://api.github.com") is
+            other_session.get_adapter("https://api.github.com"))
+
+
+def test_read_cache_sends_identical_gets_once():
+    """Gets to the same url are only sent once and results are independent copies"""
+    gh = GitHub(user="User", token="TOKEN", read_cache=ReadCache())
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a", key2="b"))
+        first = gh.get("url", fields=["key1"])
+        second = gh.get("url", fields=["key1", "key2"])
+        assert first == dict(key1="a")
+        assert second == dict(key1="a", key2="b")
+        assert mock.call_count == 1
+        assert (gh.read_cache.hits, gh.read_cache.misses) == (1, 1)
+
+
+def test_read_cache_shares_requests_in_flight():
+    """Concurrent gets to the same url wait for the request already sent"""
+    cache = ReadCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "[]", None
+
+    with AsyncGitHub(None, max_workers=2) as agh:
+        first = agh.submit(cache.fetch, "url", "url", loader)
+        started.wait()
+        second = agh.submit(cache.fetch, "url", "url", loader)
+        release.set()
+        assert first.result() == second.result() == ("[]", None)
+    assert len(calls) == 1
+
+
+def test_read_cache_invalidated_by_writes():
+    """Writing to a resource invalidates it and the listings containing it"""
+    gh = GitHub(user="User", token="TOKEN", read_cache=ReadCache())
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "repos/o/r", json=dict(name="r"))
+        register_uri(mock, "GET", "repos/o/r/labels", json=[dict(name="bug")])
+        register_uri(mock, "GET", "repos/o/r/hooks", json=[])
+        register_uri(mock, "PATCH", "repos/o/r/labels/bug", json={})
+        for url in ["repos/o/r", "repos/o/r/labels", "repos/o/r/hooks"]:
+            gh.get(url, fields=["name"])
+
+        gh.patch("repos/o/r/labels/bug", dict(color="000000"))
+        for url in ["repos/o/r", "repos/o/r/labels", "repos/o/r/hooks"]:
+            gh.get(url, fields=["name"])
+
+        assert gh.read_cache.misses == 4  # Only the labels listing was requested again
+
+
+def test_read_cache_memberships_invalidate_members():
+    """Memberships are considered the same resource as members"""
+    gh = GitHub(user="User", token="TOKEN", read_cache=ReadCache())
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "orgs/o/members", json=[])
+        register_uri(mock, "PUT", "orgs/o/memberships/mario", json={})
+        gh.get("orgs/o/members", fields=["login"])
+        gh.put("orgs/o/memberships/mario", dict(role="admin"))
+        gh.get("orgs/o/members", fields=["login"])
+        assert mock.call_count == 3
+
+
+def test_read_cache_teams_invalidate_org_teams():
+    """Writing to a team invalidates the listings of teams of the orgs"""
+    gh = GitHub(user="User", token="TOKEN", read_cache=ReadCache())
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "orgs/o/teams", json=[dict(name="team", id=8)])
+        register_uri(mock, "GET", "orgs/o/members", json=[])
+        register_uri(mock, "DELETE", "teams/8", status_code=204)
+        gh.get("orgs/o/teams", fields=["name"])
+        gh.get("orgs/o/members", fields=["login"])
+        gh.delete("teams/8")
+        gh.get("orgs/o/teams", fields=["name"])
+        gh.get("orgs/o/members", fields=["login"])
+        assert gh.read_cache.misses == 3  # Only the teams listing was requested again
+
+
+def test_payloads_and_responses_go_through_the_codec():
+    """Payloads are encoded and responses decoded once with the codec"""
+    codec = Mock(wraps=JsonCodec())
+    gh = GitHub(user="User", token="TOKEN", codec=codec)
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", "repos/o/r/labels", json=dict(name="bug"))
+        assert gh.post("repos/o/r/labels", dict(name="bug")) == dict(name="bug")
+        assert mock.last_request.json() == dict(name="bug")
+        assert mock.last_request.headers["Content-Type"] == "application/json"
+    codec.dumps.assert_called_once_with(dict(name="bug"))
+    codec.loads.assert_called_once_with(b'{"name": "bug"}')
+
+
+def test_response_text_only_built_for_debug_logs():
+    """The body is not converted to text unless debug logs are enabled"""
+    transport = Mock()
+    response = transport.send.return_value
+    response.status_code = 200
+    response.headers = {}
+    response.links = {}
+    response.content = b'{"key1": "a"}'
+    type(response).text = PropertyMock(side_effect=AssertionError("text accessed"))
+    gh = GitHub(user="User", token="TOKEN", transport=transport)
+
+    assert gh.get("url", fields=["key1"]) == dict(key1="a")
+
+
+def test_validators_are_recorded_once_enabled(gh):
+    """Validators with the ETag and a fingerprint are kept for each resource read"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a", key2="b"),
+                     headers={"ETag": '"v1"'})
+        gh.get("url", fields=["key1"])
+        assert gh.validators is None
+
+        gh.record_validators()
+        gh.get("url", fields=["key1"])
+    assert gh.validators == {"url": dict(fields=["key1"], etag='"v1"', fingerprint=ANY)}
+
+
+def test_unchanged_resource_verified_with_conditional_request(gh):
+    """A 304 to the stored ETag proves the resource did not change"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a"), headers={"ETag": '"v1"'})
+        gh.record_validators()
+        gh.get("url", fields=["key1"])
+        register_uri(mock, "GET", "url", status_code=304)
+
+        assert gh.is_unchanged("url", gh.validators["url"])
+        assert mock.last_request.headers["If-None-Match"] == '"v1"'
+
+
+def test_resource_changes_detected_through_fingerprint(gh):
+    """Resources are compared by the fields retrieved, other changes are ignored"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", json=dict(key1="a", key2="b"))
+        gh.record_validators()
+        gh.get("url", fields=["key1"])
+        validator = gh.validators["url"]
+
+        register_uri(mock, "GET", "url", json=dict(key1="a", key2="c"))
+        assert gh.is_unchanged("url", validator)
+        register_uri(mock, "GET", "url", json=dict(key1="b", key2="c"))
+        assert not gh.is_unchanged("url", validator)
+
+
+def test_writes_are_paced():
+    """Writes leave the interval of the pacer between each other"""
+    now = [1000]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    pacer = WritePacer(interval=2, clock=lambda: now[0], sleep=sleep)
+    gh = GitHub(user="User", token="TOKEN", write_pacer=pacer)
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", "url", json={})
+        register_uri(mock, "GET", "url", json={})
+        gh.post("url", {})
+        gh.get("url", fields=[])
+        gh.post("url", {})
+        gh.post("url", {})
+    assert sleeps == [2, 2]
+
+
+def test_secondary_limit_only_holds_back_writes():
+    """A Retry-After on a write delays the following writes but not the reads"""
+    now = [1000]
+    sleeps = []
+    limiter_sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    pacer = WritePacer(interval=0, clock=lambda: now[0], sleep=sleep)
+    gh = GitHub(user="User", token="TOKEN", write_pacer=pacer,
+                rate_limiter=RateLimiter(clock=lambda: now[0], sleep=limiter_sleeps.append))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "PUT", "url", response_list=[
+            dict(status_code=403, headers={"Retry-After": "60"}),
+            dict(json=dict(key1="a")),
+        ])
+        register_uri(mock, "GET", "url", json={})
+        assert gh.put("url", {}) == dict(key1="a")
+        gh.get("url", fields=[])
+    assert sleeps == [60]
+    assert limiter_sleeps == []
+
+
+def test_pacer_limits_concurrent_writes():
+    """No more writes than allowed are in flight at the same time"""
+    pacer = WritePacer(interval=0, max_concurrent=2)
+    in_flight = [0]
+    max_in_flight = [0]
+    lock = threading.Lock()
+
+    def write():
+        with pacer.slot():
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+
+    threads = [threading.Thread(target=write) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_in_flight[0] == 2
+
+
+def test_adaptive_concurrency_grows_while_healthy():
+    """The limit grows by one read per round of healthy reads"""
+    concurrency = AdaptiveConcurrency(max_limit=4, initial=2, clock=lambda: 0)
+    for _ in range(3):
+        concurrency.release(concurrency.acquire())
+    assert concurrency.limit == 3
+    for _ in range(10):
+        concurrency.release(concurrency.acquire())
+    assert concurrency.limit == 4
+    assert concurrency.history == [[0.0, 2], [0, 3], [0, 4]]
+
+
+def test_adaptive_concurrency_is_cut_on_overload():
+    """The limit is halved once for all the reads in flight when github is overloaded"""
+    now = [0]
+    concurrency = AdaptiveConcurrency(max_limit=8, initial=8, clock=lambda: now[0])
+    starts = [concurrency.acquire() for _ in range(3)]
+    now[0] = 1
+    for start in starts:
+        concurrency.release(start, overloaded=True)
+    assert concurrency.limit == 4
+    concurrency.release(concurrency.acquire(), overloaded=True)
+    assert concurrency.limit == 2
+
+
+def test_adaptive_concurrency_does_not_grow_on_slow_reads():
+    """Reads way slower than the fastest seen stop the growth"""
+    now = [0]
+    concurrency = AdaptiveConcurrency(max_limit=8, initial=1, clock=lambda: now[0])
+    start = concurrency.acquire()
+    now[0] += 0.1
+    concurrency.release(start)
+    assert concurrency.limit == 2
+    for _ in range(4):
+        start = concurrency.acquire()
+        now[0] += 1
+        concurrency.release(start)
+    assert concurrency.limit == 2
+
+
+def test_reads_report_overload_to_the_adaptive_concurrency():
+    """Transient errors on reads cut the reads allowed in flight"""
+    concurrency = AdaptiveConcurrency(max_limit=8, initial=8)
+    gh = GitHub(user="User", token="TOKEN", read_concurrency=concurrency,
+                retry_policy=RetryPolicy(sleep=lambda _: None))
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "GET", "url", response_list=[
+            dict(status_code=503),
+            dict(json={}),
+        ])
+        register_uri(mock, "POST", "url", status_code=503)
+        gh.get("url", fields=[])
+        assert concurrency.limit == 4
+        with pytest.raises(requests.HTTPError):
+            gh.post("url", {})
+        assert concurrency.limit == 4
@@ -0,0 +1,183 @@
+"""Validates functionality on the graphql module
+
+All GraphQL queries are sent to a single endpoint, the responses are mocked with
+`requests_mock` by looking at the query and variables sent.
+"""
+import json
+import os.path
+
+import pytest
+import requests_mock
+
+from dothub import github_helper, graphql
+
+
+# #######
+# HELPERS
+# #######
+
+def page(items, cursor=None, key="edges"):
+    """Builds a connection page, with a next page if a cursor is given"""
+    return {
+        "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+        key: items,
+    }
+
+
+def register_graphql(mock, responder):
+    """Registers the graphql endpoint, responses are generated by the responder
+
+    The responder receives the query and the variables and returns the data
+    """
+    def callback(request, _):
+        body = json.loads(request.body)
+        return dict(data=responder(body["query"], body["variables"]))
+    url = os.path.join(github_helper.DEFAULT_API_URL, "graphql")
+    mock.register_uri("POST", url, json=callback)
+
+
+# ########
+# FIXTURES
+# ########
+
+@pytest.fixture
+def gh():
+    """Gives an instance of github helper"""
+    return github_helper.GitHub(user="User", token="TOKEN")
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_graphql_errors_raise(gh):
+    """Errors reported by github on a query raise"""
+    with requests_mock.Mocker() as mock:
+        url = os.path.join(github_helper.DEFAULT_API_URL, "graphql")
+        mock.register_uri("POST", url, json=dict(errors=[dict(message="Bad query")]))
+        with pytest.raises(RuntimeError):
+            gh.graphql("query { viewer { login } }")
+
+
+def test_paginate_follows_cursor(gh):
+    """All the pages of a connection are retrieved"""
+    def responder(_, variables):
+        if variables.get("cursor") is None:
+            return dict(items=page([1, 2], cursor="c1"))
+        return dict(items=page([3]))
+
+    with requests_mock.Mocker() as mock:
+        register_graphql(mock, responder)
+        result = list(graphql.paginate(gh, "query", ["items"]))
+        assert result == [1, 2, 3]
+        assert mock.call_count == 2
+
+
+def test_get_org_members_with_roles(gh):
+    """Org members are returned with their role as in the REST api"""
+    def responder(_, variables):
+        assert variables["org"] == "ORG"
+        return dict(organization=dict(membersWithRole=page([
+            dict(role="ADMIN", node=dict(login="member1")),
+            dict(role="MEMBER", node=dict(login="member2")),
+        ])))
+
+    with requests_mock.Mocker() as mock:
+        register_graphql(mock, responder)
+        assert graphql.get_org_members(gh, "ORG") == dict(
+            member1=dict(role="admin"),
+            member2=dict(role="member"),
+        )
+
+
+def test_get_org_teams_access_follows_nested_pages(gh):
+    """Team members not fitting in the first query are retrieved per team"""
+    def responder(query, variables):
+        if "team(slug" in query:
+            assert variables == dict(org="ORG", slug="team1", cursor="m1")
+            return dict(organization=dict(team=dict(members=page([
+                dict(role="MEMBER", node=dict(login="member2")),
+            ]))))
+        return dict(organization=dict(teams=page([dict(
+            slug="team1",
+            members=page([dict(role="MAINTAINER", node=dict(login="member1"))],
+                         cursor="m1"),
+            repositories=page([
+                dict(permission="WRITE", node=dict(name="repo1")),
+                dict(permission="ADMIN", node=dict(name="repo2")),
+            ]),
+        )], key="nodes")))
+
+    with requests_mock.Mocker() as mock:
+        register_graphql(mock, responder)
+        assert graphql.get_org_teams_access(gh, "ORG") == {
+            "team1": {
+                "members": {
+                    "member1": {"role": "maintainer"},
+                    "member2": {"role": "member"},
+                },
+                "repositories": {
+                    "repo1": {"permission": "push"},
+                    "repo2": {"permission": "admin"},
+                },
+            }
+        }
+
+
+def test_describe_org_repositories_in_batch(gh):
+    """Repositories are described with the same format as Repo.describe"""
+    def responder(query, variables):
+        assert "r1: repository" in query
+        assert "rebaseMergeAllowed" in query
+        assert variables == dict(owner="ORG", name0="repo1", name1="repo2")
+        repo = dict(
+            labels=page([dict(name="bug", color="ff0000")], key="nodes"),
+            collaborators=page([dict(permission="ADMIN", node=dict(login="mario"))]),
+            rebaseMergeAllowed=False, squashMergeAllowed=True, mergeCommitAllowed=True,
+        )
+        return dict(r0=repo, r1=repo)
+
+    with requests_mock.Mocker() as mock:
+        register_graphql(mock, responder)
+        mock.register_uri("GET", os.path.join(github_helper.DEFAULT_API_URL, "orgs/ORG/repos"),
+                          json=[dict(name="repo1", private=False, owner={}),
+                                dict(name="repo2", private=True),
+                                dict(name="other", private=True)])
+        result = graphql.describe_org_repositories(
+            gh, "ORG", ["repo1", "repo2"], sections=["options", "labels", "collaborators"])
+        assert mock.call_count == 2
+        merge_options = dict(allow_rebase_merge=False, allow_squash_merge=True,
+                             allow_merge_commit=True)
+        assert result["repo1"] == dict(
+            options=dict(merge_options, name="repo1", private=False),
+            labels=dict(bug=dict(color="ff0000")),
+            collaborators=dict(mario=dict(permission="admin")),
+        )
+        assert result["repo2"]["options"] == dict(merge_options, name="repo2", private=True)
+
+
+def test_describe_org_repositories_hooks(gh):
+    """Hooks are retrieved per repository, as they are not available in GraphQL"""
+    with requests_mock.Mocker() as mock:
+        for name in ["a", "b"]:
+            url = os.path.join(github_helper.DEFAULT_API_URL, "repos/ORG", name, "hooks")
+            mock.register_uri("GET", url, json=[dict(name=name, id=1, active=True)])
+        result = graphql.describe_org_repositories(gh, "ORG", ["a", "b"], sections=["hooks"],
+                                                   max_workers=2)
+        assert mock.call_count == 2
+        assert result == dict(a=dict(hooks=[dict(name="a", active=True)]),
+                              b=dict(hooks=[dict(name="b", active=True)]))
+
+
+def test_describe_org_repositories_splits_batches(gh):
+    """Only batch_size repositories are requested on each query"""
+    def responder(_, variables):
+        return {"r{}".format(i): dict(labels=page([], key="nodes"))
+                for i in range(len(variables) - 1)}
+
+    with requests_mock.Mocker() as mock:
+        register_graphql(mock, responder)
+        result = graphql.describe_org_repositories(
+            gh, "ORG", ["a", "b", "c"], sections=["labels"], batch_size=2)
+        assert mock.call_count == 2
+        assert result == dict(a=dict(labels={}), b=dict(labels={}), c=dict(labels={}))
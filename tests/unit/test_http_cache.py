@@ -0,0 +1,79 @@
+"""Validates functionality on the http_cache module
+
+Responses are generated with `requests_mock` to exercise the cache as github_helper does.
+"""
+import os
+
+import pytest
+import requests
+import requests_mock
+
+from dothub.http_cache import HttpCache
+
+
+# #######
+# HELPERS
+# #######
+
+def make_response(body, **headers):
+    """Sends a request to a mocked url to build a real response"""
+    with requests_mock.Mocker() as mock:
+        mock.register_uri("GET", "https://api.github.com/url", text=body, headers=headers)
+        return requests.get("https://api.github.com/url")
+
+
+# ########
+# FIXTURES
+# ########
+
+@pytest.fixture
+def cache(tmpdir):
+    """Gives an instance of the cache in a temporary folder"""
+    return HttpCache(str(tmpdir.join("cache")))
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_get_missing_entry(cache):
+    """Retrieving an entry not in the cache returns None"""
+    assert cache.get("key") is None
+
+
+def test_store_and_get_entry(cache):
+    """An stored response can be retrieved with its validators"""
+    cache.store("key", make_response('{"a": 1}', ETag='"1234"'))
+    entry = cache.get("key")
+    assert entry["body"] == '{"a": 1}'
+    assert cache.conditional_headers(entry) == {"If-None-Match": '"1234"'}
+
+
+def test_last_modified_is_used_as_validator(cache):
+    """Responses with Last-Modified are sent with If-Modified-Since"""
+    date = "Thu, 05 Jul 2012 15:31:30 GMT"
+    cache.store("key", make_response("{}", **{"Last-Modified": date}))
+    entry = cache.get("key")
+    assert cache.conditional_headers(entry) == {"If-Modified-Since": date}
+
+
+def test_responses_without_validators_are_not_stored(cache):
+    """Responses that cannot be validated are not cached"""
+    cache.store("key", make_response("{}"))
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    """When the cache grows over the max size the oldest entries are removed"""
+    cache.store("old", make_response("[]", ETag="1"))
+    cache.store("new", make_response("[]", ETag="2"))
+    old_path = cache._path("old")
+    os.utime(old_path, (0, 0))
+    os.utime(cache._path("new"), (1, 1))
+    cache.max_size = os.path.getsize(old_path) + 1
+
+    cache.store("newer", make_response("[]", ETag="3"))
+
+    assert cache.get("old") is None
+    assert cache.get("new") is None
+    assert cache.get("newer") is not None
@@ -0,0 +1,35 @@
+"""Validates functionality on the identity module"""
+from mock import Mock
+
+from dothub.identity import IdentityIndex, hook_name
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_hook_name():
+    """Web hooks are identified by their url, the rest by their name"""
+    assert hook_name(dict(name="web", config=dict(url="http://hook"))) == "http://hook"
+    assert hook_name(dict(name="travis", config=dict())) == "travis"
+
+
+def test_captured_sections_are_not_loaded():
+    """The loader is only used for sections not captured"""
+    index = IdentityIndex()
+    index.capture("hooks", {"travis": dict(id=1)})
+    loader = Mock()
+
+    assert index.section("hooks", loader) == {"travis": dict(id=1)}
+    assert not loader.called
+    assert "hooks" in index
+
+
+def test_missing_sections_are_loaded_once():
+    """The identities loaded are captured for the next calls"""
+    index = IdentityIndex()
+    loader = Mock(return_value={"devs": dict(id=2, slug="devs")})
+
+    assert index.section("teams", loader) == {"devs": dict(id=2, slug="devs")}
+    assert index.section("teams", loader) == {"devs": dict(id=2, slug="devs")}
+    loader.assert_called_once_with()
@@ -0,0 +1,56 @@
+"""Validates functionality on the metrics module"""
+from dothub import metrics
+
+
+def test_endpoint_template_for_repo_urls():
+    """Repo identifiers are replaced by placeholders"""
+    template = metrics.endpoint_template("/repos/mario/dothub/labels/bug")
+    assert template == "/repos/{owner}/{repo}/labels/{name}"
+
+
+def test_endpoint_template_for_team_repos():
+    """Nested repos within teams are replaced as well"""
+    template = metrics.endpoint_template("/teams/1234/repos/org/dothub")
+    assert template == "/teams/{team_id}/repos/{owner}/{repo}"
+
+
+def test_endpoint_template_for_listings():
+    """Listings are kept as they are, without query"""
+    assert metrics.endpoint_template("/orgs/org/repos?page=2") == "/orgs/{org}/repos"
+
+
+def test_percentile():
+    """Percentiles use the nearest rank"""
+    values = list(range(1, 101))
+    assert metrics.percentile(values, 50) == 50
+    assert metrics.percentile(values, 99) == 99
+    assert metrics.percentile([], 50) is None
+
+
+def test_summary_groups_by_endpoint():
+    """Requests to the same endpoint template are aggregated"""
+    request_metrics = metrics.RequestMetrics(clock=lambda: 0)
+    request_metrics.record("get", "/repos/o/a/labels", 200, 0.1, 10)
+    request_metrics.record("get", "/repos/o/b/labels", 200, 0.3, 20, retries=1)
+    request_metrics.record("delete", "/repos/o/a/labels/bug", None, 0.2, 0)
+
+    summary = request_metrics.summary()
+
+    assert summary["requests"] == 3
+    assert summary["bytes"] == 30
+    assert summary["retries"] == 1
+    labels = summary["endpoints"][0]
+    assert labels["endpoint"] == "/repos/{owner}/{repo}/labels"
+    assert labels["count"] == 2
+    assert labels["p50"] == 0.1
+    assert labels["p99"] == 0.3
+    assert labels["statuses"] == {"200": 2}
+    assert summary["endpoints"][1]["statuses"] == {"error": 1}
+    assert "/repos/{owner}/{repo}/labels" in metrics.format_summary(summary)
+
+
+def test_format_concurrency_over_time():
+    """The reads allowed in flight over time are reported"""
+    summary = metrics.RequestMetrics(clock=lambda: 0).summary()
+    summary["concurrency"] = [[0.0, 4], [1.5, 5], [2.25, 2]]
+    assert "concurrency: 4 at 0.0s -> 5 at 1.5s -> 2 at 2.2s" in metrics.format_summary(summary)
@@ -12,10 +12,11 @@ at requests level by using requests_mock.
 import pytest
 import requests_mock
 import os.path
-from mock import Mock, ANY
+from mock import Mock, ANY, patch
 
 from dothub import github_helper
 from dothub.organization import Organization
+from dothub.plan import PlanError
 
 
 # ################
@@ -59,24 +60,28 @@ def add_org_options(mock, value):
 def add_org_members(mock, values):
     """Add members for an organization
 
-    This method fills two end points. Members and memberships
+    This method fills the listings of members filtered by each role
 
-    The values passed is an array of dictionaries with login as key and the value
-    will be used to fill an entry on the membership endpoint
+    The values passed is a dict with login as key and the membership
+    (with the role) as value
     """
-    url = os.path.join("orgs", ORG_NAME, "members")
-    members_response = [dict(login=member) for member in values]
-    register_uri(mock, "GET", url=url, json=members_response)
-    for name, membership in values.items():
-        ms_url = os.path.join("orgs", ORG_NAME, "memberships", name)
-        register_uri(mock, "GET", url=ms_url, json=membership)
+    add_members_by_role(mock, os.path.join("orgs", ORG_NAME, "members"), values,
+                        ["admin", "member"])
+
+
+def add_members_by_role(mock, url, values, roles):
+    """Registers the listing of members of each role"""
+    for role in roles:
+        members_response = [dict(login=member) for member, membership in values.items()
+                            if membership["role"] == role]
+        register_uri(mock, "GET", url="{}?role={}".format(url, role), json=members_response)
 
 
 def add_org_teams(mock, values):
     """Add teams for an organization
 
-    This method fills multiple end points. Teams and its child endpoints (member,
-     repo, membership, etc.)
+    This method fills multiple end points. Teams and its child endpoints (members
+     by role, repos, etc.)
     """
     teams = []
     for team in values:
@@ -85,14 +90,8 @@ def add_org_teams(mock, values):
         members = team.pop("members")
         repositories = team.pop("repositories")
 
-        register_uri(mock, "GET", url=os.path.join(team_url, "members"),
-                     json=[dict(login=member) for member in members])
-        for username, data in members.items():
-            register_uri(
-                mock, "GET",
-                url=os.path.join(team_url, "memberships", username),
-                json=data
-            )
+        add_members_by_role(mock, os.path.join(team_url, "members"), members,
+                            ["maintainer", "member"])
 
         register_uri(mock, "GET", url=os.path.join(team_url, "repos"),
                      json=list(repositories.values()))
@@ -156,7 +155,7 @@ class DF(object):
     @staticmethod
     def members():
         return dict(
-            member1=dict(role="owner"),
+            member1=dict(role="admin"),
             member2=dict(role="member"),
         )
 
@@ -270,7 +269,7 @@ def test_get_members(org):
         add_org_members(mock, DF.members())
         assert org.members == dict(
             member1=dict(
-                role="owner"
+                role="admin"
             ),
             member2=dict(
                 role="member"
@@ -285,7 +284,7 @@ def test_set_members_without_change(org):
         add_org_members(mock, DF.members())
         org.members = dict(
             member1=dict(
-                role="owner"
+                role="admin"
             ),
             member2=dict(
                 role="member"
@@ -301,7 +300,7 @@ def test_set_members_add_one(org):
         allow_org_method(mock, "PUT", "memberships/member3")
         org.members = dict(
             member1=dict(
-                role="owner"
+                role="admin"
             ),
             member2=dict(
                 role="member"
@@ -323,14 +322,14 @@ def test_set_members_update_membership(org):
         allow_org_method(mock, "PUT", "memberships/member2")
         org.members = dict(
             member1=dict(
-                role="owner"
+                role="admin"
             ),
             member2=dict(
-                role="owner"
+                role="admin"
             ),
         )
         org.spy.put.assert_called_once_with(ANY, dict(
-            role="owner",
+            role="admin",
         ))
 
 
@@ -342,7 +341,7 @@ def test_set_members_delete_one(org):
         allow_org_method(mock, "DELETE", "members/member2")
         org.members = dict(
             member1=dict(
-                role="owner"
+                role="admin"
             ),
         )
         org.spy.delete.assert_called_once()
@@ -405,6 +404,20 @@ def test_set_team_delete_one(org):
         org.spy.delete.assert_called_once()
 
 
+def test_set_team_reuses_the_ids_retrieved(org):
+    """The teams are not listed again to find their ids"""
+    with requests_mock.Mocker() as mock:
+        add_org_teams(mock, DF.teams())
+        register_uri(mock, "DELETE", url="teams/team1id")
+
+        org.teams = {}
+
+        teams_url = github_helper.DEFAULT_API_URL + "/orgs/ORG_NAME/teams?per_page=100"
+        assert [r.url for r in mock.request_history].count(teams_url) == 1
+        assert org.identities.section("teams", None) == {
+            "team1": dict(id="team1id", slug=None)}
+
+
 def test_set_team_add_one(org):
     """Adding a team calls multiple endpoints"""
     with requests_mock.Mocker() as mock:
@@ -553,3 +566,133 @@ def test_set_hooks_delete(org):
         org.hooks = []
 
         org.spy.delete.assert_called_once_with(ANY)
+
+
+def test_describe_full_org(org):
+    """Retrieve all the sections of the organization"""
+    with requests_mock.Mocker() as mock:
+        add_org_options(mock, DF.options())
+        add_org_members(mock, DF.members())
+        add_org_teams(mock, DF.teams())
+        add_org_hooks(mock, DF.hooks())
+        result = org.describe()
+        assert set(result) == {"options", "members", "teams", "hooks"}
+        assert result["options"] == DF.options()
+        assert result["members"] == DF.members()
+        assert set(result["teams"]) == {"team1"}
+
+
+def test_describe_uses_a_single_pool(org):
+    """All the sections are retrieved through the threads of the same pool"""
+    with requests_mock.Mocker() as mock, \
+            patch.object(github_helper, "AsyncGitHub",
+                         wraps=github_helper.AsyncGitHub) as async_github:
+        add_org_options(mock, DF.options())
+        add_org_members(mock, DF.members())
+        add_org_teams(mock, DF.teams())
+        add_org_hooks(mock, DF.hooks())
+        org.max_workers = 1
+        assert set(org.describe()["teams"]) == {"team1"}
+    async_github.assert_called_once_with(org.spy, 1)
+
+
+def test_update_org_without_changes_triggers_no_request(org):
+    """Updating the org with its own configuration sends no writes"""
+    with requests_mock.Mocker() as mock:
+        add_org_options(mock, DF.options())
+        add_org_members(mock, DF.members())
+        add_org_teams(mock, DF.teams())
+        add_org_hooks(mock, DF.hooks())
+        org.update(org.describe())
+
+        org.spy.post.assert_not_called()
+        org.spy.patch.assert_not_called()
+        org.spy.put.assert_not_called()
+        org.spy.delete.assert_not_called()
+
+
+def test_get_teams_with_graphql(gh):
+    """Teams retrieved through GraphQL have the same format as with REST"""
+    org = Organization(gh, name=ORG_NAME, use_graphql=True)
+    graphql_data = {"organization": {"teams": {
+        "pageInfo": {"hasNextPage": False, "endCursor": None},
+        "nodes": [{
+            "slug": "team1-slug",
+            "members": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "edges": [{"role": "MAINTAINER", "node": {"login": "member1"}}],
+            },
+            "repositories": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "edges": [{"permission": "READ", "node": {"name": "repo1"}}],
+            },
+        }],
+    }}}
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "POST", url="graphql", json=dict(data=graphql_data))
+        team = DF.teams()[0]
+        team["slug"] = "team1-slug"
+        register_uri(mock, "GET", url="orgs/ORG_NAME/teams", json=[team])
+
+        assert org.teams == {
+            'team1': {
+                'description': 'description1',
+                'members': {'member1': {'role': 'maintainer'}},
+                'permission': 'push',
+                'privacy': 'closed',
+                'repositories': {'repo1': {'permission': 'pull'}},
+            }
+        }
+
+
+def test_plan_new_team_references_its_id(org):
+    """Mutations on a team being created reference the id returned on creation"""
+    with requests_mock.Mocker() as mock:
+        add_org_teams(mock, DF.teams())
+        new_team = dict(description="", permission="pull", privacy="closed",
+                        members={"member2": dict(role="member")}, repositories={})
+
+        mutations = org.plan_teams({}, {"team2": new_team})
+
+        assert [(m.method, m.url, m.ref) for m in mutations] == [
+            ("post", "orgs/ORG_NAME/teams", "team:team2"),
+            ("put", "teams/{team:team2}/members/member2", None),
+        ]
+        assert "members" in new_team  # The new config is not modified
+        assert mutations[1].after == ("orgs/ORG_NAME/memberships/member2",)
+
+
+def test_plan_members_removed_from_org_and_team(org):
+    """Members leaving the org are not removed from its teams separately"""
+    with requests_mock.Mocker() as mock:
+        add_org_teams(mock, DF.teams())
+        current = dict(members=DF.members(), teams=org.teams)
+        new = dict(members=DF.members(), teams=org.teams)
+        del new["members"]["member2"]
+        del new["teams"]["team1"]["members"]["member2"]
+
+        plan = org.plan(current, new)
+
+        assert [(m.method, m.url) for m in plan] == [
+            ("delete", "orgs/ORG_NAME/members/member2"),
+        ]
+
+
+def test_apply_collects_failures(org):
+    """A change failing does not prevent the independent ones from being applied"""
+    with requests_mock.Mocker() as mock:
+        register_uri(mock, "PUT", url="orgs/ORG_NAME/memberships/member1", status_code=500)
+        register_uri(mock, "PUT", url="orgs/ORG_NAME/memberships/member2", json={})
+        register_uri(mock, "PUT", url="teams/1/members/member1", json={})
+        plan = org.plan({"members": {}}, {"members": {
+            "member1": dict(role="member"), "member2": dict(role="member")}})
+        plan.add("put", "teams/1/members/member1", dict(role="member"),
+                 after=["orgs/ORG_NAME/memberships/member1"])
+
+        with pytest.raises(PlanError) as exc:
+            org.apply(plan)
+
+        result = exc.value.result
+        assert [m.url for m, _ in result.failed] == ["orgs/ORG_NAME/memberships/member1"]
+        assert [m.url for m in result.skipped] == ["teams/1/members/member1"]
+        assert [m.url for m in result.applied] == ["orgs/ORG_NAME/memberships/member2"]
@@ -0,0 +1,176 @@
+"""Validates functionality on the plan module"""
+import pytest
+import requests
+from mock import Mock
+
+from dothub.github_helper import AsyncGitHub
+from dothub.plan import Mutation, Plan
+
+
+# ##########
+# TEST CASES
+# ##########
+
+def test_empty_plan():
+    """An empty plan is falsy and sends nothing"""
+    github = Mock()
+    plan = Plan()
+    assert not plan
+    plan.apply(github)
+    assert not github.mock_calls
+
+
+def test_apply_sends_mutations_in_order():
+    """Mutations are sent in order with their payload"""
+    github = Mock()
+    plan = Plan()
+    plan.add("post", "repos/o/r/labels", dict(name="bug"))
+    plan.add("delete", "repos/o/r/labels/old")
+
+    plan.apply(github)
+    assert github.mock_calls == [
+        ("post", ("repos/o/r/labels", dict(name="bug")), {}),
+        ("delete", ("repos/o/r/labels/old",), {}),
+    ]
+
+
+def test_references_to_created_resources():
+    """Urls can reference the id of resources created by previous mutations"""
+    github = Mock()
+    github.post.return_value = dict(id=42)
+    plan = Plan()
+    plan.add("post", "orgs/o/teams", dict(name="team"), ref="team:team")
+    plan.add("put", "teams/{team:team}/members/mario", dict(role="member"))
+
+    plan.apply(github)
+    github.put.assert_called_once_with("teams/42/members/mario", dict(role="member"))
+
+
+def test_by_section_keeps_order():
+    """Plans can be split per section keeping the order within each section"""
+    plan = Plan([
+        Mutation("post", "a", section="labels"),
+        Mutation("put", "b", section="hooks"),
+        Mutation("delete", "c", section="labels"),
+    ])
+    sections = plan.by_section()
+    assert list(sections) == ["labels", "hooks"]
+    assert [m.url for m in sections["labels"]] == ["a", "c"]
+
+
+def test_mutation_description():
+    """Mutations are described by their description or method and url"""
+    assert str(Mutation("delete", "repos/o/r/labels/bug")) == "DELETE repos/o/r/labels/bug"
+    assert str(Mutation("delete", "url", description="Delete bug")) == "Delete bug"
+
+
+def test_save_and_load(tmpdir):
+    """Plans can be saved to a file and loaded back"""
+    path = str(tmpdir.join("plan.json"))
+    plan = Plan(target="org/repo", validators={"url": dict(fields=["a"], etag=None,
+                                                           fingerprint="1234")})
+    plan.add("post", "orgs/o/teams", dict(name="team"), "teams", "Create team", "team:team")
+    plan.save(path)
+
+    loaded = Plan.load(path)
+    assert loaded.mutations == plan.mutations
+    assert loaded.target == plan.target
+    assert loaded.validators == plan.validators
+
+
+def test_load_unknown_format(tmpdir):
+    """Files that are not plans are rejected"""
+    path = tmpdir.join("plan.json")
+    path.write('{"version": 1000}')
+    with pytest.raises(ValueError):
+        Plan.load(str(path))
+
+
+@pytest.mark.parametrize("content", [
+    '{"version": 1}',
+    '{"version": 1, "target": "o/r", "validators": {}, "mutations": [{"url": "a"}]}',
+    '{"version": 1, "target": "o/r", "validators": {}, "mutations": [{"x": 1}]}',
+])
+def test_load_invalid_plan(tmpdir, content):
+    """Plans missing fields or with unknown fields are rejected"""
+    path = tmpdir.join("plan.json")
+    path.write(content)
+    with pytest.raises(ValueError):
+        Plan.load(str(path))
+
+
+def test_stale_resources():
+    """The resources that changed are reported"""
+    github = Mock()
+    github.is_unchanged.side_effect = lambda url, _: url == "unchanged"
+    plan = Plan(validators=dict(unchanged={}, changed={}))
+    assert plan.stale_resources(github) == ["changed"]
+
+
+def test_deleted_resources_are_stale():
+    """Resources that cannot be retrieved anymore are reported as changed"""
+    def is_unchanged(url, _):
+        if url == "deleted":
+            raise requests.HTTPError("404 Client Error: Not Found")
+        return True
+    github = Mock()
+    github.is_unchanged.side_effect = is_unchanged
+    plan = Plan(validators=dict(unchanged={}, deleted={}))
+    assert plan.stale_resources(github) == ["deleted"]
+
+
+def test_dependencies():
+    """Mutations depend on the refs, urls and after urls of previous mutations"""
+    plan = Plan([
+        Mutation("put", "orgs/o/memberships/mario", dict(role="member")),
+        Mutation("post", "orgs/o/teams", dict(name="team"), ref="team:team"),
+        Mutation("put", "teams/{team:team}/repos/o/r", dict(permission="push")),
+        Mutation("put", "teams/{team:team}/members/mario", dict(role="member"),
+                 after=["orgs/o/memberships/mario"]),
+        Mutation("delete", "repos/o/r/collaborators/luigi"),
+        Mutation("put", "repos/o/r/collaborators/luigi", dict(permission="pull")),
+        Mutation("put", "teams/1/members/peach", after=["orgs/o/memberships/peach"]),
+    ])
+    assert plan.dependencies() == [set(), set(), {1}, {0, 1}, set(), {4}, set()]
+
+
+def test_apply_async_resolves_references():
+    """Concurrent plans wait for the resources referenced to be created"""
+    github = Mock()
+    github.post.return_value = dict(id=42)
+    plan = Plan()
+    plan.add("post", "orgs/o/teams", dict(name="team"), ref="team:team")
+    plan.add("put", "teams/{team:team}/members/mario", dict(role="member"))
+    plan.add("put", "teams/{team:team}/repos/o/r", dict(permission="push"))
+
+    with AsyncGitHub(github, max_workers=4) as agh:
+        result = plan.apply_async(agh).result()
+    assert result.ok
+    assert len(result.applied) == 3
+    github.put.assert_any_call("teams/42/members/mario", dict(role="member"))
+    github.put.assert_any_call("teams/42/repos/o/r", dict(permission="push"))
+
+
+def test_apply_async_collects_failures():
+    """A failure only prevents the mutations that depend on it from being sent"""
+    github = Mock()
+    error = RuntimeError("Creation failed")
+    github.post.side_effect = error
+    plan = Plan()
+    plan.add("post", "orgs/o/teams", dict(name="team"), ref="team:team")
+    plan.add("put", "teams/{team:team}/members/mario", dict(role="member"))
+    plan.add("put", "orgs/o/memberships/luigi", dict(role="admin"))
+
+    with AsyncGitHub(github, max_workers=4) as agh:
+        result = plan.apply_async(agh).result()
+    assert not result.ok
+    assert result.failed == [(plan.mutations[0], error)]
+    assert result.skipped == [plan.mutations[1]]
+    assert result.applied == [plan.mutations[2]]
+    github.put.assert_called_once_with("orgs/o/memberships/luigi", dict(role="admin"))
+
+
+def test_apply_async_empty_plan():
+    """Empty plans are resolved right away"""
+    with AsyncGitHub(Mock()) as agh:
+        assert Plan().apply_async(agh).result().ok
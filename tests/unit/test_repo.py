@@ -575,6 +575,34 @@ def test_set_hook_remove_one(repo):
         repo.hooks = hooks
 
 
+def test_set_hooks_reuses_the_ids_retrieved(repo):
+    """The ids of the hooks are captured when retrieving them, not listed again"""
+    with requests_mock.Mocker() as mock:
+        add_repo_hooks(mock, DF.hooks())
+        hooks = DF.hooks()
+        deleted = hooks.pop()
+        for h in hooks:
+            h.pop('id')
+        allow_repo_method(mock, "DELETE", url_extra="hooks/{}".format(deleted["id"]))
+
+        repo.hooks = hooks
+
+        assert [r.method for r in mock.request_history] == ["GET", "DELETE"]
+
+
+def test_plan_hooks_without_ids_captured(repo):
+    """The ids of the hooks are listed if the hooks were not retrieved before"""
+    with requests_mock.Mocker() as mock:
+        add_repo_hooks(mock, DF.hooks())
+        hooks = DF.hooks()
+        deleted = hooks.pop()
+
+        mutations = repo.plan_hooks(DF.hooks(), hooks)
+
+        assert [m.url for m in mutations] == [
+            "repos/{}/{}/hooks/{}".format(REPO_OWNER, REPO_NAME, deleted["id"])]
+
+
 def test_set_hook_update_one(repo):
     with requests_mock.Mocker() as mock:
         add_repo_options(mock, DF.options())
@@ -699,3 +727,24 @@ def test_update_full_repo_partial(repo):
             temp_data = deepcopy(result)
             temp_data.pop(part)
             repo.update(temp_data)
+
+
+def test_apply_plan_sends_no_reads(repo):
+    """Applying a plan sends the planned writes without reading the repo again"""
+    with requests_mock.Mocker() as mock:
+        add_repo_options(mock, DF.options())
+        add_repo_labels(mock, DF.labels())
+        add_repo_collaborators(mock, DF.collaborators())
+        add_repo_hooks(mock, DF.hooks())
+        allow_repo_method(mock, "POST", "labels")
+        current = repo.describe()
+        new = deepcopy(current)
+        new["labels"]["new_label"] = dict(color="000000")
+
+        plan = repo.plan(current, new)
+        assert [str(m) for m in plan] == ["Create label 'new_label'"]
+        repo.spy.reset_mock()
+        repo.apply(plan)
+
+        repo.spy.get.assert_not_called()
+        repo.spy.post.assert_called_once_with(ANY, dict(name="new_label", color="000000"))
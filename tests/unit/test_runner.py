@@ -1,5 +1,12 @@
+import json
+
+import requests_mock
 from click.testing import CliRunner
+from mock import ANY, patch
+from dothub import github_helper, utils
 from dothub.cli import dothub
+from dothub.fake_github import FakeGitHub, FakeGitHubServer, generate_org
+from dothub.repository import Repo
 
 
 base_args = ["--user=xxx", "--token=yyy"]
@@ -22,3 +29,177 @@ def test_dothub_push_help():
     result = runner.invoke(dothub, base_args + ['push', "--help"], obj={})
     assert result.exit_code == 0
 
+
+def test_dothub_negative_write_interval():
+    """Negative intervals are rejected"""
+    runner = CliRunner()
+    result = runner.invoke(dothub, base_args + ["--write_interval", "-1", "pull", "--help"],
+                           obj={})
+    assert result.exit_code == 2
+    assert "Invalid value for" in result.output
+
+
+def test_dothub_closes_the_github_helper(tmpdir):
+    """The threads of the github helper are released when the command ends"""
+    config_file = str(tmpdir.join("config.yml"))
+    with requests_mock.Mocker() as mock, \
+            patch.object(github_helper.GitHub, "close", autospec=True) as close:
+        mock.register_uri("GET", requests_mock.ANY, json=[])
+        mock.register_uri("GET", "https://api.github.com/repos/org/repo", json=dict(name="repo"))
+        args = base_args + ["--no_http_cache", "pull", "org/repo", config_file]
+        result = CliRunner().invoke(dothub, args, obj={})
+    assert result.exit_code == 0, result.output
+    close.assert_called_once_with(ANY)
+
+
+def test_dothub_stats_file(tmpdir):
+    """The summary of the requests is saved when asked for"""
+    stats_file = str(tmpdir.join("stats.json"))
+    config_file = str(tmpdir.join("config.yml"))
+    with requests_mock.Mocker() as mock:
+        mock.register_uri("GET", requests_mock.ANY, json=[])
+        mock.register_uri("GET", "https://api.github.com/repos/org/repo", json=dict(name="repo"))
+        runner = CliRunner()
+        args = base_args + ["--no_http_cache", "--stats_file", stats_file,
+                            "pull", "org/repo", config_file]
+        result = runner.invoke(dothub, args, obj={})
+    assert result.exit_code == 0, result.output
+    with open(stats_file) as f:
+        summary = json.load(f)
+    assert summary["requests"] == 4
+    assert summary["read_cache"] == dict(hits=0, misses=4)
+    assert summary["concurrency"][0] == [0.0, 4]
+
+
+def test_dothub_plan_and_apply(tmpdir):
+    """A saved plan is applied if the resources it depends on did not change"""
+    org = generate_org("fake-org", repos=1)
+    config_file = str(tmpdir.join("config.yml"))
+    plan_file = str(tmpdir.join("plan.json"))
+    utils.serialize_yaml(dict(labels={"new": dict(color="000000")}), config_file)
+    with FakeGitHubServer(FakeGitHub(org)) as server:
+        args = base_args + ["--no_http_cache", "--write_interval", "0",
+                            "--github_base_url", server.url]
+        runner = CliRunner()
+        result = runner.invoke(dothub, args + ["plan", "fake-org/repo0", config_file,
+                                               "-o", plan_file], obj={})
+        assert result.exit_code == 0, result.output
+        assert "Create label 'new'" in result.output
+        assert "new" not in org.repos["repo0"]["labels"]
+
+        result = runner.invoke(dothub, args + ["apply", plan_file], obj={})
+        assert result.exit_code == 0, result.output
+    assert org.repos["repo0"]["labels"] == {"new": "000000"}
+
+
+def test_dothub_apply_plan_unrelated_changes(tmpdir):
+    """Changes to sections the plan does not update do not make it stale"""
+    org = generate_org("fake-org", repos=1)
+    config_file = str(tmpdir.join("config.yml"))
+    plan_file = str(tmpdir.join("plan.json"))
+    utils.serialize_yaml(dict(labels={"new": dict(color="000000")}), config_file)
+    with FakeGitHubServer(FakeGitHub(org)) as server:
+        args = base_args + ["--no_http_cache", "--write_interval", "0",
+                            "--github_base_url", server.url]
+        runner = CliRunner()
+        runner.invoke(dothub, args + ["plan", "fake-org/repo0", config_file,
+                                      "-o", plan_file], obj={})
+        org.repos["repo0"]["collaborators"]["mario"] = "pull"
+
+        result = runner.invoke(dothub, args + ["apply", plan_file], obj={})
+    assert result.exit_code == 0, result.output
+    assert org.repos["repo0"]["labels"] == {"new": "000000"}
+
+
+def test_dothub_apply_stale_plan(tmpdir):
+    """Plans are rejected if the resources they depend on changed"""
+    org = generate_org("fake-org", repos=1)
+    config_file = str(tmpdir.join("config.yml"))
+    plan_file = str(tmpdir.join("plan.json"))
+    utils.serialize_yaml(dict(labels={"new": dict(color="000000")}), config_file)
+    with FakeGitHubServer(FakeGitHub(org)) as server:
+        args = base_args + ["--no_http_cache", "--write_interval", "0",
+                            "--github_base_url", server.url]
+        runner = CliRunner()
+        runner.invoke(dothub, args + ["plan", "fake-org/repo0", config_file,
+                                      "-o", plan_file], obj={})
+        org.repos["repo0"]["labels"]["other"] = "ffffff"
+
+        result = runner.invoke(dothub, args + ["apply", plan_file], obj={})
+    assert result.exit_code != 0
+    assert "repos/fake-org/repo0/labels" in result.output
+    assert "new" not in org.repos["repo0"]["labels"]
+
+
+def test_dothub_bulk_push_with_jobs(tmpdir):
+    """Repos are updated concurrently and the outcome of each one is reported
+
+    Repos failing to be described or updated do not stop the others
+    """
+    org = generate_org("fake-org", repos=4)
+    org.repos["repo0"]["labels"] = {"new": "000000"}
+    config_file = str(tmpdir.join("config.yml"))
+    utils.serialize_yaml(dict(labels={"new": dict(color="000000")}), config_file)
+    apply = Repo.apply
+    describe = Repo.describe
+
+    def fail_repo3(repo, plan):
+        if repo.repository == "repo3":
+            raise RuntimeError("Boom")
+        return apply(repo, plan)
+
+    def fail_repo2(repo):
+        if repo.repository == "repo2":
+            raise RuntimeError()
+        return describe(repo)
+
+    with FakeGitHubServer(FakeGitHub(org)) as server, \
+            patch.object(Repo, "apply", autospec=True, side_effect=fail_repo3), \
+            patch.object(Repo, "describe", autospec=True, side_effect=fail_repo2):
+        args = base_args + ["--no_http_cache", "--write_interval", "0",
+                            "--github_base_url", server.url]
+        result = CliRunner().invoke(dothub, args + ["push", "--bulk", "--jobs", "3",
+                                                    "fake-org/*", config_file],
+                                    input="y\n", obj={})
+
+    assert result.exit_code != 0
+    assert result.output.splitlines()[-5:] == [
+        "repo0: unchanged",
+        "repo1: updated",
+        "repo2: failed (RuntimeError)",
+        "repo3: failed (Boom)",
+        "Error: 2 of 4 repos failed to be updated",
+    ]
+    assert org.repos["repo1"]["labels"] == {"new": "000000"}
+
+
+def test_dothub_bulk_push_groups_identical_changes(tmpdir):
+    """The changes of all repos are shown grouped and confirmed once"""
+    org = generate_org("fake-org", repos=3)
+    org.repos["repo0"]["labels"] = {"new": "000000"}
+    org.repos["repo1"]["labels"] = {"bug": "ff0000"}
+    org.repos["repo2"]["labels"] = {"bug": "ff0000"}
+    config_file = str(tmpdir.join("config.yml"))
+    utils.serialize_yaml(dict(labels={"new": dict(color="000000")}), config_file)
+
+    with FakeGitHubServer(FakeGitHub(org)) as server:
+        args = base_args + ["--no_http_cache", "--write_interval", "0",
+                            "--github_base_url", server.url]
+        result = CliRunner().invoke(dothub, args + ["push", "--bulk", "--jobs", "2",
+                                                    "fake-org/*", config_file],
+                                    input="n\n", obj={})
+
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[:4] == [
+        "2 repos: repo1, repo2",
+        "  Create label 'new'",
+        "  Delete label 'bug'",
+        "Apply the changes to 2 repos? [Y/n]: n",
+    ]
+    assert lines[-3:] == [
+        "repo0: unchanged",
+        "repo1: skipped (changes not confirmed)",
+        "repo2: skipped (changes not confirmed)",
+    ]
+    assert org.repos["repo1"]["labels"] == {"bug": "ff0000"}
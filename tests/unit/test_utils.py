@@ -1,4 +1,5 @@
 from dothub import utils
+from dothub.plan import Mutation, Plan
 import sealedmock
 
 class StringContains(object):
@@ -102,3 +103,27 @@ def test_output_for_diff_on_web_hooks(mock_confirm, log_info):
 
     assert 1 == mock_confirm.call_count
     log_info.assert_any_call(StringContains("C ", "http://chooserandom.com", "True", "False"))
+
+
+@sealedmock.patch("dothub.utils.click.confirm")
+def test_confirm_changes_with_empty_plan(mock_confirm):
+    mock_confirm.return_value = None
+    mock_confirm.sealed = True
+
+    utils.confirm_changes(dict(options="B"), dict(options="A"), plan=Plan())
+    assert 0 == mock_confirm.call_count
+
+
+@sealedmock.patch("dothub.utils.LOG.info")
+@sealedmock.patch("dothub.utils.click.confirm")
+def test_confirm_changes_shows_plan(mock_confirm, log_info):
+    mock_confirm.return_value = None
+    log_info.return_value = None
+    mock_confirm.sealed = True
+    log_info.sealed = True
+    plan = Plan([Mutation("delete", "repos/o/r/labels/bug", description="Delete label 'bug'")])
+
+    utils.confirm_changes(dict(labels={"bug": {}}), dict(labels={}), plan=plan)
+
+    assert 1 == mock_confirm.call_count
+    log_info.assert_any_call(StringContains("DELETE", "repos/o/r/labels/bug", "Delete label"))